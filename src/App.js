@@ -11,7 +11,6 @@ const App = () => {
     //   command: 'check updates'
     // })
     window.api.receive('fromMain', (event, args) => {
-      console.log('Event received from main', JSON.stringify(event, null, 2))
       if (event && event.length !== 0) {
         if (event[0] === 'checking-for-update') {
           setCheckingForUpdates(true)
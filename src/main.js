@@ -61,42 +61,122 @@ const createWindow = () => {
 // Some APIs can only be used after this event occurs.
 app.on('ready', createWindow);
 
-const runAnalysis = (event, analysis, dirPath, config) => {
+// Long-lived python analysis server ('analyze --serve'), started on first use and kept warm between runs.
+// Requests and responses are JSON lines matched up by id (see python/server.py).
+// Participant results of a run come ahead of its response as {id, results} lines, see python/results.py.
+let analysisServer = null
+let nextJobId = 1
+const pendingJobs = new Map()
+const resultHandlers = new Map()
+// Latest job per folder, so re-running with new parameters cancels the superseded run
+const latestJobForDir = new Map()
+
+const getAnalysisServer = () => {
+  if (analysisServer) {
+    return analysisServer
+  }
+  analysisServer = child_process.spawn(path.join(__dirname, '/python/analyze'), ['--serve'])
+  let buffered = ''
+  analysisServer.stdout.on('data', chunk => {
+    buffered += chunk.toString()
+    let newline = buffered.indexOf('\n')
+    while (newline !== -1) {
+      const line = buffered.slice(0, newline)
+      buffered = buffered.slice(newline + 1)
+      newline = buffered.indexOf('\n')
+      if (!line.trim()) {
+        continue
+      }
+      let output
+      try {
+        output = JSON.parse(line)
+      } catch (err) {
+        console.log(line)
+        continue
+      }
+      if (output.results) {
+        const onResults = resultHandlers.get(output.id)
+        if (onResults) {
+          onResults(output.results)
+        }
+        continue
+      }
+      const handler = pendingJobs.get(output.id)
+      if (handler) {
+        pendingJobs.delete(output.id)
+        resultHandlers.delete(output.id)
+        handler(output)
+      }
+    }
+  })
+  analysisServer.stderr.on('data', chunk => console.log(chunk.toString()))
+  analysisServer.on('exit', code => {
+    // Fail whatever was still running, the next request starts a fresh server
+    analysisServer = null
+    pendingJobs.forEach(handler => handler({error: `Analysis server exited (${code})`}))
+    pendingJobs.clear()
+    resultHandlers.clear()
+  })
+  return analysisServer
+}
+
+const sendToAnalysisServer = (request, handler, onResults) => {
+  const id = String(nextJobId++)
+  if (handler) {
+    pendingJobs.set(id, handler)
+  }
+  if (onResults) {
+    resultHandlers.set(id, onResults)
+  }
+  getAnalysisServer().stdin.write(JSON.stringify({id, ...request}) + '\n')
+  return id
+}
+
+const cancelAnalysis = (jobId) => {
+  if (analysisServer && pendingJobs.has(jobId)) {
+    sendToAnalysisServer({command: 'cancel', job: jobId})
+  }
+}
+
+// Participant results (see python/results.py) are only asked for when the renderer asks for them with
+// 'results' in its toMain message, they are then forwarded as 'results' messages
+const runAnalysis = (event, analysis, dirPath, config, results) => {
   event.sender.send('fromMain', ['dir selected'])
-  console.log(`"${path.join(__dirname, '/python/analyze')}" "${dirPath}" ${analysis} '${JSON.stringify(config)}'`)
-  child_process.exec(`"${path.join(__dirname, '/python/analyze')}" "${dirPath}" ${analysis} '${JSON.stringify(config)}'`, (error, stdout, stderr) => {
-    if (error) {
-      event.sender.send('fromMain', ['error', {message: JSON.stringify(error)}])
+  cancelAnalysis(latestJobForDir.get(dirPath))
+  const request = {command: 'analyze', dir_path: dirPath, analysis, config}
+  if (results) {
+    request.results = results
+  }
+  const jobId = sendToAnalysisServer(request, output => {
+    if (latestJobForDir.get(dirPath) === jobId) {
+      latestJobForDir.delete(dirPath)
     }
-    if (stdout) {
-      // If there is an error in here, handle appropriately, else send back success info
-      if (stdout && JSON.parse(stdout)) {
-        console.log(JSON.parse(stdout))
-        let output = JSON.parse(stdout);
-        if (output.error) {
-          if (output.error === 'Exception(1)') {
-            event.sender.send('fromMain', ['override_phases_duration', {
-              filePaths: [dirPath],
-              command: 'openFilesDialog',
-              analysis,
-              config,
-            }])
-          } else {
-            event.sender.send('fromMain', ['error', {message: JSON.stringify({from: 'python', ...output})}])
-          }
-        } else {
-          event.sender.send('fromMain', ['success', JSON.parse(stdout)])
-        }
+    console.log(output)
+    if (output.cancelled) {
+      return
+    }
+    if (output.error) {
+      if (output.error === 'Exception(1)') {
+        event.sender.send('fromMain', ['override_phases_duration', {
+          filePaths: [dirPath],
+          command: 'openFilesDialog',
+          analysis,
+          config,
+        }])
       } else {
-        console.log(stdout)
-        event.sender.send('fromMain', ['error', stdout])
+        event.sender.send('fromMain', ['error', {message: JSON.stringify({from: 'python', ...output})}])
       }
+    } else {
+      const {id, ...response} = output
+      event.sender.send('fromMain', ['success', response])
     }
-    if (stderr) {
-      console.log(stderr)
-      event.sender.send('fromMain', ['error', {message: JSON.stringify({from: 'python', stderr})}])
+  }, results && (chunk => {
+    // Columnar chunks of typed arrays, rendered as they come in
+    if (latestJobForDir.get(dirPath) === jobId) {
+      event.sender.send('fromMain', ['results', chunk])
     }
-  })
+  }))
+  latestJobForDir.set(dirPath, jobId)
 }
 
 ipcMain.on('toMain', (event, args) => {
@@ -153,6 +233,22 @@ ipcMain.on('toMain', (event, args) => {
   }
 
 
+  if (args.command && args.command === 'cancelAnalysis' && args.dirPath) {
+    cancelAnalysis(latestJobForDir.get(args.dirPath))
+  }
+
+  // Header-only look at a folder (malformed files, missing markers, lists of events) before analyzing it
+  if (args.command && args.command === 'previewFolder' && args.dirPath) {
+    sendToAnalysisServer({command: 'preview', dir_path: args.dirPath}, output => {
+      if (output.error) {
+        event.sender.send('fromMain', ['error', {message: JSON.stringify({from: 'python', ...output})}])
+      } else {
+        const {id, ...response} = output
+        event.sender.send('fromMain', ['preview', response])
+      }
+    })
+  }
+
   if (args.command && args.command === 'open file') {
     child_process.exec(`open "${path.dirname(args.fileName)}"`, (error, stdout, stderr) => {
       if (error) {
@@ -170,7 +266,7 @@ ipcMain.on('toMain', (event, args) => {
       let dirPath = args.filePaths[0];
       const isDirectory = fs.lstatSync(dirPath).isDirectory()
       if (isDirectory) {
-        runAnalysis(event, args.analysis, dirPath, args.config)
+        runAnalysis(event, args.analysis, dirPath, args.config, args.results)
       } else {
         event.sender.send('fromMain', ['error', {
           title: "Upload Folders Only",
@@ -186,7 +282,7 @@ ipcMain.on('toMain', (event, args) => {
 
         if (!dialogResponse.canceled) {
           event.sender.send('fromMain', ['dir selected'])
-          runAnalysis(event, args.analysis, dialogResponse.filePaths[0], args.config)
+          runAnalysis(event, args.analysis, dialogResponse.filePaths[0], args.config, args.results)
         }
       })
         .catch(err => console.log(err))
@@ -199,6 +295,9 @@ ipcMain.on('toMain', (event, args) => {
 // for applications and their menu bar to stay active until the user quits
 // explicitly with Cmd + Q.
 app.on('window-all-closed', () => {
+  if (analysisServer) {
+    analysisServer.stdin.end()
+  }
   if (process.platform !== 'darwin') {
     app.quit();
   }
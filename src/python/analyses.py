@@ -0,0 +1,69 @@
+import os
+from summary import write_summary
+from cue_pairing import write_cue_pairing
+
+# Analysis types the engine can produce, by the name the GUI sends as 'analysis'. Every analysis writes its summary
+# from the same analyzed participants and the same stacked summary model (summary.SummaryModel), so each session
+# file is parsed and binned once however many analyses are asked for. Several are asked for with a comma separated
+# 'targetAltControl,cuePairing' or a list of names; the first one is the run's main out_file.
+#
+# A new analysis subclasses Analysis and is registered with @register. It only writes its summary, anything it
+# needs per participant has to come from the shared analysis (participant.py) so it reaches every load path (cache,
+# incremental manifest, event store, long files).
+
+ANALYSES = {}
+
+
+def register(analysis_class):
+    ANALYSES[analysis_class.name] = analysis_class()
+    return analysis_class
+
+
+# The registered analyses for analysis_type, in the order asked for (each once). Raises ValueError for unknown names
+def resolve(analysis_type):
+    names = analysis_type.split(",") if isinstance(analysis_type, str) else list(analysis_type)
+    resolved = []
+    for name in names:
+        name = name.strip()
+        if name not in ANALYSES:
+            raise ValueError(f"Unknown analysis '{name}', expected one of {', '.join(ANALYSES)}")
+        if ANALYSES[name] not in resolved:
+            resolved.append(ANALYSES[name])
+    return resolved
+
+
+class Analysis:
+    name = None
+    # Folder of the summaries under <dir_path>/out/
+    out_dir = None
+
+    # Writes <out_dir>/<out_file_name>.csv from the model's first group (the participants summarized). When
+    # exclusion_summary is set, the model's second group holds the auto excluded participants. Returns the path.
+    def write(self, model, out_dir, out_file_name, config, exclusion_summary):
+        raise NotImplementedError
+
+
+@register
+class TargetAltControl(Analysis):
+    name = 'targetAltControl'
+    out_dir = "target_alt"
+
+    # The exclusion summary goes next to the main summary, in excluded/
+    def write(self, model, out_dir, out_file_name, config, exclusion_summary):
+        out_path = os.path.join(out_dir, f"{out_file_name}.csv")
+        write_summary(out_path, model.groups[0], model.event_list, config)
+        if exclusion_summary:
+            write_summary(os.path.join(out_dir, "excluded", f"{out_file_name}_excluded.csv"),
+                          model.groups[1], model.event_list, config, exclusion_summary=True)
+        return out_path
+
+
+@register
+class CuePairing(Analysis):
+    name = 'cuePairing'
+    out_dir = "cue_pairing"
+
+    def write(self, model, out_dir, out_file_name, config, exclusion_summary):
+        out_path = os.path.join(out_dir, f"{out_file_name}.csv")
+        write_cue_pairing(out_path, model.groups[0], model.event_list, config)
+        return out_path
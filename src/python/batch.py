@@ -0,0 +1,147 @@
+import os, time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from participant import Participant
+from engine import AnalysisEngine, AnalysisCancelled, session_files, engine_config, load_files
+
+# Batch runs over a tree of session folders (e.g. one folder per study or condition):
+#   python performAnalysisOnFolder.py --batch <root dir, or JSON list of folders> <analysis_type> '<config json>'
+# Every folder under the root that directly holds .csv session files is analyzed into its own out/ summary, like a
+# single run of that folder would. The participants of all folders are scheduled on one shared process pool
+# (config['workers'], 0 or missing for one worker per core), and each folder's summary is written as soon as its
+# last participant is done. The run returns a JSON report with the counts and timings of every folder.
+# Sweep and incremental runs are single folder only.
+
+
+# Folders under root (root included) that directly hold session files, skipping the out/ folders of earlier runs
+def find_session_folders(root):
+    folders = []
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names[:] = sorted(name for name in dir_names if name != "out")
+        if any(os.path.splitext(file_name)[1] == ".csv" for file_name in file_names):
+            folders.append(dir_path)
+    return folders
+
+
+# Worker side: analyzes a run of files of one folder, reading them ahead (see read_ahead.py).
+# Returns (participants, seconds spent)
+def analyze_files(dir_path, file_paths, config):
+    start = time.perf_counter()
+    participants = load_files(Participant, dir_path, file_paths, config)
+    return participants, time.perf_counter() - start
+
+
+# One folder of the batch while its participants come in
+class BatchFolder:
+    def __init__(self, dir_path):
+        self.dir_path = dir_path
+        self.files = session_files(dir_path)
+        self.participants = [None] * len(self.files)
+        self.chunks_left = 0
+        self.analysis_duration = 0.0
+        self.error = None
+
+
+def run_batch(folders, analysis_type, config, is_cancelled=None):
+    if 'sweep' in config or config.get('incremental'):
+        raise ValueError("Batch runs don't support 'sweep' or 'incremental'")
+
+    start = time.time()
+    folders = [BatchFolder(dir_path) for dir_path in folders]
+    worker_config = engine_config(config)
+    workers = config.get('workers', 0) or os.cpu_count() or 1
+
+    # Each chunk is a run of files from one folder, so a folder is done when all of its chunks are
+    total_files = sum(len(folder.files) for folder in folders)
+    chunksize = max(1, total_files // (workers * 4))
+    chunks = []
+    for folder in folders:
+        for offset in range(0, len(folder.files), chunksize):
+            chunks.append((folder, offset, folder.files[offset:offset + chunksize]))
+            folder.chunks_left += 1
+
+    reports = {}
+
+    def chunk_done(folder, offset, result):
+        if folder.error is None:
+            participants, duration = result
+            folder.participants[offset:offset + len(participants)] = participants
+            folder.analysis_duration += duration
+        folder.chunks_left -= 1
+        if folder.chunks_left == 0:
+            reports[folder.dir_path] = finish_folder(folder, analysis_type, config, is_cancelled, start)
+
+    for folder in folders:
+        if not folder.files:
+            reports[folder.dir_path] = {"dir_path": folder.dir_path, "error": "No session files"}
+
+    if workers <= 1:
+        for (folder, offset, file_paths) in chunks:
+            if is_cancelled is not None and is_cancelled():
+                raise AnalysisCancelled()
+            try:
+                result = analyze_files(folder.dir_path, file_paths, worker_config)
+            except Exception as err:
+                folder.error, result = err, None
+            chunk_done(folder, offset, result)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        try:
+            pending = {executor.submit(analyze_files, folder.dir_path, file_paths, worker_config): (folder, offset)
+                       for (folder, offset, file_paths) in chunks}
+            while pending:
+                done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                if is_cancelled is not None and is_cancelled():
+                    raise AnalysisCancelled()
+                for future in done:
+                    folder, offset = pending.pop(future)
+                    if future.exception() is not None and folder.error is None:
+                        folder.error = future.exception()
+                    chunk_done(folder, offset, None if folder.error is not None else future.result())
+        finally:
+            # On cancellation, drop the chunks that haven't started instead of waiting for them
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    folder_reports = [reports[folder.dir_path] for folder in folders]
+    failed = [report for report in folder_reports if "error" in report]
+    return {
+        "message": "Done",
+        "folders": folder_reports,
+        "folders_processed": len(folder_reports) - len(failed),
+        "folders_failed": len(failed),
+        "files_processed": sum(report.get("files_processed", 0) for report in folder_reports),
+        "duration": round(time.time() - start, 4),
+    }
+
+
+# Writes the summary of a folder whose participants are all analyzed, and returns its report entry.
+# A folder that fails is reported with its error instead of stopping the batch.
+def finish_folder(folder, analysis_type, config, is_cancelled, batch_start):
+    report = {"dir_path": folder.dir_path, "files": len(folder.files),
+              "analysis_duration": round(folder.analysis_duration, 4)}
+    if folder.error is None:
+        summary_start = time.time()
+        try:
+            engine = AnalysisEngine(folder.dir_path, config, is_cancelled, participants=folder.participants)
+            engine.produce_summary(analysis_type)
+        except AnalysisCancelled:
+            raise
+        except Exception as err:
+            folder.error = err
+        else:
+            report.update({
+                "files_processed": engine.files_processed,
+                "excluded": int(len(engine.excluded_participants)),
+                "out_file": engine.out_path,
+                "summary_duration": round(time.time() - summary_start, 4),
+            })
+            if len(engine.out_paths) > 1:
+                report["out_files"] = engine.out_paths
+            if engine.errors:
+                report["errors"] = engine.errors
+    if folder.error is not None:
+        report["error"] = repr(folder.error)
+
+    # Participants are no longer needed once the summary is written
+    folder.participants = None
+    report["finished_after"] = round(time.time() - batch_start, 4)
+    return report
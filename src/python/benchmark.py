@@ -0,0 +1,307 @@
+import os, sys, json, time, shutil, tempfile, tracemalloc
+import numpy as np
+from parsing import read_session, read_session_mapped, parse_session
+from participant import Participant
+from engine import AnalysisEngine, session_files, engine_config, iter_participants, run_analysis
+from synthetic import generate_folder, write_session
+import bootstrap
+
+# Benchmarks parsing the session files of a folder.
+#   python benchmark.py <dir_path>
+# Compares the old line by line parse ('(str, int)' tuple list) against the columnar parser in parsing.py,
+# reporting throughput in MB/s and the memory held by the parsed events of one participant, then the memory an
+# analyzed Participant keeps per session file.
+#
+# Benchmark suite on synthetic session files (see synthetic.py):
+#   python benchmark.py --suite [sizes, e.g. 10,1000,10000] [--json <out_path>]
+# Times parsing, analysis and summary writing separately at each number of participants, reporting files/s and
+# events/s per stage and the peak memory of the whole run. --json also saves the numbers to compare runs.
+#
+# Read-ahead of a folder as if it were on a network share (see read_ahead.py):
+#   python benchmark.py --read-ahead <dir_path> [latency in ms, default 20] [depths, e.g. 0,4,8,16]
+# Loads every participant with each read-ahead depth, with the latency added to every file read.
+#
+# One long synthetic session (about 8 hours at 200 responses/s):
+#   python benchmark.py --long-session [events, default 5000000]
+# Parses it read into one string and memory-mapped (see parsing.read_session_mapped), reporting the time and peak
+# memory of each, then analyzes it as a Participant.
+#
+# Bootstrap confidence intervals (see bootstrap.py) over random per participant results:
+#   python benchmark.py --bootstrap [participants, default 5000] [resamples, default 10000]
+#
+# Check that every analysis screen's config runs (see GUI_CONFIGS):
+#   python benchmark.py --gui-configs
+
+SUITE_SIZES = (10, 1000, 10000)
+SUITE_CONFIG = {'bin_size': 60, 'bin_num_phase_1': 5, 'bin_num_phase_2_max': 5, 'bin_num_phase_3': 5,
+                'auto_exclude': True, 'cache': False}
+STAGES = ('parse', 'analyze', 'summary')
+
+# Binning used for the per participant memory figure, as AnalysisEngine passes it (bin_size in ms)
+MEMORY_CONFIG = {'bin_size': 60000, 'bin_num_phase_1': 5, 'bin_num_phase_2_max': 5, 'bin_num_phase_3': 5,
+                 'cache': False}
+
+
+# The event parse Participant used before parsing.py, kept here as the 'before' reference
+def legacy_read_session(path):
+    with open(path, "r") as file:
+        if file.readline(6) != "Start:":
+            return None
+        current_line = file.readline()
+        while not current_line.startswith("LIST OF EVENTS"):
+            current_line = file.readline()
+        current_line = file.readline()
+        while not current_line == "\n":
+            current_line = file.readline()
+        last_position = file.tell()
+        while ")" not in current_line:
+            current_line = file.readline()
+            last_position = file.tell()
+        file.seek(last_position - len(current_line))
+        return [tuple([event_line.rstrip().split()[0][:-1], int(event_line.rstrip().split()[1])]) for event_line
+                in file.readlines() if (event_line != '\n' and event_line != '' and ")" in event_line)]
+
+
+def time_parser(parse, paths, total_bytes, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path in paths:
+            parse(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, total_bytes / best / 1e6
+
+
+def memory_of(parse, path):
+    tracemalloc.start()
+    result = parse(path)
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return held
+
+
+# Average bytes still held per analyzed participant, once all of them are kept in memory like the engine does
+def participant_memory(dir_path, file_paths, config=MEMORY_CONFIG):
+    tracemalloc.start()
+    participants = [Participant(dir_path, file_path, config) for file_path in file_paths]
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del participants
+    return held / len(file_paths)
+
+
+# Runs parse, analyze and summary writing over a folder one after the other. Returns ({stage: seconds}, events)
+def time_stages(dir_path, config=SUITE_CONFIG):
+    file_paths = session_files(dir_path)
+    timings = {}
+
+    start = time.perf_counter()
+    sessions = [read_session(os.path.join(dir_path, file_path)) for file_path in file_paths]
+    timings['parse'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    participants = [Participant(dir_path, file_path, engine_config(config), session)
+                    for (file_path, session) in zip(file_paths, sessions)]
+    timings['analyze'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    engine = AnalysisEngine(dir_path, config, participants=participants)
+    engine.produce_summary('targetAltControl', 'benchmark')
+    timings['summary'] = time.perf_counter() - start
+
+    return timings, sum(len(codes) for (_, codes, _) in sessions if codes is not None)
+
+
+# Peak traced memory of a whole time_stages() run. Kept apart from the timings, as tracing slows everything down.
+def peak_memory(dir_path, config=SUITE_CONFIG):
+    tracemalloc.start()
+    time_stages(dir_path, config)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def run_suite(sizes=SUITE_SIZES, seed=0):
+    results = []
+    for size in sizes:
+        dir_path = tempfile.mkdtemp(prefix="benchmark_")
+        try:
+            generate_folder(dir_path, size, seed)
+            timings, num_events = time_stages(dir_path)
+            result = {'participants': size, 'events': num_events, 'peak_memory_bytes': peak_memory(dir_path)}
+            for stage in STAGES:
+                result[stage] = {
+                    'seconds': round(timings[stage], 4),
+                    'files_per_sec': round(size / timings[stage], 1),
+                    'events_per_sec': round(num_events / timings[stage], 1),
+                }
+            results.append(result)
+        finally:
+            shutil.rmtree(dir_path, ignore_errors=True)
+    return results
+
+
+def print_suite(results):
+    print(f"{'participants':>12} {'events':>10} {'stage':>8} {'seconds':>9} {'files/s':>10} {'events/s':>12} "
+          f"{'peak MB':>8}")
+    for result in results:
+        for stage in STAGES:
+            print(f"{result['participants']:>12} {result['events']:>10} {stage:>8} {result[stage]['seconds']:>9} "
+                  f"{result[stage]['files_per_sec']:>10} {result[stage]['events_per_sec']:>12} "
+                  f"{round(result['peak_memory_bytes'] / 1e6, 1):>8}")
+
+
+READ_AHEAD_DEPTHS = (0, 4, 8, 16)
+
+
+# Seconds to load every participant of a folder at each read-ahead depth, with latency_ms added to every read
+def time_read_ahead(dir_path, latency_ms=20, depths=READ_AHEAD_DEPTHS, config=SUITE_CONFIG):
+    file_paths = session_files(dir_path)
+    timings = {}
+    for depth in depths:
+        read_config = {**engine_config(config), 'read_ahead': depth, 'read_latency': latency_ms / 1000}
+        start = time.perf_counter()
+        for _ in iter_participants(dir_path, file_paths, read_config):
+            pass
+        timings[depth] = time.perf_counter() - start
+    return timings
+
+
+LONG_SESSION_EVENTS = 5000000
+LONG_SESSION_RATE = 200
+
+
+# Writes a session of about num_events events to a temporary folder and times its parse and analysis
+def long_session(num_events=LONG_SESSION_EVENTS, seed=0):
+    dir_path = tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        path = os.path.join(dir_path, "long.csv")
+        # write_session() draws a response rate of 0.2 to 1.5 times the one given, 0.85 times on average
+        phase_length = int(num_events / (LONG_SESSION_RATE * 0.85) * 1000 / 3)
+        written = write_session(path, np.random.default_rng(seed), (phase_length,) * 3, LONG_SESSION_RATE)
+        print(f"{written} events, {round(os.path.getsize(path) / 1e6, 1)} MB, "
+              f"{round(phase_length * 3 / 3.6e6, 1)} hours")
+
+        def read_whole(session_path):
+            with open(session_path, "r") as session_file:
+                return parse_session(session_file.read())
+
+        for name, parse in (("read whole", read_whole), ("memory-mapped", read_session_mapped)):
+            tracemalloc.start()
+            start = time.perf_counter()
+            session = parse(path)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            events_bytes = session[1].nbytes + session[2].nbytes
+            print(f"{name}: {round(elapsed, 3)} s, {round(len(session[1]) / elapsed / 1e6, 2)} M events/s, "
+                  f"peak {round(peak / 1e6, 1)} MB ({round(events_bytes / 1e6, 1)} MB of events)")
+            del session
+
+        start = time.perf_counter()
+        participant = Participant(dir_path, "long.csv", {**MEMORY_CONFIG, 'bin_size': 60000})
+        print(f"participant: {round(time.perf_counter() - start, 3)} s, phase durations "
+              f"{[round(duration / 3.6e6, 2) for duration in participant.phases_duration]} hours, "
+              f"excluded: {participant.excluded} {participant.exclusion_reason}")
+    finally:
+        shutil.rmtree(dir_path, ignore_errors=True)
+
+
+BOOTSTRAP_PARTICIPANTS = 5000
+BOOTSTRAP_RESAMPLES = 10000
+BOOTSTRAP_EVENTS = 9
+
+
+# Stands in for a summary.SummaryGroup of random results, the bootstrap doesn't look at the participants themselves
+class RandomGroup:
+    def __init__(self, n, rng, num_events=BOOTSTRAP_EVENTS, num_bins=5):
+        self.participants = [None] * n
+        self.counts = rng.poisson(20, size=(n, num_events, 3, num_bins))
+        self.phase_3_latency = np.where(rng.random((n, 4)) < 0.2, -1000, rng.integers(0, 60000, size=(n, 4)))
+        self.first_latency = np.where(rng.random((n, num_events, 3)) < 0.2, np.nan,
+                                      rng.exponential(5000, size=(n, num_events, 3)))
+
+
+# Times the bootstrap of n participants, twice to check that the seeded runs give the same intervals
+def time_bootstrap(n=BOOTSTRAP_PARTICIPANTS, resamples=BOOTSTRAP_RESAMPLES, seed=0):
+    group = RandomGroup(n, np.random.default_rng(seed))
+    event_list = [(str(code), f"Event {code}") for code in range(1, BOOTSTRAP_EVENTS + 1)]
+    config = {**MEMORY_CONFIG, 'bootstrap': {'resamples': resamples, 'seed': seed}}
+    runs = []
+    for _ in range(2):
+        start = time.perf_counter()
+        runs.append(bootstrap.cohort_statistics(group, event_list, config))
+        print(f"{n} participants, {resamples} resamples, {len(runs[-1]) - 3} statistics: "
+              f"{round(time.perf_counter() - start, 3)} s")
+    print(f"reproducible: {runs[0] == runs[1]}")
+
+
+# The configs the analysis screens send (src/screens/), exactly as they send them by default. Keep them in step
+# with the screens: the engine has to run with only these keys.
+GUI_CONFIGS = {
+    'targetAltControl': {'bin_size': 60, 'bin_num_phase_1': 5, 'auto_exclude': True, 'bin_num_phase_2_max': 5,
+                         'bin_num_phase_3': 5},
+    'cuePairing': {'bin_size': 60, 'bin_num_phase_1': 5, 'bin_num_phase_2_max': 5, 'bin_num_phase_3': 5},
+}
+
+
+# Runs every analysis with its screen's config on a small synthetic folder. Raises if one fails or writes nothing
+def check_gui_configs(participants=20, seed=0):
+    dir_path = tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        generate_folder(dir_path, participants, seed)
+        for analysis_type, config in GUI_CONFIGS.items():
+            response = run_analysis(dir_path, analysis_type, dict(config))
+            if not os.path.isfile(response["out_file"]):
+                raise RuntimeError(f"{analysis_type} wrote no summary")
+            print(f"{analysis_type}: {response['files_processed']} files, {response['out_file']}")
+    finally:
+        shutil.rmtree(dir_path, ignore_errors=True)
+
+
+def compare_parsers(dir_path):
+    paths = sorted(os.path.join(dir_path, file_path) for file_path in os.listdir(dir_path)
+                   if os.path.splitext(file_path)[1] == ".csv")
+    total_bytes = sum(os.path.getsize(path) for path in paths)
+    print(f"{len(paths)} files, {round(total_bytes / 1e6, 2)} MB")
+
+    for name, parse in (("before (line by line)", legacy_read_session), ("after (columnar)", read_session)):
+        elapsed, throughput = time_parser(parse, paths, total_bytes)
+        held = memory_of(parse, paths[0])
+        print(f"{name}: {round(elapsed, 4)} s, {round(throughput, 1)} MB/s, "
+              f"{round(held / 1024, 1)} KiB held for {os.path.basename(paths[0])}")
+
+    held = participant_memory(dir_path, [os.path.basename(path) for path in paths])
+    print(f"analyzed participants: {round(held / 1024, 1)} KiB held per participant")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "--suite":
+        arguments = sys.argv[2:]
+        json_path = None
+        if "--json" in arguments:
+            json_path = arguments[arguments.index("--json") + 1]
+            arguments = arguments[:arguments.index("--json")]
+        sizes = [int(size) for size in arguments[0].split(",")] if arguments else SUITE_SIZES
+
+        results = run_suite(sizes)
+        print_suite(results)
+        if json_path is not None:
+            with open(json_path, "w") as json_file:
+                json.dump(results, json_file, indent=2)
+    elif len(sys.argv) > 1 and sys.argv[1] == "--long-session":
+        long_session(int(sys.argv[2]) if len(sys.argv) > 2 else LONG_SESSION_EVENTS)
+    elif len(sys.argv) > 1 and sys.argv[1] == "--gui-configs":
+        check_gui_configs()
+    elif len(sys.argv) > 1 and sys.argv[1] == "--bootstrap":
+        time_bootstrap(int(sys.argv[2]) if len(sys.argv) > 2 else BOOTSTRAP_PARTICIPANTS,
+                       int(sys.argv[3]) if len(sys.argv) > 3 else BOOTSTRAP_RESAMPLES)
+    elif len(sys.argv) > 2 and sys.argv[1] == "--read-ahead":
+        latency = float(sys.argv[3]) if len(sys.argv) > 3 else 20
+        depths = [int(depth) for depth in sys.argv[4].split(",")] if len(sys.argv) > 4 else READ_AHEAD_DEPTHS
+        for depth, seconds in time_read_ahead(str(sys.argv[2]), latency, depths).items():
+            print(f"read-ahead {depth:>3}: {round(seconds, 3)} s")
+    else:
+        compare_parsers(str(sys.argv[1]))
@@ -0,0 +1,173 @@
+import math
+import numpy as np
+from parsing import SessionError
+
+# Event codes that carry meaning for the analysis (everything else is a plain response type)
+TARGET_RESPONSE = 1
+ALT_RESPONSE = 2
+SR_TARGET = 17
+SR_ALT = 18
+END_OF_PHASE_1 = 30
+END_OF_PHASE_2 = 31
+END_OF_SESSION = 99
+
+
+# Everything about one participant's events that does not depend on the bin size or bin counts:
+# the phase of each event, which events are counted, and their distance to the end/start of their phase.
+# Computed once by segment_events() and binned (possibly several times, see Participant.rebinned) by count_bins().
+# Only the events that get counted are kept.
+class PhaseSegments:
+    def __init__(self, event_index, phase, distance, first_sr_phase):
+        self.event_index = event_index  # Event code - 1
+        self.phase = phase
+        # Time till the end of the phase for phases 1 and 2 (binned backward), time since its start for phase 3
+        self.distance = distance
+        # Phase of the first SR, None if it never came (or the participant had no phase 1)
+        self.first_sr_phase = first_sr_phase
+        # Time from the start of phase 2 to the 31 marker, used for bin_phase_2
+        self.phase_2_length = None
+        self.phase_3_latency = [-1000, -1000, -1000, -1000]
+        self.event_99_detected = False
+        # First event of each (code, phase): its code, phase and time since the start of the phase
+        self.first_codes = None
+        self.first_phases = None
+        self.first_latencies = None
+
+
+# Splits one participant's events into phases.
+# 'codes' and 'times' must already be sorted by time, with any missing 30/31 markers reconstructed.
+# Nothing is counted before the first SR (unless the participant had no phase 1).
+# phases_duration is filled in place.
+def segment_events(codes, times, phases_offset, phases_duration, no_phase_1):
+    codes = np.asarray(codes)
+    times = np.asarray(times, dtype=np.int64)
+    n = len(codes)
+    positions = np.arange(n)
+
+    # Phase of each event: the starting phase plus the number of 30/31 markers seen before it
+    marker_positions = np.flatnonzero((codes == END_OF_PHASE_1) | (codes == END_OF_PHASE_2))
+    phase = (1 if no_phase_1 else 0) + np.searchsorted(marker_positions, positions, side='left')
+
+    # Counting starts with the first SR, which also marks the start of phase 1
+    if no_phase_1:
+        first_sr = 0
+        reset_positions = marker_positions
+    else:
+        sr_positions = np.flatnonzero((codes == SR_TARGET) | (codes == SR_ALT))
+        first_sr = sr_positions[0] if len(sr_positions) else n
+        reset_positions = np.union1d(sr_positions[:1], marker_positions)
+
+    # Start time of the phase each event falls into (the last reset strictly before the event)
+    last_reset = np.searchsorted(reset_positions, positions, side='left') - 1
+    phase_start = np.where(last_reset >= 0, times[reset_positions[np.maximum(last_reset, 0)]], 0)
+
+    # Raises IndexError for a participant that runs past phase 3, like the per-event loop did
+    time_till_phase_end = np.asarray(phases_offset)[phase] - times
+    time_since_phase_begin = times - phase_start
+
+    counted = (positions >= first_sr) & (codes != END_OF_PHASE_1) & (codes != END_OF_PHASE_2) & (
+            codes != END_OF_SESSION)
+    distance = np.where(phase == 2, time_since_phase_begin, time_till_phase_end)
+    first_sr_phase = int(phase[first_sr]) if first_sr < n and not no_phase_1 else None
+    segments = PhaseSegments(codes[counted].astype(np.int64) - 1, phase[counted], distance[counted], first_sr_phase)
+
+    # np.unique returns the first position of every (code, phase) pair
+    _, first = np.unique(codes.astype(np.int64) * 3 + phase, return_index=True)
+    segments.first_codes = codes[first]
+    segments.first_phases = phase[first]
+    segments.first_latencies = time_since_phase_begin[first]
+
+    # Phase durations, the phase 2 length and the 99 marker only depend on the handful of control events
+    current_phase_start_time = 0
+    control_positions = np.union1d(reset_positions, np.flatnonzero(codes == END_OF_SESSION))
+    for position in control_positions:
+        event_type, event_time = codes[position], int(times[position])
+        if position == first_sr and not no_phase_1:
+            current_phase_start_time = event_time
+        if event_type == END_OF_PHASE_1:
+            phases_duration[0] = event_time - current_phase_start_time
+            current_phase_start_time = event_time
+        elif event_type == END_OF_PHASE_2:
+            segments.phase_2_length = event_time - current_phase_start_time
+            phases_duration[1] = event_time - current_phase_start_time
+            current_phase_start_time = event_time
+        elif event_type == END_OF_SESSION:
+            phases_duration[2] = event_time - current_phase_start_time
+            segments.event_99_detected = True
+
+    # Check if phase3 duration was recorded, if not -> set it in accordance of max time
+    if phases_duration[2] == 0:
+        phases_duration[2] = phases_offset[2] - current_phase_start_time
+
+    # First target/alt latency in phase 3 (recorded even before the first SR)
+    for slot, event_type in enumerate((TARGET_RESPONSE, ALT_RESPONSE)):
+        hits = np.flatnonzero((codes == event_type) & (phase == 2))
+        if len(hits):
+            segments.phase_3_latency[slot] = int(time_since_phase_begin[hits[0]])
+
+    return segments
+
+
+# Bins a participant needs per phase: the most any phase is configured with. However long a phase runs, only its
+# configured bins are written to the summary, so events binned past them are dropped by count_bins().
+def bins_needed(config):
+    return max(config['bin_num_phase_1'], config['bin_num_phase_2_max'], config['bin_num_phase_3'])
+
+
+# Smallest integer dtype that can hold counts up to max_count
+def count_dtype(max_count):
+    for dtype in (np.int8, np.int16, np.int32):
+        if max_count <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+# Bins the segmented events into type_response (in place): phases 1 and 2 backward from the end of the phase,
+# phase 3 forward from its start. Returns bin_phase_2
+# 'responses' (optional, one entry per event code - 1) is added the number of binned events of each type, those in
+# bins past the configured ones included.
+def count_bins(segments, type_response, config, responses=None):
+    bin_size = config['bin_size']
+    phase = segments.phase
+    forward = phase == 2
+
+    # Bin index (0-based) of every counted event. Integer division matches floor(distance / bin_size) exactly
+    # for whole millisecond bin sizes and distances, and is cheaper. Distances are floats when the GUI's
+    # phases_duration override has a fractional value.
+    if float(bin_size).is_integer() and segments.distance.dtype.kind in 'iu':
+        whole_bins = segments.distance // int(bin_size)
+    else:
+        whole_bins = np.floor(segments.distance / bin_size).astype(np.int64)
+    bins_per_phase = np.array([config['bin_num_phase_1'], config['bin_num_phase_2_max'], 0], dtype=np.int64)
+    bins = np.where(forward, whole_bins, bins_per_phase[phase] - whole_bins - 1)
+    # Backward bins that fall before the first configured bin are dropped
+    kept = forward | (bins >= 0)
+
+    event_index = segments.event_index[kept]
+    phase_index = phase[kept]
+    bin_index = bins[kept]
+
+    # The first SR also counts as a target response in the first bin of its phase
+    if segments.first_sr_phase is not None:
+        event_index = np.append(event_index, 0)
+        phase_index = np.append(phase_index, segments.first_sr_phase)
+        bin_index = np.append(bin_index, 0)
+
+    num_types, num_phases, num_bins = type_response.shape
+    unknown = (event_index < 0) | (event_index >= num_types)
+    if unknown.any():
+        raise SessionError(f"Event code {int(event_index[unknown][0]) + 1:02d} not in LIST OF EVENTS")
+    if responses is not None:
+        responses += np.bincount(event_index, minlength=num_types)
+    # Bins past the configured ones (e.g. of a phase 3 running longer than its bins) are never written to the summary
+    if len(bin_index) and bin_index.max() >= num_bins:
+        kept = bin_index < num_bins
+        event_index, phase_index, bin_index = event_index[kept], phase_index[kept], bin_index[kept]
+
+    # Single scatter-add of all counts
+    flat_index = (event_index * num_phases + phase_index) * num_bins + bin_index
+    type_response += np.bincount(flat_index, minlength=type_response.size).reshape(type_response.shape)
+
+    if segments.phase_2_length is None:
+        return None
+    return math.floor(segments.phase_2_length / bin_size)
@@ -0,0 +1,107 @@
+import os, csv, warnings
+import numpy as np
+from summary import phase_3_target_first
+
+# Participant-level bootstrap confidence intervals of cohort outcomes, written by AnalysisEngine when
+# config['bootstrap'] is set (True for the defaults, or {'resamples': ..., 'confidence': ..., 'seed': ...}):
+#   target_first_proportion   share of participants whose first phase 3 response (target vs controls) was the
+#                             target, the summary's "Proportion in Phase 3"
+#   mean_count                mean count per participant, per event, phase and configured bin
+#   phase_3_latency           mean latency of the first phase 3 target / alt response (ms), over the participants
+#                             that had one
+#   first_latency             mean first latency per event and phase (ms, see latency.py), over the participants
+#                             that had one
+# A resample draws as many participants as the cohort has, with replacement. Resamples are drawn as index matrices
+# of BLOCK_RESAMPLES rows, turned into weights (how many times each participant was drawn), so every statistic of a
+# block comes out of one matrix product. Intervals are percentile intervals, and the seeded generator makes a run
+# reproducible.
+
+DEFAULT_RESAMPLES = 2000
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_SEED = 0
+BLOCK_RESAMPLES = 500
+
+STATISTICS_HEADER = ["statistic", "event", "phase", "bin", "estimate", "ci_low", "ci_high"]
+
+
+# (resamples, confidence, seed) of config['bootstrap']
+def options(config):
+    settings = config['bootstrap'] if isinstance(config['bootstrap'], dict) else {}
+    return (settings.get('resamples', DEFAULT_RESAMPLES), settings.get('confidence', DEFAULT_CONFIDENCE),
+            settings.get('seed', DEFAULT_SEED))
+
+
+# (resamples, n) weights of bootstrap resamples of n participants: how many times each participant was drawn
+def resample_weights(n, resamples, rng):
+    indices = rng.integers(0, n, size=(resamples, n))
+    rows = np.arange(resamples)[:, None] * n
+    return np.bincount((rows + indices).ravel(), minlength=resamples * n).reshape(resamples, n)
+
+
+# (resamples, columns) bootstrap means of every column of values (participants, columns). NaN values are left out
+# of their column's mean, a resample without any value in a column gives NaN.
+def bootstrap_means(values, resamples, rng):
+    present = ~np.isnan(values)
+    filled = np.where(present, values, 0.0)
+    means = np.empty((resamples, values.shape[1]))
+    for start in range(0, resamples, BLOCK_RESAMPLES):
+        weights = resample_weights(len(values), min(BLOCK_RESAMPLES, resamples - start), rng).astype(float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means[start:start + len(weights)] = (weights @ filled) / (weights @ present)
+    return means
+
+
+# (estimate, ci_low, ci_high) per column of values, the estimate being the mean over the whole cohort
+def intervals(values, resamples, confidence, seed):
+    means = bootstrap_means(values, resamples, np.random.default_rng(seed))
+    tail = (1 - confidence) / 2 * 100
+    with warnings.catch_warnings():
+        # Columns without any value are all NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        estimate = np.nanmean(values, axis=0)
+        low, high = np.nanpercentile(means, [tail, 100 - tail], axis=0)
+    return estimate, low, high
+
+
+# Rows of the statistics file for one group of participants (summary.SummaryGroup)
+def cohort_statistics(group, event_list, config):
+    resamples, confidence, seed = options(config)
+    bins_per_phase = (config["bin_num_phase_1"], config["bin_num_phase_2_max"], config["bin_num_phase_3"])
+
+    # Every statistic is a column of one (participants, columns) matrix, labelled (statistic, event, phase, bin)
+    target_first, _ = phase_3_target_first(group.phase_3_latency)
+    columns = [target_first.astype(float)[:, None]]
+    labels = [("target_first_proportion", "", 3, "")]
+    for j, (_, event_type) in enumerate(event_list):
+        for phase in [0, 1, 2]:
+            columns.append(group.counts[:, j, phase, 0:bins_per_phase[phase]])
+            labels += [("mean_count", event_type, phase + 1, bin_number + 1)
+                       for bin_number in range(columns[-1].shape[1])]
+
+    phase_3_latency = group.phase_3_latency[:, 0:2].astype(float)
+    phase_3_latency[phase_3_latency == -1000] = np.nan
+    columns.append(phase_3_latency)
+    labels += [("phase_3_latency", "Target Response", 3, ""), ("phase_3_latency", "Alt Response", 3, "")]
+
+    columns.append(group.first_latency.reshape(len(group.participants), -1))
+    labels += [("first_latency", event_type, phase + 1, "") for (_, event_type) in event_list for phase in [0, 1, 2]]
+
+    estimate, low, high = intervals(np.hstack(columns), resamples, confidence, seed)
+    rows = [["participants", "", "", "", len(group.participants), "", ""],
+            ["resamples", "", "", "", resamples, "", ""],
+            ["confidence", "", "", "", confidence, "", ""]]
+    for i, label in enumerate(labels):
+        rows.append(list(label) + [_rounded(estimate[i]), _rounded(low[i]), _rounded(high[i])])
+    return rows
+
+
+def write_statistics(out_path, group, event_list, config):
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with open(out_path, "w+", newline="") as out_file:
+        writer = csv.writer(out_file)
+        writer.writerow(STATISTICS_HEADER)
+        writer.writerows(cohort_statistics(group, event_list, config))
+
+
+def _rounded(value):
+    return "None" if np.isnan(value) else round(float(value), 4)
@@ -0,0 +1,244 @@
+import os, sys, json, shutil, threading
+from collections import OrderedDict
+import numpy as np
+from parsing import SessionHeader, parse_session, read_session, check_size, read_all, MAPPED_MIN_BYTES, MAX_FILE_BYTES
+
+# Cache of parsed session files, kept under <dir_path>/out/.cache/ with one entry per session file.
+# An entry holds the parsed header and the event arrays, and is only used while the session file still has the
+# size and mtime it had when the entry was written, so re-running with new binning parameters skips the parse.
+#
+# Entry layout: MAGIC | uint32 meta length | meta JSON (padded to 8 bytes) | int16 codes | int64 times
+#
+# Config switches:
+#   'cache': False             -> always parse the session files
+#   'clear_cache': True        -> drop every entry before the run
+#   'cache_max_bytes': <int>   -> least recently used entries are evicted past this size (default 1 GB)
+# The cache of a folder can also be cleared from the command line: python cache.py <dir_path> --clear
+#
+# A long-lived process (server.py) can also keep parsed sessions in memory with keep_warm(), validated the same way,
+# least recently used sessions being dropped once their event arrays take more than the given number of bytes.
+
+MAGIC = b"ARCACHE1"
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+
+# In-memory layer: path -> (size, mtime_ns, (header, codes, times), bytes of the arrays), least recently used first
+warm_sessions = None
+warm_max_bytes = 0
+warm_bytes = 0
+warm_lock = threading.Lock()
+
+
+def keep_warm(max_bytes):
+    global warm_sessions, warm_max_bytes, warm_bytes
+    with warm_lock:
+        warm_sessions = OrderedDict()
+        warm_max_bytes = max_bytes
+        warm_bytes = 0
+
+
+def cache_dir(dir_path):
+    return os.path.join(dir_path, "out", ".cache")
+
+
+def entry_path(dir_path, file_path):
+    return os.path.join(cache_dir(dir_path), f"{file_path}.bin")
+
+
+# Returns (header, codes, times) for a session file, from the cache when the entry is still valid
+def load_session(dir_path, file_path, config):
+    return finish_session(dir_path, file_path, config, fetch_session(dir_path, file_path, config))
+
+
+# The I/O half of load_session(), which read_ahead.py runs on its threads: returns (stat, session, text) with the
+# cached session, or the text of the session file when there is no valid entry (or the cache is off). Big session
+# files aren't read here (text is None), finish_session() parses them from a memory map.
+# 'stat' can be passed in when the caller already has it, it only has to be taken before the file is read.
+def fetch_session(dir_path, file_path, config, stat=None):
+    path = os.path.join(dir_path, file_path)
+    if not config.get('cache', True):
+        return None, None, read_text(path, config.get('max_file_bytes', MAX_FILE_BYTES))
+
+    # Stat before reading, so a file modified mid-parse is re-parsed next time
+    stat = os.stat(path) if stat is None else stat
+    session = read_warm(path, stat)
+    if session is None:
+        session = read_entry(entry_path(dir_path, file_path), stat)
+    if session is not None:
+        return stat, session, None
+    return stat, None, read_text(path, config.get('max_file_bytes', MAX_FILE_BYTES))
+
+
+# The CPU half of load_session(): parses what fetch_session() read and caches it
+def finish_session(dir_path, file_path, config, fetched):
+    stat, session, text = fetched
+    path = os.path.join(dir_path, file_path)
+    max_bytes = config.get('max_file_bytes', MAX_FILE_BYTES)
+    if not config.get('cache', True):
+        return parse_session(text) if text is not None else read_session(path, max_bytes)
+
+    if session is None:
+        session = parse_session(text) if text is not None else read_session(path, max_bytes)
+        # Files that don't begin with 'Start:' are cheap to reject and aren't written to disk
+        if session[0] is not None:
+            write_entry(entry_path(dir_path, file_path), stat, *session)
+
+    store_warm(path, stat, session)
+    return session
+
+
+# Text of a session file, None for the files parsing.read_session() maps instead of reading. Raises
+# parsing.SessionError for files over max_bytes or that aren't text
+def read_text(path, max_bytes=MAX_FILE_BYTES):
+    with open(path, "r") as file:
+        size = os.fstat(file.fileno()).st_size
+        check_size(size, max_bytes)
+        if size >= MAPPED_MIN_BYTES:
+            return None
+        return read_all(file)
+
+
+def read_warm(path, stat):
+    if warm_sessions is None:
+        return None
+    with warm_lock:
+        warm = warm_sessions.get(path)
+        if warm is None or warm[0] != stat.st_size or warm[1] != stat.st_mtime_ns:
+            return None
+        warm_sessions.move_to_end(path)
+        return warm[2]
+
+
+def store_warm(path, stat, session):
+    global warm_bytes
+    if warm_sessions is None:
+        return
+    # Shared between runs, so the arrays are made read-only
+    num_bytes = 0
+    for events in session[1:]:
+        if events is not None:
+            events.setflags(write=False)
+            num_bytes += events.nbytes
+    with warm_lock:
+        _drop_warm(path)
+        if num_bytes > warm_max_bytes:
+            return
+        warm_sessions[path] = (stat.st_size, stat.st_mtime_ns, session, num_bytes)
+        warm_bytes += num_bytes
+        while warm_bytes > warm_max_bytes:
+            _drop_warm(next(iter(warm_sessions)))
+
+
+# Drops the in-memory session of path, if any. The warm lock must be held
+def _drop_warm(path):
+    global warm_bytes
+    warm = warm_sessions.pop(path, None)
+    if warm is not None:
+        warm_bytes -= warm[3]
+
+
+# Returns the cached (header, codes, times), or None if the entry is missing, unreadable or stale
+def read_entry(path, stat):
+    try:
+        with open(path, "rb") as entry:
+            data = entry.read()
+    except OSError:
+        return None
+
+    if data[:len(MAGIC)] != MAGIC:
+        return None
+    meta_start = len(MAGIC) + 4
+    meta_length = int.from_bytes(data[len(MAGIC):meta_start], "little")
+    try:
+        meta = json.loads(data[meta_start:meta_start + meta_length])
+    except ValueError:
+        return None
+    if meta['size'] != stat.st_size or meta['mtime_ns'] != stat.st_mtime_ns:
+        return None
+
+    num_events = meta['num_events']
+    codes_start = meta_start + padded(meta_length)
+    times_start = codes_start + padded(2 * num_events)
+    if len(data) != times_start + 8 * num_events:
+        return None
+
+    header = SessionHeader()
+    header.no_phase_1 = meta['no_phase_1']
+    header.sr = meta['sr']
+    header.event_list = meta['event_list']
+    codes = np.frombuffer(data, dtype=np.int16, count=num_events, offset=codes_start).copy()
+    times = np.frombuffer(data, dtype=np.int64, count=num_events, offset=times_start).copy()
+
+    # Touch the entry so eviction drops the least recently used ones first
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return header, codes, times
+
+
+def write_entry(path, stat, header, codes, times):
+    meta = json.dumps({
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'num_events': len(codes),
+        'no_phase_1': header.no_phase_1,
+        'sr': header.sr,
+        'event_list': header.event_list,
+    }).encode()
+    codes = np.ascontiguousarray(codes, dtype=np.int16).tobytes()
+    times = np.ascontiguousarray(times, dtype=np.int64).tobytes()
+
+    # Written to a temporary file first, so a concurrent reader (or a crash) never sees half an entry
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp_path, "wb") as entry:
+            entry.write(MAGIC)
+            entry.write(len(meta).to_bytes(4, "little"))
+            entry.write(meta.ljust(padded(len(meta)), b" "))
+            entry.write(codes.ljust(padded(len(codes)), b"\0"))
+            entry.write(times)
+        os.replace(temp_path, path)
+    except OSError:
+        # The cache is only an optimization, an unwritable study folder still gets analyzed
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+# Removes least recently used entries until the cache is at most max_bytes
+def evict(dir_path, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+    if not os.path.isdir(cache_dir(dir_path)):
+        return
+    entries = [(entry.stat().st_mtime_ns, entry.stat().st_size, entry.path)
+               for entry in os.scandir(cache_dir(dir_path)) if entry.is_file()]
+    total = sum(size for (_, size, _) in entries)
+    for (_, size, path) in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def clear(dir_path):
+    shutil.rmtree(cache_dir(dir_path), ignore_errors=True)
+    if warm_sessions is not None:
+        with warm_lock:
+            for path in [path for path in warm_sessions if os.path.dirname(path) == dir_path]:
+                _drop_warm(path)
+
+
+# Length rounded up to a multiple of 8 bytes, so the arrays that follow in a file can be mapped aligned (also used by
+# event_store.py)
+def padded(length):
+    return (length + 7) // 8 * 8
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[2] == "--clear":
+        clear(str(sys.argv[1]))
+    else:
+        print("usage: python cache.py <dir_path> --clear")
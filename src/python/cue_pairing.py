@@ -0,0 +1,88 @@
+import os, csv
+import numpy as np
+from binning import TARGET_RESPONSE, ALT_RESPONSE, SR_TARGET, SR_ALT
+from latency import event_codes_of, rows_of
+
+# Cue pairing summary: how responding lines up with the cues (reinforcer deliveries, SR Target and SR Alt unless
+# config['cue_codes'] says otherwise) in every bin of every phase. It is written from the binned counts of the
+# summary model (summary.SummaryModel), so it doesn't go over the events again.
+# Like in the target/alt summary, the first SR also counts as a target response in the first bin of its phase.
+
+DEFAULT_CUE_CODES = (SR_TARGET, SR_ALT)
+RESPONSES = ((TARGET_RESPONSE, "Target Responses"), (ALT_RESPONSE, "Alt Responses"))
+
+
+# (participants, 3, bins) counts of a group summed over the given event codes, zeros for codes that aren't listed
+def code_counts(group, event_list, codes):
+    rows = rows_of(np.asarray(codes, dtype=np.int64), event_codes_of(event_list))
+    return group.counts[:, rows >= 0].sum(axis=1)
+
+
+# Responses per cue, NaN where there was no cue
+def responses_per_cue(responses, cues):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(cues > 0, responses / np.maximum(cues, 1), np.nan)
+
+
+def write_cue_pairing(out_path, group, event_list, config):
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    participants = group.participants
+    n = len(participants)
+
+    def label(text):
+        return [text] * n
+
+    def ratio_row(ratios):
+        return ["None" if np.isnan(ratio) else str(round(ratio, 2)) for ratio in ratios.tolist()]
+
+    cues = code_counts(group, event_list, config.get('cue_codes', DEFAULT_CUE_CODES))
+    responses = [(name, code_counts(group, event_list, [code])) for (code, name) in RESPONSES]
+    target = responses[0][1]
+    bins_per_phase = (config["bin_num_phase_1"], config["bin_num_phase_2_max"], config["bin_num_phase_3"])
+
+    with open(out_path, "w+") as out_file:
+        writer = csv.writer(out_file)
+        writer.writerow([part.file_path[:-4] for part in participants])
+        writer.writerow([])
+        writer.writerows([[str(part.sr[i]) if len(part.sr) > i else "no sr info" for part in participants]
+                          for i in range(4)])
+        writer.writerow([])
+        writer.writerow(label("Cut-off?"))
+        writer.writerow([part.exclusion_reason == "Cut-Off" for part in participants])
+
+        # One row per bin of every series, per phase
+        for phase in [0, 1, 2]:
+            num_bins = bins_per_phase[phase]
+            writer.writerow([])
+            writer.writerow(label(f"Phase {phase + 1}"))
+            writer.writerow(label("Cues"))
+            writer.writerows(cues[:, phase, 0:num_bins].T.tolist())
+            for (name, counts) in responses:
+                writer.writerow(label(name))
+                writer.writerows(counts[:, phase, 0:num_bins].T.tolist())
+            writer.writerow(label("Target Responses per Cue"))
+            writer.writerows([ratio_row(responses_per_cue(target[:, phase, bin_number], cues[:, phase, bin_number]))
+                              for bin_number in range(num_bins)])
+
+        # Whole phases, over the configured bins
+        writer.writerow([])
+        writer.writerow(label("Phase Totals"))
+        for phase in [0, 1, 2]:
+            num_bins = bins_per_phase[phase]
+            phase_cues = cues[:, phase, 0:num_bins].sum(axis=1)
+            writer.writerow(label(f"Phase {phase + 1}"))
+            writer.writerow(label("Cues"))
+            writer.writerow(phase_cues.tolist())
+            for (name, counts) in responses:
+                writer.writerow(label(name))
+                writer.writerow(counts[:, phase, 0:num_bins].sum(axis=1).tolist())
+            writer.writerow(label("Target Responses per Cue"))
+            writer.writerow(ratio_row(responses_per_cue(target[:, phase, 0:num_bins].sum(axis=1), phase_cues)))
+
+        writer.writerow([])
+        writer.writerow(label("Phase Durations"))
+        for phase in [0, 1, 2]:
+            writer.writerow(label(f"Phase {phase + 1}"))
+            writer.writerow([str(round(duration / 1000.0, 2)) for duration in group.phases_duration[:, phase].tolist()])
+        writer.writerow(label("99)"))
+        writer.writerow(["OK" if part.event_99_detected else "Miss" for part in participants])
@@ -1,46 +1,448 @@
-import os, json, csv, math
-import numpy as np
+import os, csv, time, signal, threading, cProfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from participant import Participant
-
-latency_events = {
-    1: "Target Response",
-    2: "Alt Response",
-}
+from manifest import StoredParticipant
+from summary import SummaryModel
+from sweep import SweepPoint
+from long_format import LongWriter, read_long
+from preview import SessionPreview
+from binning import END_OF_PHASE_1, END_OF_PHASE_2, END_OF_SESSION
+import analyses
+import bootstrap
+import cache
+import event_store
+import manifest
+import read_ahead
+import sweep
+import timing
+
+
+# Raised when a run is cancelled through the engine's is_cancelled callback (see server.py)
+class AnalysisCancelled(Exception):
+    pass
+
+
+# Raised in a file's analysis when it takes more than config['file_timeout'] seconds (see _guarded)
+class FileTimeout(Exception):
+    pass
+
+
+# Stands in for the participant of a session file that couldn't be read or analyzed, so one bad file doesn't stop
+# the run. The engine leaves it out of the summaries and lists it in the response's 'errors'.
+class FailedFile:
+    __slots__ = ('dir_path', 'file_path', 'error', 'message')
+
+    def __init__(self, dir_path, file_path, err):
+        self.dir_path = dir_path
+        self.file_path = file_path
+        self.error = type(err).__name__
+        self.message = str(err)
+
+    def to_dict(self):
+        return {'file': self.file_path, 'error': self.error, 'message': self.message}
+
+
+def failed_files(participants):
+    return [participant for participant in participants if isinstance(participant, FailedFile)]
+
+
+# Runs one analysis of a folder and returns the response sent back to the GUI
+# With a results.ResultSender as 'results', every participant's results are sent through it (in participant_files
+# order) before the response is returned, and the response says how many chunks were sent.
+# With config['timings'] the response also carries per stage timings (see timing.py). With config['profile'] the
+# run is profiled with cProfile and the stats are dumped next to the summary as <summary name>.prof (worker
+# processes aren't profiled, run with 'workers': 1 to see the analysis itself).
+def run_analysis(dir_path, analysis_type, config, is_cancelled=None, results=None):
+    if config.get('output') == 'long':
+        return stream_analysis(dir_path, analysis_type, config, is_cancelled)
+
+    profiler = cProfile.Profile() if config.get('profile') else None
+    if profiler is not None:
+        profiler.enable()
+
+    # Get time taken
+    start = time.time()
+    engine = AnalysisEngine(dir_path, config, is_cancelled)
+    engine.produce_summary(analysis_type)
+    end = time.time() - start
+
+    response = summary_response(engine, end)
+    if results is not None:
+        response["result_chunks"] = results.send_participants(engine.all_participants(), engine.event_list,
+                                                              engine.config)
+
+    if engine.clock.stages is not None:
+        response["timings"] = timing.summarize(engine.clock.stages, engine.all_participants(),
+                                               config.get('timings_slowest', timing.DEFAULT_SLOWEST))
+    if profiler is not None:
+        profiler.disable()
+        if engine.out_path is not None:
+            profile_path = f"{os.path.splitext(engine.out_path)[0]}.prof"
+        else:
+            profile_path = os.path.join(dir_path, "out", "analysis.prof")
+        os.makedirs(os.path.dirname(profile_path), exist_ok=True)
+        profiler.dump_stats(profile_path)
+        response["profile"] = profile_path
+    return response
+
+
+# The response of a run whose summaries 'engine' has written, 'duration' seconds after it started
+def summary_response(engine, duration):
+    response = {
+        "message": "Done",
+        "files_processed": engine.files_processed,
+        "duration": round(duration, 4),
+        "out_file": engine.out_path,
+        "excluded": int(len(engine.excluded_participants))
+    }
+    if len(engine.out_paths) > 1:
+        response["out_files"] = engine.out_paths
+    if engine.statistics_paths:
+        response["statistics_files"] = engine.statistics_paths
+    if engine.errors:
+        response["errors"] = engine.errors
+    return response
+
+
+# What the GUI can know about a folder before analyzing it, from the headers of its session files only (see
+# preview.py): one entry per file, and the files grouped by what would need attention
+def preview_folder(dir_path):
+    start = time.time()
+    previews = [SessionPreview(dir_path, file_path) for file_path in session_files(dir_path)]
+    valid = [preview for preview in previews if not (preview.malformed or preview.error)]
+
+    event_lists = []
+    for preview in valid:
+        if preview.event_list not in event_lists:
+            event_lists.append(preview.event_list)
+
+    return {
+        "message": "Done",
+        "files": [preview.to_dict() for preview in previews],
+        "malformed": [preview.file_path for preview in previews if preview.malformed],
+        "errors": {preview.file_path: preview.error for preview in previews if preview.error},
+        "missing_no_phase_1": [preview.file_path for preview in valid if preview.no_phase_1 is None],
+        # A missing 30 or 31 is where the GUI offers the phases duration override
+        "missing_phase_markers": [preview.file_path for preview in valid
+                                  if not (preview.markers[END_OF_PHASE_1] and preview.markers[END_OF_PHASE_2])],
+        "cut_off": [preview.file_path for preview in valid if not preview.markers[END_OF_SESSION]],
+        "event_lists": event_lists,
+        "duration": round(time.time() - start, 4),
+    }
+
+
+# The session files of a folder (not its subfolders), in the order participants are analyzed and summarized
+def session_files(dir_path):
+    return [entry.name for entry in session_entries(dir_path)]
+
+
+# session_files() as os.DirEntry objects, from a single listing of the folder. An entry's stat() is taken once and
+# kept, so the incremental manifest and the cache don't stat the file again.
+def session_entries(dir_path):
+    with os.scandir(dir_path) as entries:
+        sessions = [entry for entry in entries if entry.is_file() and os.path.splitext(entry.name)[1] == ".csv"]
+    return sorted(sessions, key=lambda entry: entry.name.lower())
+
+
+# The config as participants get it: the GUI sends bin_size in seconds, the analysis works in ms
+def engine_config(config):
+    return {**config, 'bin_size': config['bin_size'] * 1000}
+
+
+# Runs of files handed to a worker process at once
+MAX_CHUNK_SIZE = 64
+# Seconds a file's read and analysis can take, see _guarded
+DEFAULT_FILE_TIMEOUT = 60
+
+
+# Worker side of iter_participants()
+def load_files(loader, dir_path, file_paths, config, read_files=True):
+    return list(_load(loader, dir_path, file_paths, config, read_files))
+
+
+# Loads the participants of file_paths one by one. Loaders that take the session files as (header, codes, times)
+# get them read ahead (see read_ahead.py), the others (read_files=False) are called as loader(dir_path, file_path,
+# config). A file that fails gives a FailedFile (see _guarded).
+def _load(loader, dir_path, file_paths, config, read_files, entries=None):
+    timeout = config.get('file_timeout', DEFAULT_FILE_TIMEOUT)
+    if not read_files:
+        for file_path in file_paths:
+            yield _guarded(dir_path, file_path, timeout, lambda: loader(dir_path, file_path, config))
+        return
+    for file_path, load_session in read_ahead.read_sessions(dir_path, file_paths, config, entries):
+        yield _guarded(dir_path, file_path, timeout, lambda: loader(dir_path, file_path, config, load_session()))
+
+
+# Returns analyze(), or a FailedFile when it raises or runs for more than 'timeout' seconds (0 or None for no limit).
+# The timeout is a SIGALRM timer, so it only applies where there is one: on the main thread of a process, which
+# worker processes and the command line runs are (not the server's job threads), on platforms other than Windows.
+# It interrupts Python code, a single numpy call runs to its end first.
+def _guarded(dir_path, file_path, timeout, analyze):
+    timed = bool(timeout) and hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread()
+    if timed:
+        previous_handler = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return analyze()
+    except AnalysisCancelled:
+        raise
+    except FileTimeout:
+        return FailedFile(dir_path, file_path, FileTimeout(f"Took more than {timeout} s"))
+    except Exception as err:
+        return FailedFile(dir_path, file_path, err)
+    finally:
+        if timed:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+
+
+def _raise_timeout(signum, frame):
+    raise FileTimeout()
+
+
+# Yields loader(dir_path, file_path, config, session) for every file, in file_paths order. With config['workers'] > 1
+# (or 0 for one worker per core) the files are analyzed on a process pool in chunks, with only a few chunks in
+# flight ahead of the consumer, so memory stays bounded however many files there are.
+# Files are read ahead of the analysis (see read_ahead.py), unless the loader doesn't read them (read_files=False,
+# it is then called without a session). entries (optional) maps file paths to their os.DirEntry.
+# is_cancelled (optional) is polled between participants, returning True aborts with AnalysisCancelled.
+def iter_participants(dir_path, file_paths, config, is_cancelled=None, loader=Participant, read_files=True,
+                      entries=None):
+    workers = config.get('workers', 1)
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(file_paths))
+
+    if workers <= 1:
+        participants = _load(loader, dir_path, file_paths, config, read_files, entries)
+        try:
+            for file_path in file_paths:
+                _check_cancelled(is_cancelled)
+                yield next(participants)
+        finally:
+            # Stops the read-ahead right away when the run is cancelled
+            participants.close()
+        return
+
+    # Hand out files in chunks so each worker round-trip covers several participants
+    chunksize = max(1, min(MAX_CHUNK_SIZE, len(file_paths) // (workers * 4)))
+    chunks = [file_paths[offset:offset + chunksize] for offset in range(0, len(file_paths), chunksize)]
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        pending = deque()
+        next_chunk = 0
+        while next_chunk < len(chunks) or pending:
+            while next_chunk < len(chunks) and len(pending) < workers * 2:
+                pending.append(executor.submit(load_files, loader, dir_path, chunks[next_chunk], config, read_files))
+                next_chunk += 1
+            for participant in pending.popleft().result():
+                _check_cancelled(is_cancelled)
+                yield participant
+    finally:
+        # On cancellation, drop the chunks that haven't started instead of waiting for them
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _check_cancelled(is_cancelled):
+    if is_cancelled is not None and is_cancelled():
+        raise AnalysisCancelled()
+
+
+# Streaming run, for config['output'] == 'long': every participant is analyzed, written to the long file
+# (out/long/<first file>-<last file>.csv, see long_format.py) and dropped, so memory stays flat however many
+# session files the folder holds. config['long_to_wide'] also writes the usual summary afterwards, from the long file.
+def stream_analysis(dir_path, analysis_type, config, is_cancelled=None):
+    # Get time taken
+    start = time.time()
+    entries = {entry.name: entry for entry in session_entries(dir_path)}
+    file_paths = list(entries)
+    participant_config = engine_config(config)
+    if config.get('clear_cache'):
+        cache.clear(dir_path)
+
+    out_path = os.path.join(dir_path, "out", "long", f"{file_paths[0][:-4]}-{file_paths[-1][:-4]}.csv")
+    files_processed, excluded = 0, 0
+    errors = []
+    with LongWriter(out_path, participant_config) as writer:
+        for participant in iter_participants(dir_path, file_paths, participant_config, is_cancelled,
+                                             entries=entries):
+            if isinstance(participant, FailedFile):
+                errors.append(participant.to_dict())
+                continue
+            writer.write(participant)
+            # Counted like AnalysisEngine splits participants
+            excluded += participant.excluded
+            files_processed += not (config.get('auto_exclude', False) and participant.excluded)
+
+    if config.get('cache', True):
+        cache.evict(dir_path, config.get('cache_max_bytes', cache.DEFAULT_CACHE_MAX_BYTES))
+
+    response = {
+        "message": "Done",
+        "files_processed": files_processed,
+        "out_file": out_path,
+        "excluded": int(excluded)
+    }
+    if errors:
+        response["errors"] = errors
+    if config.get('long_to_wide'):
+        engine = AnalysisEngine(dir_path, {**config, 'clear_cache': False}, is_cancelled,
+                                participants=read_long(out_path, dir_path))
+        engine.produce_summary(analysis_type)
+        response["wide_out_file"] = engine.out_path
+        if len(engine.out_paths) > 1:
+            response["wide_out_files"] = engine.out_paths
+
+    response["duration"] = round(time.time() - start, 4)
+    return response
 
 
 class AnalysisEngine:
-    def __init__(self, dir_path, config):
+    # is_cancelled (optional) is polled between participants, returning True aborts with AnalysisCancelled.
+    # participants (optional) are the folder's already analyzed participants, in session_files() order, for callers
+    # that analyze the files themselves (see batch.py). With participant_files (the file of every participant, e.g.
+    # when merging shards, see shards.py) the folder isn't listed, it doesn't have to hold the session files.
+    def __init__(self, dir_path, config, is_cancelled=None, participants=None, participant_files=None):
         self.dir_path = dir_path
-        unsorted_paths = os.listdir(dir_path)
-        unsorted_paths = list(filter(lambda file_path: (
-                (os.path.isfile(os.path.join(dir_path, file_path))) and (os.path.splitext(file_path)[1] == ".csv")),
-                                     unsorted_paths))
-        self.participant_files = sorted(unsorted_paths, key=lambda path: path.lower())
+        self.is_cancelled = is_cancelled
+        self.clock = timing.stage_clock(config)
+        # os.DirEntry of every session file, by file path (see session_entries)
+        self.session_entries = {}
+        # Whether the participants are analyzed from the event store
+        self.from_store = False
+        if participant_files is not None:
+            self.participant_files = list(participant_files)
+        elif config.get('event_store') and not config.get('incremental'):
+            # Run from the folder's compiled event store (see event_store.py), the session files are only listed,
+            # to compile the store again if they changed since. Incremental runs win over the store: they compare
+            # the session files' size and mtime with the manifest, so with both set the files are listed and the
+            # changed ones are read from the csv as without the store
+            self.session_entries = {entry.name: entry for entry in session_entries(dir_path)}
+            self.participant_files = event_store.current_store(dir_path, config, self.session_entries).file_paths
+            self.from_store = True
+        else:
+            self.session_entries = {entry.name: entry for entry in session_entries(dir_path)}
+            self.participant_files = list(self.session_entries)
+        self.clock.lap('listing')
         # Instantiates all files (not dirs) as participants
-        self.config = {**config, 'bin_size': config['bin_size'] * 1000}
+        self.config = engine_config(config)
         self.event_list = []
 
-        participants = [Participant(dir_path, file_path, self.config) for file_path in self.participant_files]
+        if self.config.get('clear_cache'):
+            cache.clear(dir_path)
+
+        # One SweepPoint per binning setting when config['sweep'] is set (see sweep.py)
+        self.sweep_points = []
+
+        if participants is None:
+            if 'sweep' in self.config:
+                participants = self.__load_sweep()
+            elif self.config.get('incremental'):
+                participants = self.__load_participants_incremental()
+            elif self.from_store:
+                participants = self.__load_participants(self.participant_files, loader=event_store.load_participant,
+                                                        read_files=False)
+            else:
+                participants = self.__load_participants(self.participant_files)
+
+        if self.config.get('cache', True):
+            cache.evict(dir_path, self.config.get('cache_max_bytes', cache.DEFAULT_CACHE_MAX_BYTES))
+
+        # Files that couldn't be analyzed only go into the response (see FailedFile)
+        failed = failed_files(participants)
+        self.errors = [failed_file.to_dict() for failed_file in failed]
+        if failed:
+            participants = [participant for participant in participants if not isinstance(participant, FailedFile)]
+            if not participants:
+                raise ValueError(f"None of the {len(failed)} session files could be analyzed, "
+                                 f"{failed[0].file_path}: {failed[0].error} {failed[0].message}")
 
         # Filter out excluded participants
-        if (self.config['auto_exclude']):
-            self.participants = list(filter(lambda participant: not participant.excluded, participants))
-        else:
-            self.participants = participants
-
-        self.excluded_participants = list(filter(lambda participant: participant.excluded, participants))
+        self.participants, self.excluded_participants = self.__split_participants(participants)
+        self.clock.lap('participants')
 
         self.event_list = self.participants[0].event_list
         self.files_processed = len(self.participants)
         self.out_path = None
-
-    # Will produce an output file with a summary of all the participants.
-    # If no filename is given, will default to 'Participantx - Participanty'
+        self.out_paths = {}
+        # Bootstrap confidence interval files, one per summarized set of participants (see bootstrap.py)
+        self.statistics_paths = []
+
+    # Parses and analyzes every participant file, on a process pool with config['workers'] > 1 (see
+    # iter_participants). The results keep participant_files order, so the output is the same as the serial path.
+    # 'loader' is called as loader(dir_path, file_path, config, session) for every file, or without the session
+    # with read_files=False
+    def __load_participants(self, file_paths, loader=Participant, read_files=True):
+        return list(iter_participants(self.dir_path, file_paths, self.config, self.is_cancelled, loader, read_files,
+                                      self.session_entries))
+
+    # Only analyzes the files that were added or modified since the last incremental run, the rest of the
+    # participants are restored from the manifest (see manifest.py). Entries of removed files are dropped.
+    def __load_participants_incremental(self):
+        entries = manifest.load(self.dir_path, self.config)
+        stats = {file_path: self.session_entries[file_path].stat() for file_path in self.participant_files}
+
+        changed_files = [file_path for file_path in self.participant_files if file_path not in entries or
+                         not manifest.is_current(entries[file_path], stats[file_path], self.config)]
+        analyzed = dict(zip(changed_files, self.__load_participants(changed_files)))
+
+        participants = []
+        current_entries = {}
+        for file_path in self.participant_files:
+            if file_path in analyzed:
+                participants.append(analyzed[file_path])
+                # Failed files get no entry, so they are tried again by the next run
+                if not isinstance(analyzed[file_path], FailedFile):
+                    current_entries[file_path] = manifest.make_entry(analyzed[file_path], stats[file_path])
+            else:
+                participants.append(StoredParticipant(self.dir_path, entries[file_path]))
+                current_entries[file_path] = entries[file_path]
+
+        if changed_files or len(current_entries) != len(entries):
+            # A run cancelled by then mustn't overwrite the manifest of the run that superseded it
+            _check_cancelled(self.is_cancelled)
+            manifest.save(self.dir_path, self.config, current_entries)
+        self.files_reanalyzed = len(changed_files)
+        return participants
+
+    # Analyzes every file for all the sweep points at once (each file is parsed a single time).
+    # Returns the participants of the first point, which stand for the run in the response, and the failed files.
+    def __load_sweep(self):
+        if self.from_store:
+            per_file = self.__load_participants(self.participant_files, loader=event_store.load_grid, read_files=False)
+        else:
+            per_file = self.__load_participants(self.participant_files, loader=sweep.analyze_grid)
+        failed = failed_files(per_file)
+        per_file = [analyzed for analyzed in per_file if not isinstance(analyzed, FailedFile)]
+        for i, point in enumerate(sweep.grid_points(self.config['sweep'])):
+            participants = [file_participants[i] for file_participants in per_file]
+            self.sweep_points.append(SweepPoint(sweep.point_config(self.config, point),
+                                                *self.__split_participants(participants)))
+        return [file_participants[0] for file_participants in per_file] + failed
+
+    # Every participant of the run, summarized or auto excluded, in participant_files order
+    def all_participants(self):
+        if not self.config.get('auto_exclude', False):
+            return list(self.participants)
+        order = {file_path: i for (i, file_path) in enumerate(self.participant_files)}
+        return sorted(self.participants + self.excluded_participants,
+                      key=lambda participant: order[participant.file_path])
+
+    # Returns (participants, excluded_participants). Without auto_exclude every participant stays in the summary.
+    def __split_participants(self, participants):
+        excluded_participants = list(filter(lambda participant: participant.excluded, participants))
+        if self.config.get('auto_exclude', False):
+            return list(filter(lambda participant: not participant.excluded, participants)), excluded_participants
+        return participants, excluded_participants
+
+    # Will produce an output file with a summary of all the participants, for every analysis of analysis_type
+    # (see analyses.py). If no filename is given, will default to 'Participantx - Participanty'
     # Can only accept 0 or 1 arguments, the one being whatever file name you want to give it
     def produce_summary(self, analysis_type, file_name=None):
 
         # Arg 0 will be analysis_type, Arg 1 (optional) will be out_file_name if set
-        analysis_type = analysis_type
+        requested = analyses.resolve(analysis_type)
 
         if file_name is not None:
             out_file_name = file_name
@@ -49,300 +451,63 @@ class AnalysisEngine:
             last_file_name = self.participant_files[len(self.participant_files) - 1][:-4]
             out_file_name = f"{first_file_name}-{last_file_name}"
 
-        if analysis_type == 'targetAltControl':
-            self.__produce_target_alt_control_summary(out_file_name)
-            if len(self.excluded_participants) != 0 and self.config['auto_exclude']:
-                self.__produce_exclusion_summary(out_file_name)
-
-    def __produce_target_alt_control_summary(self, out_file_name):
-
-        out_path = os.path.join(self.dir_path, "out", "target_alt", f"{out_file_name}.csv")
-        self.out_path = out_path
-
-        if not os.path.exists(os.path.dirname(out_path)):
-            try:
-                os.makedirs(os.path.dirname(out_path),
-                            exist_ok=True)  # Created dir if not exists, WILL overwrite previous
-            except OSError:  # Guard against very unlikely race condition
-                pass
-
-        with open(out_path, "w+") as out_file:
-            writer = csv.writer(out_file)
-
-            # Write each row
-            writer.writerow(map(lambda part: part.file_path[:-4], self.participants))
-
-            writer.writerow([])
-            # Write SR info
-            for i in range(4):
-                row = []
-                for part in self.participants:
-                    if len(part.sr) > i:
-                        row.append(str(part.sr[i]))
-                    else:
-                        row.append("no sr info")
-                writer.writerow(row)
-                # writer.writerow(map(lambda part: part.sr[i] if part.sr[i] else 'no sr info', self.participants))
-            writer.writerow([])
-
-            # Inform if has been cut off, if so, the rest of analysis should essentially be ignored, as it will be inaccurate
-            writer.writerow(
-                map(lambda _: "Cut-off?",
-                    self.participants))
-
-            writer.writerow(
-                map(lambda part: part.exclusion_reason == "Cut-Off",
-                    self.participants))
-
-            # Write events
-            for key, event_type in self.event_list:
-                key = int(key)
-
-                do_not_print = self.config.get('do_not_print')
-                if do_not_print:
-                    if key in do_not_print:
-                        continue
-
-                writer.writerow([])
-
-                # If no responses were recorded for this event, then we can just write "No responses"
-                all_responses_for_this_event = list(map(lambda part: part.type_response[key - 1], self.participants))
-                all_responses_for_this_event = np.asarray(all_responses_for_this_event).flatten()
-                # print(list(all_responses_for_this_event))
-                all_zeros = not np.any(all_responses_for_this_event)
-                if all_zeros:
-                    writer.writerow([f"No responses were recorded for type {event_type}"])
-                    continue
-                else:
-                    # Write event name
-                    writer.writerow(map(lambda _: event_type, self.participants))
-
-                for phase in [0, 1, 2]:
-                    # Write phase number
-                    writer.writerow(map(lambda _: f"Phase {phase + 1}", self.participants))
-
-                    begin = 0
-                    bin_upto = 0
-                    if phase == 0:
-                        begin = 0
-                        bin_upto = self.config["bin_num_phase_1"]
-                    elif phase == 1:
-                        # If you want to cut off first X bins in phase 2 when x varies, change 'begin' below
-                        # but remember, the type_response list is 0-indexed, so if you want to cut off first 4 bins,
-                        # set begin to be 4.
-                        begin = 0
-                        bin_upto = self.config["bin_num_phase_2_max"]
-                    elif phase == 2:
-                        begin = 0
-                        bin_upto = self.config["bin_num_phase_3"]
-
-                    for _bin in range(begin, bin_upto):
-                        # We want to get the number of responses of current type (key), in the current phase (phase) in the current bin (_bin)
-                        writer.writerow(map(lambda part: part.type_response[key - 1][phase][_bin], self.participants))
-
-            writer.writerow([])
-            # Write phase durations
-            writer.writerow(map(lambda _: "Phase Durations", self.participants))
-
-            for phase in [0, 1, 2]:
-                writer.writerow(map(lambda _: f"Phase {phase + 1}", self.participants))
-                writer.writerow(
-                    map(lambda part: str(round((int(part.phases_duration[phase]) / 1000.0), 2)), self.participants))
-
-            # Write 'OK' if '99)' was detected, 'Miss' if not
-            writer.writerow(map(lambda _: "99)", self.participants))
-            writer.writerow(map(lambda partic: "OK" if partic.event_99_detected else "Miss", self.participants))
-
-            # Empty Line
-            writer.writerow([])
-
-            # Write Latencies
-            writer.writerow(map(lambda _: "Latencies", self.participants))
-            for evt_type in latency_events.keys():  # 1 and 2
-                writer.writerow(map(lambda _: latency_events[evt_type], self.participants))
-                writer.writerow(
-                    map(lambda part: str(round((int(part.phase_3_latency[evt_type - 1]) / 1000.0), 2)) if
-                    part.phase_3_latency[evt_type - 1] != -1000 else "None",
-                        self.participants))
-                # Empty Line
-                writer.writerow([])
-
-            countTarget, countControl1, countControl2, allInvalid = 0, 0, 0, 0
-
-            for part in self.participants:
-                tar = part.phase_3_latency[0]  # Target
-                con1 = part.phase_3_latency[2]  # Control 1
-                con2 = part.phase_3_latency[3]  # Control 2
-
-                tmp1 = min(tar, con1)
-                if tmp1 == -1000:
-                    tmp1 = max(tar, con1)
-
-                tmp2 = min(tar, con2)
-                if tmp2 == -1000:
-                    tmp2 = max(tar, con2)
-
-                fin = min(tmp1, tmp2)
-                if fin == -1000:
-                    fin = max(tmp1, tmp2)
-
-                if fin == -1000:
-                    allInvalid += 1
-                elif fin == tar:
-                    countTarget += 1
-                elif fin == con1:
-                    countControl1 += 1
-                elif fin == con2:
-                    countControl2 += 1
-
-            writer.writerow([f"Counts of {len(self.participants)} participant(s) in Phase 3"])
-            writer.writerow(["Target"])
-            writer.writerow([countTarget])
-
-            writer.writerow([])
-
-            writer.writerow(["No target response in Phase 3"])
-            writer.writerow([allInvalid])
-
-            writer.writerow([])
-
-            writer.writerow(["Proportion in Phase 3"])
-            writer.writerow(["Target"])
-            writer.writerow([str(round(float(float(countTarget) / len(self.participants)), 2))])
-
-    def __produce_exclusion_summary(self, out_file_name):
-        out_path = os.path.join(self.dir_path, "out", "target_alt", "excluded", f"{out_file_name}_excluded.csv")
-        if not os.path.exists(os.path.dirname(out_path)):
-            try:
-                os.makedirs(os.path.dirname(out_path),
-                            exist_ok=True)  # Created dir if not exists, WILL overwrite previous
-            except OSError:  # Guard against very unlikely race condition
-                pass
-
-        with open(out_path, "w+") as out_file:
-            writer = csv.writer(out_file)
-
-            # Write each row
-            writer.writerow(map(lambda part: part.file_path[:-4], self.excluded_participants))
-
-            writer.writerow(map(lambda part: part.exclusion_reason, self.excluded_participants))
-
-            # Write events
-            for key, event_type in self.event_list:
-                key = int(key)
-
-                do_not_print = self.config.get('do_not_print')
-                if do_not_print:
-                    if key in do_not_print:
-                        continue
-
-                writer.writerow([])
-
-                # If no responses were recorded for this event, then we can just write "No responses"
-                all_responses_for_this_event = list(
-                    map(lambda part: part.type_response[key - 1], self.excluded_participants))
-                all_responses_for_this_event = np.asarray(all_responses_for_this_event).flatten()
-                # print(list(all_responses_for_this_event))
-                all_zeros = not np.any(all_responses_for_this_event)
-                if all_zeros:
-                    writer.writerow([f"No responses were recorded for type {event_type}"])
-                    continue
-                else:
-                    # Write event name
-                    writer.writerow(map(lambda _: event_type, self.excluded_participants))
-
-                for phase in [0, 1, 2]:
-                    # Write phase number
-                    writer.writerow(map(lambda _: f"Phase {phase + 1}", self.excluded_participants))
-
-                    begin = 0
-                    bin_upto = 0
-                    if phase == 0:
-                        begin = 0
-                        bin_upto = self.config["bin_num_phase_1"]
-                    elif phase == 1:
-                        # If you want to cut off first X bins in phase 2 when x varies, change 'begin' below
-                        # but remember, the type_response list is 0-indexed, so if you want to cut off first 4 bins,
-                        # set begin to be 4.
-                        begin = 0
-                        bin_upto = self.config["bin_num_phase_2_max"]
-                    elif phase == 2:
-                        begin = 0
-                        bin_upto = self.config["bin_num_phase_3"]
-
-                    for _bin in range(begin, bin_upto):
-                        # We want to get the number of responses of current type (key), in the current phase (phase) in the current bin (_bin)
-                        writer.writerow(
-                            map(lambda part: part.type_response[key - 1][phase][_bin], self.excluded_participants))
-
-            writer.writerow([])
-            # Write phase durations
-            writer.writerow(map(lambda _: "Phase Durations", self.excluded_participants))
-
-            for phase in [0, 1, 2]:
-                writer.writerow(map(lambda _: f"Phase {phase + 1}", self.excluded_participants))
-                writer.writerow(
-                    map(lambda part: str(round((int(part.phases_duration[phase]) / 1000.0), 2)),
-                        self.excluded_participants))
-
-            # Write 'OK' if '99)' was detected, 'Miss' if not
-            writer.writerow(map(lambda _: "99)", self.excluded_participants))
-            writer.writerow(
-                map(lambda partic: "OK" if partic.event_99_detected else "Miss", self.excluded_participants))
-
-            # Empty Line
-            writer.writerow([])
-
-            # Write Latencies
-            writer.writerow(map(lambda _: "Latencies", self.excluded_participants))
-            for evt_type in latency_events.keys():  # 1 and 2
-                writer.writerow(map(lambda _: latency_events[evt_type], self.excluded_participants))
-                writer.writerow(
-                    map(lambda part: str(round((int(part.phase_3_latency[evt_type - 1]) / 1000.0), 2)) if
-                    part.phase_3_latency[evt_type - 1] != -1000 else "None",
-                        self.excluded_participants))
-                # Empty Line
-                writer.writerow([])
-
-            countTarget, countControl1, countControl2, allInvalid = 0, 0, 0, 0
-
-            for part in self.excluded_participants:
-                tar = part.phase_3_latency[0]  # Target
-                con1 = part.phase_3_latency[2]  # Control 1
-                con2 = part.phase_3_latency[3]  # Control 2
-
-                tmp1 = min(tar, con1)
-                if tmp1 == -1000:
-                    tmp1 = max(tar, con1)
-
-                tmp2 = min(tar, con2)
-                if tmp2 == -1000:
-                    tmp2 = max(tar, con2)
-
-                fin = min(tmp1, tmp2)
-                if fin == -1000:
-                    fin = max(tmp1, tmp2)
-
-                if fin == -1000:
-                    allInvalid += 1
-                elif fin == tar:
-                    countTarget += 1
-                elif fin == con1:
-                    countControl1 += 1
-                elif fin == con2:
-                    countControl2 += 1
-
-            writer.writerow([f"Counts of {len(self.excluded_participants)} participant(s) in Phase 3"])
-            writer.writerow(["Target"])
-            writer.writerow([countTarget])
-
-            writer.writerow([])
-
-            writer.writerow(["No target response in Phase 3"])
-            writer.writerow([allInvalid])
-
-            writer.writerow([])
-
-            writer.writerow(["Proportion in Phase 3"])
-            writer.writerow(["Target"])
-            writer.writerow([str(round(float(float(countTarget) / len(self.excluded_participants)), 2))])
+        # A run cancelled by then mustn't overwrite the summaries of the run that superseded it
+        _check_cancelled(self.is_cancelled)
+        if self.sweep_points:
+            self.out_paths = self.__produce_sweep_summaries(requested, out_file_name)
+        else:
+            self.out_paths = self.__produce_summaries(requested, self.participants, self.excluded_participants,
+                                                      self.config, out_file_name)
+        self.out_path = self.out_paths[requested[0].name]
+        self.clock.lap('summary')
+
+    # Writes the summary of every requested analysis from one stacked model, in out/<analysis out_dir>/ (plus
+    # sub_dir). Returns {analysis name: summary path}
+    def __produce_summaries(self, requested, participants, excluded_participants, config, out_file_name,
+                            sub_dir=""):
+        write_exclusion_summary = len(excluded_participants) != 0 and config.get('auto_exclude', False)
+
+        # Both summaries are written from one stacked model. With auto_exclude the two groups don't overlap.
+        groups = [participants, excluded_participants] if write_exclusion_summary else [participants]
+        model = SummaryModel(groups, self.event_list)
+        if config.get('bootstrap'):
+            self.__produce_statistics(model, config, out_file_name, sub_dir)
+
+        return {analysis.name: analysis.write(model, os.path.join(self.dir_path, "out", analysis.out_dir, sub_dir),
+                                              out_file_name, config, write_exclusion_summary)
+                for analysis in requested}
+
+    # Optional statistics stage: bootstrap confidence intervals of the summarized participants (the model's first
+    # group), in out/statistics/ (plus sub_dir)
+    def __produce_statistics(self, model, config, out_file_name, sub_dir):
+        self.clock.lap('summary')
+        out_path = os.path.join(self.dir_path, "out", "statistics", sub_dir, f"{out_file_name}.csv")
+        bootstrap.write_statistics(out_path, model.groups[0], model.event_list, config)
+        self.statistics_paths.append(out_path)
+        self.clock.lap('statistics')
+
+    # One summary per sweep point and analysis, plus an index.csv per analysis listing the points in
+    # out/<analysis out_dir>/sweep/<out_file_name>/. Returns {analysis name: index path}
+    def __produce_sweep_summaries(self, requested, out_file_name):
+        sub_dir = os.path.join("sweep", out_file_name)
+        rows = {analysis.name: [] for analysis in requested}
+        for point in self.sweep_points:
+            out_paths = self.__produce_summaries(requested, point.participants, point.excluded_participants,
+                                                 point.config, point.label, sub_dir)
+            for analysis in requested:
+                rows[analysis.name].append([
+                    point.label, point.config['bin_size'] / 1000, point.config['bin_num_phase_1'],
+                    point.config['bin_num_phase_2_max'], point.config['bin_num_phase_3'], len(point.participants),
+                    len(point.excluded_participants), out_paths[analysis.name]])
+
+        index_paths = {}
+        for analysis in requested:
+            index_path = os.path.join(self.dir_path, "out", analysis.out_dir, sub_dir, "index.csv")
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            with open(index_path, "w+") as index_file:
+                writer = csv.writer(index_file)
+                writer.writerow(["point", "bin_size", "bin_num_phase_1", "bin_num_phase_2_max", "bin_num_phase_3",
+                                 "files_processed", "excluded", "out_file"])
+                writer.writerows(rows[analysis.name])
+            index_paths[analysis.name] = index_path
+        return index_paths
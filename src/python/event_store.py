@@ -0,0 +1,183 @@
+import os, sys, json, shutil
+import numpy as np
+from parsing import SessionHeader, read_session
+from participant import Participant
+import sweep
+from cache import padded
+
+# Event store: a study folder compiled into one binary file, so analyses can run from it (config['event_store'])
+# without reading the session files again. Built with
+#   python event_store.py <dir_path> [store_path]
+# (default store path: <dir_path>/out/.store/events.bin). The store records the size and mtime of every file it
+# was compiled from, and a run compiles it again first when the folder's session files differ from those (see
+# current_store), so files added or changed since are never left out or read stale. Sweeps run from the store too.
+#
+# Layout (CSR): MAGIC | uint32 meta length | meta JSON (padded to 8 bytes) | int64 offsets (files + 1)
+#               | int64 times (all events) | int16 codes (all events)
+# The events of file i are times[offsets[i]:offsets[i + 1]] and codes[offsets[i]:offsets[i + 1]], the meta holds
+# one header entry per file (no_phase_1, sr, event_list), and every array is opened with np.memmap.
+
+MAGIC = b"AREVSTO1"
+
+
+def default_store_path(dir_path):
+    return os.path.join(dir_path, "out", ".store", "events.bin")
+
+
+# Compiles every session file of dir_path into the store. Events are spooled to temporary files as files are
+# parsed, so memory doesn't grow with the size of the folder. Returns the store path.
+def compile_store(dir_path, store_path=None, file_paths=None):
+    # Imported here, engine imports this module
+    from engine import session_files
+
+    store_path = store_path or default_store_path(dir_path)
+    file_paths = session_files(dir_path) if file_paths is None else file_paths
+    os.makedirs(os.path.dirname(store_path), exist_ok=True)
+    times_path, codes_path, temp_path = (f"{store_path}.{part}.{os.getpid()}.tmp"
+                                         for part in ("times", "codes", "all"))
+
+    files = []
+    offsets = [0]
+    try:
+        with open(times_path, "wb") as times_file, open(codes_path, "wb") as codes_file:
+            for file_path in file_paths:
+                # Taken before the file is read, so a file changed while it is compiled is compiled again next time
+                stat = os.stat(os.path.join(dir_path, file_path))
+                entry = {'file_path': file_path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+                try:
+                    header, codes, times = read_session(os.path.join(dir_path, file_path))
+                except ValueError as err:
+                    # Stored as is, the file fails when it is analyzed, like it would from the csv
+                    header, codes, times = None, None, None
+                    entry['error'] = str(err)
+
+                if header is not None:
+                    entry.update({'no_phase_1': header.no_phase_1, 'sr': header.sr,
+                                  'event_list': header.event_list})
+                    times_file.write(np.ascontiguousarray(times, dtype=np.int64).tobytes())
+                    codes_file.write(np.ascontiguousarray(codes, dtype=np.int16).tobytes())
+                entry['has_header'] = header is not None
+                offsets.append(offsets[-1] + (len(codes) if header is not None else 0))
+                files.append(entry)
+
+        meta = json.dumps({'num_files': len(files), 'num_events': offsets[-1], 'files': files}).encode()
+        with open(temp_path, "wb") as store:
+            store.write(MAGIC)
+            store.write(len(meta).to_bytes(4, "little"))
+            store.write(meta.ljust(padded(len(meta)), b" "))
+            store.write(np.array(offsets, dtype=np.int64).tobytes())
+            for part_path in (times_path, codes_path):
+                with open(part_path, "rb") as part:
+                    shutil.copyfileobj(part, store)
+        os.replace(temp_path, store_path)
+    finally:
+        for path in (times_path, codes_path, temp_path):
+            if os.path.exists(path):
+                os.remove(path)
+    return store_path
+
+
+class EventStore:
+    def __init__(self, store_path):
+        self.store_path = store_path
+        with open(store_path, "rb") as store:
+            if store.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{store_path} is not an event store")
+            meta_length = int.from_bytes(store.read(4), "little")
+            meta = json.loads(store.read(meta_length))
+
+        self.files = meta['files']
+        self.file_paths = [entry['file_path'] for entry in self.files]
+        self.positions = {file_path: i for (i, file_path) in enumerate(self.file_paths)}
+
+        num_files, num_events = meta['num_files'], meta['num_events']
+        offsets_start = len(MAGIC) + 4 + padded(meta_length)
+        times_start = offsets_start + 8 * (num_files + 1)
+        codes_start = times_start + 8 * num_events
+        self.offsets = np.memmap(store_path, dtype=np.int64, mode='r', offset=offsets_start, shape=(num_files + 1,))
+        # np.memmap can't map zero bytes
+        if num_events:
+            self.times = np.memmap(store_path, dtype=np.int64, mode='r', offset=times_start, shape=(num_events,))
+            self.codes = np.memmap(store_path, dtype=np.int16, mode='r', offset=codes_start, shape=(num_events,))
+        else:
+            self.times = np.zeros(0, dtype=np.int64)
+            self.codes = np.zeros(0, dtype=np.int16)
+
+    # Whether the store holds exactly the session files of 'entries' (os.DirEntry by file path, see
+    # engine.session_entries), in the same order and with the size and mtime they have now
+    def is_current(self, entries):
+        if self.file_paths != list(entries):
+            return False
+        for entry in self.files:
+            stat = entries[entry['file_path']].stat()
+            if entry.get('size') != stat.st_size or entry.get('mtime_ns') != stat.st_mtime_ns:
+                return False
+        return True
+
+    # (header, codes, times) of one session file, like parsing.read_session() returns it. The events are views
+    # into the mapped store.
+    def session(self, file_path):
+        i = self.positions[file_path]
+        entry = self.files[i]
+        if 'error' in entry:
+            raise ValueError(entry['error'])
+        if not entry['has_header']:
+            return None, None, None
+
+        header = SessionHeader()
+        header.no_phase_1 = entry['no_phase_1']
+        header.sr = entry['sr']
+        header.event_list = entry['event_list']
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return header, self.codes[start:end], self.times[start:end]
+
+
+# Stores opened by this process, so pool workers map each store once: path -> (size, mtime_ns, EventStore).
+# A store that was rebuilt since is opened again.
+open_stores = {}
+
+
+def open_store(store_path):
+    stat = os.stat(store_path)
+    opened = open_stores.get(store_path)
+    if opened is None or opened[0] != stat.st_size or opened[1] != stat.st_mtime_ns:
+        opened = (stat.st_size, stat.st_mtime_ns, EventStore(store_path))
+        open_stores[store_path] = opened
+    return opened[2]
+
+
+# Path of the store config['event_store'] points at: True for the folder's default store, or a path
+def store_path_of(dir_path, config):
+    return default_store_path(dir_path) if config['event_store'] is True else config['event_store']
+
+
+# The store of config['event_store'] for the session files of 'entries' (see EventStore.is_current), compiled
+# again first if it is missing or out of date
+def current_store(dir_path, config, entries):
+    store_path = store_path_of(dir_path, config)
+    if os.path.exists(store_path):
+        store = open_store(store_path)
+        if store.is_current(entries):
+            return store
+    compile_store(dir_path, store_path, list(entries))
+    return open_store(store_path)
+
+
+# Loader for AnalysisEngine: a Participant analyzed from the store instead of its csv file
+def load_participant(dir_path, file_path, config):
+    session = open_store(store_path_of(dir_path, config)).session(file_path)
+    return Participant(dir_path, file_path, config, session)
+
+
+# Loader for sweeps: the participants of every sweep point (see sweep.analyze_grid), analyzed from the store
+def load_grid(dir_path, file_path, config):
+    session = open_store(store_path_of(dir_path, config)).session(file_path)
+    return sweep.analyze_grid(dir_path, file_path, config, session)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("usage: python event_store.py <dir_path> [store_path]")
+    else:
+        path = compile_store(str(sys.argv[1]), str(sys.argv[2]) if len(sys.argv) > 2 else None)
+        print(f"Event store written to {path}")
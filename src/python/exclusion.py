@@ -0,0 +1,105 @@
+import operator
+import numpy as np
+from binning import TARGET_RESPONSE, ALT_RESPONSE
+
+# Exclusion criteria, checked in order after a participant's events are binned.
+# Each rule counts the events with one of 'codes' inside a window of 'window' ms that ends at the end of 'phase'
+# (1, 2 or 3), and compares that count against 'threshold' using 'comparison'.
+# With a 'reference' window, the count is compared against threshold * (count in the reference window) instead.
+# Window starts are clamped at 0 and both window ends are inclusive.
+# Every rule that matches excludes the participant, and the reason of the last matching rule is kept. 'reason'
+# may use {count} and {reference}.
+# These defaults can be replaced through config['exclusion_rules'].
+DEFAULT_EXCLUSION_RULES = [
+    # 1. There are zero target and zero alt responses in the last 2 minutes of phase 1
+    {
+        'codes': [TARGET_RESPONSE, ALT_RESPONSE],
+        'phase': 1,
+        'window': 120000,
+        'comparison': '==',
+        'threshold': 0,
+        'reason': "Zero target and zero alt responses in last 2 minutes of Phase 1",
+    },
+    # 2. There are zero target and zero alt responses in the last 2 minutes of phase 2
+    {
+        'codes': [TARGET_RESPONSE, ALT_RESPONSE],
+        'phase': 2,
+        'window': 120000,
+        'comparison': '==',
+        'threshold': 0,
+        'reason': "Zero target and zero alt responses in last 2 minutes of Phase 2",
+    },
+    # 3. Target responding in the last minute of phase 2 has not decreased to 50% of the last minute of phase 1
+    {
+        'codes': [TARGET_RESPONSE],
+        'phase': 2,
+        'window': 60000,
+        'comparison': '>=',
+        'threshold': 0.5,
+        'reference': {'codes': [TARGET_RESPONSE], 'phase': 1, 'window': 60000},
+        'reason': "Target responding has not decreased to 50% of phase 1 levels. "
+                  "Phase 1 level (last minute): {reference}, Phase 2 level (last minute): {count}",
+    },
+]
+
+comparisons = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+# Timestamps grouped by event code, each group sorted, so any (code, time range) count is two binary searches
+class EventIndex:
+    def __init__(self, codes, times):
+        # codes/times are sorted by time, so a stable sort on the code keeps each group in time order
+        order = np.argsort(codes, kind='stable')
+        sorted_codes = codes[order]
+        self.times = times[order]
+        self.present = np.unique(sorted_codes)
+        self.starts = np.searchsorted(sorted_codes, self.present, side='left')
+        self.ends = np.searchsorted(sorted_codes, self.present, side='right')
+
+    # Sorted timestamps of one event code
+    def times_of(self, event_type):
+        i = np.searchsorted(self.present, event_type)
+        if i == len(self.present) or self.present[i] != event_type:
+            return self.times[:0]
+        return self.times[self.starts[i]:self.ends[i]]
+
+    # Number of events with one of 'event_types' and start <= time <= end
+    def count(self, event_types, start, end):
+        total = 0
+        for event_type in event_types:
+            times = self.times_of(event_type)
+            total += int(np.searchsorted(times, end, side='right') - np.searchsorted(times, start, side='left'))
+        return total
+
+
+def count_in_window(index, window, phases_offset):
+    end = phases_offset[window['phase'] - 1]
+    start = max(end - window['window'], 0)
+    return index.count(window['codes'], start, end)
+
+
+# Returns (excluded, exclusion_reason) for one participant
+def evaluate_exclusion_rules(rules, index, phases_offset):
+    excluded, exclusion_reason = False, ''
+    for rule in rules:
+        if rule['comparison'] not in comparisons:
+            raise ValueError(f"Unknown comparison '{rule['comparison']}' in exclusion rule")
+
+        count = count_in_window(index, rule, phases_offset)
+        reference = None
+        threshold = rule['threshold']
+        if 'reference' in rule:
+            reference = count_in_window(index, rule['reference'], phases_offset)
+            threshold = threshold * reference
+
+        if comparisons[rule['comparison']](count, threshold):
+            excluded = True
+            exclusion_reason = rule['reason'].format(count=count, reference=reference)
+    return excluded, exclusion_reason
@@ -0,0 +1,94 @@
+import numpy as np
+from binning import count_dtype, TARGET_RESPONSE
+
+# Latency metrics, per participant and stacked across the cohort (see summary.SummaryModel):
+#   first_latency[participant, event, phase]    ms from the start of the phase to the first event of that code,
+#                                               NaN when the code doesn't occur in the phase
+#   irt[participant, event, irt bin]            inter-response times (time between two consecutive events of the
+#                                               same code), counted into the IRT_BIN_EDGES bins
+# Events are in the order of the participant's list of events; the cohort arrays follow the run's list of events.
+# Control responses for the first response classification are config['control_codes'], codes 03 and 04 by default.
+
+# ms, the last bin is open ended
+IRT_BIN_EDGES = np.array([0, 250, 500, 1000, 2000, 5000, 10000, 30000, 60000])
+DEFAULT_CONTROL_CODES = (3, 4)
+
+# Names of the first response classes (see classify_first_responses)
+FIRST_RESPONSE_CLASSES = ("Target", "Control", "None")
+
+
+# Whether a run with this config reads the latencies: the latency metrics section of the summary, the bootstrap
+# statistics and the long output do. Participants only compute them then (see participant.Participant).
+def latency_needed(config):
+    return bool(config.get('latency_metrics') or config.get('bootstrap') or config.get('output') == 'long')
+
+
+def irt_bin_labels():
+    labels = [f"{lo / 1000:g}-{hi / 1000:g} s" for (lo, hi) in zip(IRT_BIN_EDGES[:-1], IRT_BIN_EDGES[1:])]
+    return labels + [f"{IRT_BIN_EDGES[-1] / 1000:g}+ s"]
+
+
+def event_codes_of(event_list):
+    return np.array([int(event[0]) for event in event_list], dtype=np.int64)
+
+
+# (events, 3) first latencies of one participant from its binning.PhaseSegments
+def first_latency_matrix(segments, event_codes):
+    matrix = np.full((len(event_codes), 3), np.nan)
+    rows = rows_of(event_codes, segments.first_codes)
+    known = rows >= 0
+    matrix[rows[known], segments.first_phases[known]] = segments.first_latencies[known]
+    return matrix
+
+
+# (events, IRT bins) inter-response time counts of one participant, from its time sorted codes and times
+def irt_histogram(codes, times, event_codes):
+    order = np.argsort(codes, kind='stable')  # Each code's events stay in time order
+    sorted_codes = codes[order]
+    sorted_times = times[order]
+    same_code = sorted_codes[1:] == sorted_codes[:-1]
+    intervals = (sorted_times[1:] - sorted_times[:-1])[same_code]
+    rows = rows_of(event_codes, sorted_codes[1:][same_code])
+
+    known = rows >= 0
+    bins = np.searchsorted(IRT_BIN_EDGES, intervals[known], side='right') - 1
+    num_bins = len(IRT_BIN_EDGES)
+    counts = np.bincount(rows[known] * num_bins + bins, minlength=len(event_codes) * num_bins)
+    return counts.reshape(len(event_codes), num_bins).astype(count_dtype(len(codes)))
+
+
+# Row of each of 'codes' in event_codes, -1 for codes that aren't listed (the first listing wins for duplicates)
+def rows_of(event_codes, codes):
+    codes = np.asarray(codes, dtype=np.int64)
+    if len(event_codes) == 0:
+        return np.full(len(codes), -1)
+    order = np.argsort(event_codes, kind='stable')
+    sorted_codes = event_codes[order]
+    positions = np.minimum(np.searchsorted(sorted_codes, codes), len(sorted_codes) - 1)
+    return np.where(sorted_codes[positions] == codes, order[positions], -1)
+
+
+# Which came first in phase 3, per participant: 0 the target response, 1 a control response, 2 neither occurred.
+# Ties go to the target. first_latency is the cohort (participants, events, 3) matrix.
+def classify_first_responses(first_latency, event_codes, control_codes=DEFAULT_CONTROL_CODES):
+    phase_3 = first_latency[:, :, 2]
+    target = _column(phase_3, event_codes, [TARGET_RESPONSE])
+    control = _column(phase_3, event_codes, control_codes)
+
+    classes = np.full(len(phase_3), 2)
+    with np.errstate(invalid='ignore'):
+        classes[~np.isnan(control)] = 1
+        classes[~np.isnan(target) & ~(control < target)] = 0
+    return classes
+
+
+# Earliest latency over the given codes' columns, NaN if none of them occurred
+def _column(phase_3, event_codes, codes):
+    columns = np.isin(event_codes, codes)
+    if not np.any(columns):
+        return np.full(len(phase_3), np.nan)
+    selected = phase_3[:, columns]
+    earliest = np.full(len(phase_3), np.nan)
+    occurred = ~np.all(np.isnan(selected), axis=1)
+    earliest[occurred] = np.nanmin(selected[occurred], axis=1)
+    return earliest
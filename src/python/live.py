@@ -0,0 +1,332 @@
+import os, sys, json, time
+import numpy as np
+from parsing import parse_mapped_header, parse_events, decode, SessionCutOff
+from binning import PhaseSegments, count_bins, bins_needed, SR_TARGET, SR_ALT, TARGET_RESPONSE, ALT_RESPONSE, \
+    END_OF_PHASE_1, END_OF_PHASE_2, END_OF_SESSION
+from exclusion import evaluate_exclusion_rules, DEFAULT_EXCLUSION_RULES
+from participant import Participant, default_phase_ends
+from engine import session_files, engine_config
+
+# Live view of session files that are still being written: the experiment software keeps appending 'NN) time'
+# lines, and every poll of a LiveParticipant only parses the lines added since the last one.
+#   python performAnalysisOnFolder.py --watch <dir_path> '<config json>' [interval in s] [--until-done]
+# polls every session file of the folder (files that appear later included) and writes one JSON line per file
+# whose state changed, see LiveParticipant.state().
+#
+# The bins are kept up to date as the lines come in: phase 3 events are binned right away (forward from the start
+# of the phase), the events of phases 1 and 2 are held until their 30/31 marker says where the phase ends (they are
+# binned backward from it). The exclusion rules are checked as soon as the phases they look at are over.
+# A 31 coming in phase 1 means the session has no 30: phase 1 is ended where the analysis reconstructs the missing
+# marker (after the configured length of phase 1), and the session is still followed live.
+# Sessions the live state can't follow exactly (events out of time order, markers out of order, or a phases_duration
+# override) are analyzed as a full Participant instead, again each time new events came in (not on polls that found
+# nothing new). Once the 99 marker comes in, the session gets a full Participant analysis too, so its final state is
+# exactly what a run would report.
+
+DEFAULT_INTERVAL = 1.0
+SR_CODES = (SR_TARGET, SR_ALT)
+
+
+# Events of a session so far, in growing arrays (time sorted, as the session writes them)
+class EventBuffer:
+    def __init__(self):
+        self.length = 0
+        self.all_codes = np.zeros(1024, dtype=np.int16)
+        self.all_times = np.zeros(1024, dtype=np.int64)
+
+    @property
+    def codes(self):
+        return self.all_codes[:self.length]
+
+    @property
+    def times(self):
+        return self.all_times[:self.length]
+
+    def append(self, codes, times):
+        end = self.length + len(codes)
+        if end > len(self.all_codes):
+            capacity = max(end, 2 * len(self.all_codes))
+            self.all_codes = np.resize(self.all_codes, capacity)
+            self.all_times = np.resize(self.all_times, capacity)
+        self.all_codes[self.length:end] = codes
+        self.all_times[self.length:end] = times
+        self.length = end
+
+    # Number of events with one of 'event_types' and start <= time <= end, like exclusion.EventIndex.count
+    def count(self, event_types, start, end):
+        times = self.times
+        first, last = np.searchsorted(times, start, side='left'), np.searchsorted(times, end, side='right')
+        return int(np.count_nonzero(np.isin(self.codes[first:last], event_types)))
+
+
+class LiveParticipant:
+    def __init__(self, dir_path, file_path, config):
+        self.dir_path = dir_path
+        self.file_path = file_path
+        self.config = config
+        self.offset = 0  # Bytes of the file parsed so far, always whole lines
+        self.header = None
+        self.malformed = False
+        self.error = None
+        self.events = EventBuffer()
+        # Why the session is analyzed as a full Participant instead, None while the live state follows it
+        self.irregular = "phases_duration override" if 'phases_duration' in config else None
+        # Full analysis, for irregular sessions and once the session is over, of the first analyzed_events events
+        self.participant = None
+        self.analyzed_events = 0
+
+        self.type_response = None
+        self.phase = 0
+        self.counting = False  # Nothing is counted before the first SR (unless the participant had no phase 1)
+        self.phase_start = 0
+        self.phases_offset = [None, None, None]
+        self.phases_duration = [0, 0, 0]
+        self.bin_phase_2 = None
+        self.phase_3_latency = [-1000, -1000, -1000, -1000]
+        self.event_99_detected = False
+        # Counted events of the open phase 1 or 2, as (event code - 1, time) arrays, binned when the phase ends
+        self.pending = []
+
+    # Parses what was appended to the file since the last poll. Returns whether anything changed
+    def poll(self):
+        if self.malformed or self.error is not None:
+            return False
+        path = os.path.join(self.dir_path, self.file_path)
+        try:
+            with open(path, "rb") as file:
+                if os.fstat(file.fileno()).st_size < self.offset:
+                    # The file was rewritten from scratch
+                    self.__init__(self.dir_path, self.file_path, self.config)
+                file.seek(self.offset)
+                data = file.read()
+        except OSError as err:
+            self.error = str(err)
+            return True
+
+        # Only whole lines, the last one may still be being written
+        data = data[:data.rfind(b"\n") + 1]
+        if not data:
+            return False
+        try:
+            if self.header is None:
+                # Read from the start of the file until the header is complete
+                if not self.__read_header(data):
+                    return self.malformed
+                data = data[self.offset:]
+            self.offset += len(data)
+            self.__add_events(*parse_events(decode(data)))
+        except (ValueError, IndexError) as err:
+            self.error = repr(err)
+        return True
+
+    # Parses the header once it is complete, and moves self.offset to the first event line. Returns whether it did
+    def __read_header(self, data):
+        try:
+            header, events_start = parse_mapped_header(data)
+        except SessionCutOff:
+            # Not written up to the end of the list of events yet
+            return False
+        if header is None:
+            self.malformed = True
+            return False
+        self.header = header
+        self.offset = events_start
+        num_types = max(map(lambda event: int(event[0]), header.event_list))
+        self.type_response = np.zeros((num_types, 3, bins_needed(self.config)), dtype=np.int64)
+        self.counting = bool(header.no_phase_1)
+        self.phase = 1 if header.no_phase_1 else 0
+        return True
+
+    def __add_events(self, codes, times):
+        if len(codes) == 0:
+            return
+        if self.irregular is None and (np.any(np.diff(times) < 0) or
+                                       (self.events.length and times[0] < self.events.times[-1])):
+            self.irregular = "events out of time order"
+        self.events.append(codes, times)
+
+        if self.irregular is None:
+            self.__follow(codes, times)
+        if (self.irregular is not None or self.event_99_detected) and self.analyzed_events != self.events.length:
+            self.participant = Participant(self.dir_path, self.file_path, self.config,
+                                           (self.header, self.events.codes, self.events.times))
+            self.analyzed_events = self.events.length
+
+    # Updates the live state with new events, split at the events that change it (first SR, 30, 31, 99)
+    def __follow(self, codes, times):
+        controls = np.isin(codes, (END_OF_PHASE_1, END_OF_PHASE_2, END_OF_SESSION))
+        if not self.counting:
+            first_sr = np.flatnonzero(np.isin(codes, SR_CODES))[:1]
+            controls[first_sr] = True
+
+        position = 0
+        for control in np.flatnonzero(controls).tolist():
+            self.__add_plain(codes[position:control], times[position:control])
+            self.__add_control(int(codes[control]), int(times[control]))
+            if self.irregular is not None:
+                return
+            position = control + 1
+        self.__add_plain(codes[position:], times[position:])
+
+    # Events that don't change the phase
+    def __add_plain(self, codes, times):
+        if len(codes) == 0:
+            return
+        if self.phase == 2:
+            # First target/alt latency in phase 3 (recorded even before the first SR)
+            for slot, event_type in enumerate((TARGET_RESPONSE, ALT_RESPONSE)):
+                hits = np.flatnonzero(codes == event_type)
+                if self.phase_3_latency[slot] == -1000 and len(hits):
+                    self.phase_3_latency[slot] = int(times[hits[0]]) - self.phase_start
+        if not self.counting:
+            return
+
+        event_index = codes.astype(np.int64) - 1
+        if self.phase == 2:
+            segments = PhaseSegments(event_index, np.full(len(codes), 2), times - self.phase_start, None)
+            count_bins(segments, self.type_response, self.config)
+        else:
+            self.pending.append((event_index, times.copy()))
+
+    def __add_control(self, code, event_time):
+        if code in SR_CODES:
+            # The first SR is counted (from the previous phase start), starts the phase, and also counts as a
+            # target response in the first bin of its phase
+            self.counting = True
+            self.__add_plain(np.array([code], dtype=np.int16), np.array([event_time], dtype=np.int64))
+            self.phase_start = event_time
+            self.type_response[0, self.phase, 0] += 1
+        elif code == END_OF_SESSION:
+            if self.phase != 2:
+                self.irregular = "99 before the end of phase 2"
+                return
+            self.phases_offset[2] = event_time
+            self.phases_duration[2] = event_time - self.phase_start
+            self.event_99_detected = True
+        elif code == (END_OF_PHASE_1 if self.phase == 0 else END_OF_PHASE_2 if self.phase == 1 else None):
+            self.__end_phase(event_time)
+        elif code == END_OF_PHASE_2 and self.phase == 0 and self.__end_phase_1_reconstructed(event_time):
+            self.__end_phase(event_time)
+        else:
+            self.irregular = f"marker {code} out of order"
+
+    # Bins the held events of phase 1 or 2 backward from its end
+    def __end_phase(self, event_time):
+        phase = self.phase
+        if self.pending:
+            event_index = np.concatenate([index for (index, _) in self.pending])
+            times = np.concatenate([times for (_, times) in self.pending])
+        else:
+            event_index, times = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        segments = PhaseSegments(event_index, np.full(len(times), phase), event_time - times, None)
+        if phase == 1:
+            segments.phase_2_length = event_time - self.phase_start
+        bin_phase_2 = count_bins(segments, self.type_response, self.config)
+        if phase == 1:
+            self.bin_phase_2 = bin_phase_2
+
+        self.phases_offset[phase] = event_time
+        self.phases_duration[phase] = event_time - self.phase_start
+        self.pending = []
+        self.phase += 1
+        self.phase_start = event_time
+
+    # Ends phase 1 at the reconstructed 30 of a session whose 31 came first. The analysis sorts the reconstructed
+    # marker in after the events at its time, so the held events up to it are binned in phase 1 and the later ones
+    # are held again for phase 2. Returns whether it could, which needs the first SR to have come before the marker
+    # and the marker to be before the 31
+    def __end_phase_1_reconstructed(self, end_of_phase_2):
+        end_of_phase_1, _ = default_phase_ends(self.config)
+        if not (self.counting and self.phase_start <= end_of_phase_1 < end_of_phase_2):
+            return False
+        pending = self.pending
+        self.pending = [(event_index[times <= end_of_phase_1], times[times <= end_of_phase_1])
+                        for (event_index, times) in pending]
+        self.__end_phase(end_of_phase_1)
+        self.pending = [(event_index[times > end_of_phase_1], times[times > end_of_phase_1])
+                        for (event_index, times) in pending]
+        return True
+
+    # Each exclusion rule as {'excluded', 'reason'}, 'excluded' being None until the phases it looks at are over
+    def exclusion_indicators(self):
+        indicators = []
+        for rule in self.config.get('exclusion_rules', DEFAULT_EXCLUSION_RULES):
+            phases = [rule['phase']] + ([rule['reference']['phase']] if 'reference' in rule else [])
+            if any(self.phases_offset[phase - 1] is None for phase in phases):
+                indicators.append({'excluded': None, 'reason': rule['reason']})
+                continue
+            excluded, reason = evaluate_exclusion_rules([rule], self.events,
+                                                        [offset or 0 for offset in self.phases_offset])
+            indicators.append({'excluded': excluded, 'reason': reason or rule['reason']})
+        return indicators
+
+    # What the watch command reports. 'final' is set once the session is over (99) and was analyzed in full.
+    def state(self):
+        state = {'file': self.file_path, 'events': self.events.length, 'error': self.error,
+                 'malformed': self.malformed, 'irregular': self.irregular, 'final': False}
+        if self.header is None or self.error is not None:
+            return state
+
+        participant = self.participant
+        if participant is not None:
+            state.update({
+                'phase': None,
+                'type_response': participant.type_response,
+                'phases_duration': participant.phases_duration,
+                'bin_phase_2': participant.bin_phase_2,
+                'phase_3_latency': participant.phase_3_latency,
+                'event_99_detected': participant.event_99_detected,
+                'excluded': participant.excluded,
+                'exclusion_reason': participant.exclusion_reason,
+                'final': participant.event_99_detected,
+            })
+            return state
+
+        phases_duration = list(self.phases_duration)
+        if self.events.length and not self.event_99_detected:
+            # Time spent in the open phase so far
+            phases_duration[self.phase] = int(self.events.times[-1]) - self.phase_start
+        state.update({
+            'phase': self.phase + 1,
+            'counting': self.counting,
+            'type_response': self.type_response,
+            'phases_duration': phases_duration,
+            'bin_phase_2': self.bin_phase_2,
+            'phase_3_latency': self.phase_3_latency,
+            'event_99_detected': self.event_99_detected,
+            'exclusion': self.exclusion_indicators(),
+        })
+        return state
+
+
+# Polls the session files of dir_path every 'interval' seconds, writing the state of every file that changed as a
+# JSON line. Runs until is_cancelled() returns True, or with until_done, until every session is over (or failed).
+# config is the GUI's (bin_size in seconds).
+def watch(dir_path, config, interval=DEFAULT_INTERVAL, output_stream=sys.stdout, is_cancelled=None,
+          until_done=False):
+    participant_config = engine_config(config)
+
+    sessions = {}
+    while is_cancelled is None or not is_cancelled():
+        for file_path in session_files(dir_path):
+            if file_path not in sessions:
+                sessions[file_path] = LiveParticipant(dir_path, file_path, participant_config)
+
+        for session in sessions.values():
+            if session.poll():
+                output_stream.write(json.dumps(session.state(), default=_to_json) + "\n")
+        output_stream.flush()
+
+        if until_done and sessions and all(session.malformed or session.error is not None or (
+                session.participant is not None and session.participant.event_99_detected)
+                                           for session in sessions.values()):
+            return
+        time.sleep(interval)
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.integer):
+        return int(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
@@ -0,0 +1,164 @@
+import os, csv
+import numpy as np
+from manifest import StoredParticipant
+from latency import IRT_BIN_EDGES
+
+# Long (tidy) output: one row per value instead of one column per participant, so participants can be written as
+# they are analyzed and dropped right after (see engine.stream_analysis). Columns:
+#   participant, record, event_code, event_type, phase, bin, value
+# with one of these records per row:
+#   event              one per entry of the participant's list of events (event_code, event_type)
+#   count              responses of an event in one bin (phase and bin are 1-based), zeros included
+#   phase_duration     ms, per phase
+#   latency            first phase 3 response in ms, bin is the slot (0 target, 1 alt, 2 and 3 controls), empty if none
+#   first_latency      ms from the start of the phase to the first event of a code, empty if none (see latency.py)
+#   irt                inter-response times of a code in one IRT bin (0-based), only the bins that aren't empty
+#   excluded, exclusion_reason, event_99_detected, no_phase_1
+#   sr                 one per SR line of the header, bin is its position
+# read_long() turns the rows back into participants, so the wide summary can still be written from a long file.
+
+LONG_HEADER = ["participant", "record", "event_code", "event_type", "phase", "bin", "value"]
+LATENCY_SLOTS = ("Target Response", "Alt Response", "Control 1", "Control 2")
+
+
+def participant_rows(participant, config):
+    name = participant.file_path
+    rows = [[name, "event", event[0], event[1] if len(event) > 1 else "", "", "", ""]
+            for event in participant.event_list]
+
+    type_response = participant.type_response
+    if type_response is not None:
+        bins_per_phase = (config['bin_num_phase_1'], config['bin_num_phase_2_max'], config['bin_num_phase_3'])
+        for event in participant.event_list:
+            counts = type_response[int(event[0]) - 1]
+            for phase in range(3):
+                for bin_number in range(min(bins_per_phase[phase], type_response.shape[2])):
+                    rows.append([name, "count", event[0], event[1] if len(event) > 1 else "", phase + 1,
+                                 bin_number + 1, int(counts[phase, bin_number])])
+
+    if participant.first_latency is not None:
+        for i, event in enumerate(participant.event_list):
+            event_type = event[1] if len(event) > 1 else ""
+            for phase in range(3):
+                latency = participant.first_latency[i, phase]
+                rows.append([name, "first_latency", event[0], event_type, phase + 1, "",
+                             "" if np.isnan(latency) else int(latency)])
+            irt_counts = participant.irt_histogram[i]
+            for irt_bin in np.flatnonzero(irt_counts).tolist():
+                rows.append([name, "irt", event[0], event_type, "", irt_bin, int(irt_counts[irt_bin])])
+
+    for phase in range(3):
+        rows.append([name, "phase_duration", "", "", phase + 1, "", int(participant.phases_duration[phase])])
+    for slot, latency in enumerate(participant.phase_3_latency):
+        rows.append([name, "latency", "", LATENCY_SLOTS[slot], 3, slot, int(latency) if latency != -1000 else ""])
+    for i, line in enumerate(participant.sr):
+        rows.append([name, "sr", "", "", "", i, line])
+    rows += [
+        [name, "excluded", "", "", "", "", participant.excluded],
+        [name, "exclusion_reason", "", "", "", "", participant.exclusion_reason],
+        [name, "event_99_detected", "", "", "", "", participant.event_99_detected],
+        [name, "no_phase_1", "", "", "", "", participant.no_phase_1],
+    ]
+    return rows
+
+
+# Writes rows as participants come in. Use as a context manager: with LongWriter(path) as writer: writer.write(...)
+class LongWriter:
+    def __init__(self, out_path, config):
+        self.out_path = out_path
+        self.config = config
+        self.out_file = None
+        self.writer = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.out_path), exist_ok=True)
+        self.out_file = open(self.out_path, "w+", newline="")
+        self.writer = csv.writer(self.out_file)
+        self.writer.writerow(LONG_HEADER)
+        return self
+
+    def write(self, participant):
+        self.writer.writerows(participant_rows(participant, self.config))
+
+    def __exit__(self, *exc_info):
+        self.out_file.close()
+
+
+# Participants of a long file, in file order, as StoredParticipants (what the summary writers read)
+def read_long(long_path, dir_path):
+    participants = []
+    entry = None
+    with open(long_path, "r", newline="") as long_file:
+        reader = csv.reader(long_file)
+        next(reader)
+        for (name, record, event_code, event_type, phase, bin_number, value) in reader:
+            if entry is None or entry['file_path'] != name:
+                if entry is not None:
+                    participants.append(StoredParticipant(dir_path, _finish_entry(entry)))
+                entry = _new_entry(name)
+
+            if record == "event":
+                entry['event_list'].append([event_code, event_type])
+            elif record == "count":
+                entry['counts'].append((int(event_code) - 1, int(phase) - 1, int(bin_number) - 1, int(value)))
+            elif record == "first_latency":
+                entry['first_latencies'].append((event_code, int(phase) - 1, float(value) if value != "" else np.nan))
+            elif record == "irt":
+                entry['irts'].append((event_code, int(bin_number), int(value)))
+            elif record == "phase_duration":
+                entry['phases_duration'][int(phase) - 1] = int(value)
+            elif record == "latency":
+                entry['phase_3_latency'][int(bin_number)] = int(value) if value != "" else -1000
+            elif record == "sr":
+                entry['sr'].append(value)
+            elif record == "exclusion_reason":
+                entry['exclusion_reason'] = value
+            elif record == "no_phase_1":
+                entry['no_phase_1'] = None if value == "" else value == "True"
+            else:  # excluded, event_99_detected
+                entry[record] = value == "True"
+
+    if entry is not None:
+        participants.append(StoredParticipant(dir_path, _finish_entry(entry)))
+    return participants
+
+
+def _new_entry(name):
+    return {'file_path': name, 'no_phase_1': None, 'sr': [], 'event_list': [], 'counts': [],
+            'first_latencies': [], 'irts': [], 'phases_offset': [0, 0, 0], 'phases_duration': [0, 0, 0],
+            'bin_phase_2': None,
+            'phase_3_latency': [-1000, -1000, -1000, -1000], 'excluded': False, 'exclusion_reason': '',
+            'event_99_detected': False}
+
+
+# Turns the collected counts and latencies into the arrays of a manifest entry
+def _finish_entry(entry):
+    first_latencies, irts = entry.pop('first_latencies'), entry.pop('irts')
+    entry['first_latency'], entry['irt_histogram'] = None, None
+    if first_latencies:
+        rows = {}
+        for (i, event) in enumerate(entry['event_list']):
+            rows.setdefault(event[0], i)
+        first_latency = np.full((len(entry['event_list']), 3), np.nan)
+        for (event_code, phase, latency) in first_latencies:
+            first_latency[rows[event_code], phase] = latency
+        irt_histogram = np.zeros((len(entry['event_list']), len(IRT_BIN_EDGES)), dtype=np.int64)
+        for (event_code, irt_bin, count) in irts:
+            irt_histogram[rows[event_code], irt_bin] = count
+        entry['first_latency'] = np.where(np.isnan(first_latency), None, first_latency).tolist()
+        entry['irt_histogram'] = irt_histogram.tolist()
+
+    counts = entry.pop('counts')
+    entry['type_response'] = None
+    if counts:
+        num_types = max(int(event[0]) for event in entry['event_list'])
+        num_bins = max(bin_index for (_, _, bin_index, _) in counts) + 1
+        nonzero = [(event_index, phase, bin_index, count) for (event_index, phase, bin_index, count) in counts
+                   if count]
+        entry['type_response'] = {
+            'shape': [num_types, 3, num_bins],
+            'index': [(event_index * 3 + phase) * num_bins + bin_index
+                      for (event_index, phase, bin_index, _) in nonzero],
+            'count': [count for (_, _, _, count) in nonzero],
+        }
+    return entry
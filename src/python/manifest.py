@@ -0,0 +1,134 @@
+import os, json
+import numpy as np
+from binning import count_dtype
+from latency import latency_needed
+
+# Manifest of per-participant results for incremental runs (config['incremental']), kept in
+# <dir_path>/out/.incremental/manifest.json. Each session file's entry records the size and mtime it had when it
+# was analyzed, together with everything the summary writers read from its Participant, so unchanged files don't
+# have to be analyzed again. The whole manifest is dropped when the analysis config changes.
+
+# Config keys that don't change per-participant results (only how the run or the summary is done)
+NON_ANALYSIS_KEYS = ('workers', 'cache', 'clear_cache', 'cache_max_bytes', 'incremental', 'auto_exclude',
+                     'do_not_print', 'sweep', 'timings', 'timings_slowest', 'profile',
+                     'output', 'long_to_wide', 'event_store', 'read_ahead', 'read_latency',
+                     'bootstrap', 'file_timeout', 'max_file_bytes', 'latency_metrics', 'cue_codes', 'control_codes')
+
+
+def manifest_path(dir_path):
+    return os.path.join(dir_path, "out", ".incremental", "manifest.json")
+
+
+# The part of the config that the stored results depend on
+def analysis_config(config):
+    return {key: value for (key, value) in config.items() if key not in NON_ANALYSIS_KEYS}
+
+
+# Returns {file_path: entry} for the results produced with this config, empty if there are none
+def load(dir_path, config):
+    try:
+        with open(manifest_path(dir_path), "r") as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('config') != json.loads(json.dumps(analysis_config(config))):
+        return {}
+    return manifest['participants']
+
+
+def save(dir_path, config, entries):
+    path = manifest_path(dir_path)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp_path, "w") as manifest_file:
+            json.dump({'config': analysis_config(config), 'participants': entries}, manifest_file)
+        os.replace(temp_path, path)
+    except OSError:
+        # Without a manifest the next run simply analyzes every file again
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+# Whether the entry still stands for the file, and holds what the run reads: the latencies are only stored by runs
+# that needed them (see latency.latency_needed), latency_metrics and bootstrap not being analysis keys
+def is_current(entry, stat, config):
+    if entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+        return False
+    return not (latency_needed(config) and entry['type_response'] is not None and entry.get('first_latency') is None)
+
+
+def make_entry(participant, stat):
+    type_response = getattr(participant, 'type_response', None)
+    if type_response is not None:
+        # Counts are stored sparsely, most cells are empty
+        flat = type_response.reshape(-1)
+        nonzero = np.flatnonzero(flat)
+        type_response = {
+            'shape': list(type_response.shape),
+            'index': nonzero.tolist(),
+            'count': flat[nonzero].astype(np.int64).tolist(),
+        }
+
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'file_path': participant.file_path,
+        'no_phase_1': participant.no_phase_1,
+        'sr': participant.sr,
+        'event_list': participant.event_list,
+        'type_response': type_response,
+        'phases_offset': [int(offset) for offset in participant.phases_offset],
+        'phases_duration': [int(duration) for duration in participant.phases_duration],
+        'bin_phase_2': participant.bin_phase_2,
+        'phase_3_latency': [int(latency) for latency in participant.phase_3_latency],
+        'excluded': participant.excluded,
+        'exclusion_reason': participant.exclusion_reason,
+        'event_99_detected': participant.event_99_detected,
+        'first_latency': _nullable(participant.first_latency),
+        'irt_histogram': _nullable(participant.irt_histogram),
+        'responses': _nullable(getattr(participant, 'responses', None)),
+    }
+
+
+# Array as nested lists for JSON, NaN as None
+def _nullable(array):
+    if array is None:
+        return None
+    return np.where(np.isnan(array), None, array).tolist() if array.dtype.kind == 'f' else array.tolist()
+
+
+# A participant's results restored from the manifest. It carries the same attributes the summary writers read
+# from a Participant, without the events.
+class StoredParticipant:
+    __slots__ = ('dir_path', 'file_path', 'no_phase_1', 'sr', 'event_list', 'phases_offset', 'phases_duration',
+                 'bin_phase_2', 'phase_3_latency', 'excluded', 'exclusion_reason', 'event_99_detected',
+                 'type_response', 'first_latency', 'irt_histogram', 'responses')
+
+    def __init__(self, dir_path, entry):
+        self.dir_path = dir_path
+        self.file_path = entry['file_path']
+        self.no_phase_1 = entry['no_phase_1']
+        self.sr = entry['sr']
+        self.event_list = entry['event_list']
+        self.phases_offset = tuple(entry['phases_offset'])
+        self.phases_duration = entry['phases_duration']
+        self.bin_phase_2 = entry['bin_phase_2']
+        self.phase_3_latency = entry['phase_3_latency']
+        self.excluded = entry['excluded']
+        self.exclusion_reason = entry['exclusion_reason']
+        self.event_99_detected = entry['event_99_detected']
+
+        first_latency, irt = entry.get('first_latency'), entry.get('irt_histogram')
+        self.first_latency = None if first_latency is None else np.array(first_latency, dtype=float).reshape(-1, 3)
+        self.irt_histogram = None if irt is None else np.array(irt, dtype=np.int64).reshape(len(first_latency), -1)
+
+        # Not in the entries of older manifests, the summary then goes by the stored counts
+        responses = entry.get('responses')
+        self.responses = None if responses is None else np.array(responses, dtype=np.int64)
+
+        stored = entry['type_response']
+        self.type_response = None
+        if stored is not None:
+            self.type_response = np.zeros(stored['shape'], dtype=count_dtype(max(stored['count'], default=0)))
+            self.type_response.reshape(-1)[stored['index']] = stored['count']
@@ -0,0 +1,257 @@
+import os, re, mmap, warnings
+import numpy as np
+
+# Session files of at least MAPPED_MIN_BYTES are parsed from a memory map, CHUNK_BYTES of event lines at a time
+# (read_session_mapped), instead of being read into one string, so a multi-hour recording with millions of events
+# only needs memory for its arrays and one chunk.
+MAPPED_MIN_BYTES = 16 * 1024 * 1024
+CHUNK_BYTES = 4 * 1024 * 1024
+# First read of the header of a mapped file, doubled until the header fits
+HEAD_BYTES = 64 * 1024
+LINE_END = re.compile(rb"\r\n|\r|\n")
+
+# Limits on what a session file can be, so a damaged or unrelated file fails fast with a SessionError instead of
+# being read for ever: its size (config['max_file_bytes'] where a config is at hand), the lines above the event
+# lines, the length of each of them, and the entries of the list of events.
+MAX_FILE_BYTES = 2 * 1024 * 1024 * 1024
+MAX_HEADER_LINES = 10000
+MAX_HEADER_LINE_CHARS = 10000
+MAX_EVENT_TYPES = 1000
+
+
+# A session file that can't be parsed. A ValueError, which is what the parse raised before the limits
+class SessionError(ValueError):
+    pass
+
+
+# The file ends inside the header, e.g. the header of a session that is still being written
+class SessionCutOff(SessionError):
+    pass
+
+
+def check_size(size, max_bytes=MAX_FILE_BYTES):
+    if size > max_bytes:
+        raise SessionError(f"File is {size} bytes, more than the {max_bytes} bytes a session file can be")
+
+
+# Text of bytes of a session file. Raises SessionError if they aren't text
+def decode(data):
+    try:
+        return data.decode()
+    except UnicodeDecodeError:
+        raise SessionError("File is not text") from None
+
+
+# file.read() of a session file opened in text mode. Raises SessionError if it isn't text
+def read_all(file):
+    try:
+        return file.read()
+    except UnicodeDecodeError:
+        raise SessionError("File is not text") from None
+
+
+# Everything found above the event lines of a session file.
+# 'event_list' keeps the ['01', 'Target Response'] pairs exactly as written in the LIST OF EVENTS block.
+class SessionHeader:
+    def __init__(self):
+        self.no_phase_1 = None
+        self.sr = []
+        self.event_list = []
+
+
+# Reads one line starting at 'position', the way file.readline() would ('' once the text is exhausted)
+def _read_line(text, position):
+    end = text.find("\n", position)
+    end = len(text) if end == -1 else end + 1
+    return text[position:end], end
+
+
+# _read_line() for the header, which can only have so many lines of so many characters
+def _read_header_line(text, position, line_number):
+    if line_number > MAX_HEADER_LINES:
+        raise SessionError(f"No event lines within the first {MAX_HEADER_LINES} lines")
+    current_line, position = _read_line(text, position)
+    if len(current_line) > MAX_HEADER_LINE_CHARS:
+        raise SessionError(f"Line {line_number} is longer than {MAX_HEADER_LINE_CHARS} characters")
+    return current_line, position
+
+
+# Parses the header block of a session file.
+# Returns (header, events_start) where events_start is the offset of the first event line ('NN) time'),
+# or (None, 0) if the file does not begin with 'Start:'. Raises SessionError for a header that is cut off, malformed
+# or over the limits.
+def parse_header(text):
+    if text[:6] != "Start:":
+        return None, 0
+
+    header = SessionHeader()
+    line_number = 1
+    current_line, position = _read_header_line(text, 6, line_number)
+
+    # Skip all lines that don't start with 'LIST OF EVENTS', picking up the noPhase1 flag and SR info on the way
+    while not current_line.startswith("LIST OF EVENTS"):
+        line_number += 1
+        current_line, position = _read_header_line(text, position, line_number)
+        if current_line == "":
+            raise SessionCutOff("Reached end of file before 'LIST OF EVENTS'")
+
+        if current_line.startswith("noPhase1:"):
+            # 0 or 1 value here is converted to a boolean for clarity
+            fields = current_line.split()
+            if len(fields) < 2 or not fields[1].lstrip("+-").isdigit():
+                raise SessionError(f"Line {line_number}: malformed noPhase1 flag '{current_line.rstrip()}'")
+            header.no_phase_1 = bool(int(fields[1]))
+
+        if current_line.startswith(("totalSR:", "srPhase1:", "srPhase2:", "srPhase3:")):
+            header.sr.append(current_line.rstrip())
+
+    # The list of events ends with a blank line
+    line_number += 1
+    current_line, position = _read_header_line(text, position, line_number)
+    while not current_line == "\n":
+        if current_line == "":
+            raise SessionCutOff("Reached end of file inside 'LIST OF EVENTS'")
+        event = current_line.rstrip().split(": ")
+        if not event[0].strip().isdigit():
+            raise SessionError(f"Line {line_number}: malformed entry '{current_line.rstrip()}' in 'LIST OF EVENTS'")
+        if len(header.event_list) == MAX_EVENT_TYPES:
+            raise SessionError(f"More than {MAX_EVENT_TYPES} entries in 'LIST OF EVENTS'")
+        header.event_list.append(event)
+        line_number += 1
+        current_line, position = _read_header_line(text, position, line_number)
+
+    # Events begin at the first line with a ')' in it
+    while ")" not in current_line:
+        if current_line == "":
+            return header, len(text)
+        line_number += 1
+        current_line, position = _read_header_line(text, position, line_number)
+
+    return header, position - len(current_line)
+
+
+# Parses the event lines ('NN) time') into two arrays: int16 event codes and int64 timestamps.
+# Lines without a ')' are ignored, other lines that aren't 'NN) time' raise SessionError.
+def parse_events(text, start=0):
+    section = text[start:]
+    num_events = section.count(")")
+
+    # Fast path: with the ')' removed, the section is just whitespace separated integers
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        try:
+            values = np.fromstring(section.replace(")", " "), dtype=np.int64, sep=" ")
+        except ValueError:
+            # Text numpy can't read past
+            values = None
+
+    # Anything else (stray text, blank-less junk lines) goes through the line by line parse
+    if values is None or len(values) != 2 * num_events:
+        event_lines = [event_line for event_line in section.splitlines() if ")" in event_line]
+        values = np.zeros(2 * len(event_lines), dtype=np.int64)
+        for i, event_line in enumerate(event_lines):
+            fields = event_line.split()
+            try:
+                values[2 * i:2 * i + 2] = int(fields[0][:-1]), int(fields[1])
+            except (ValueError, IndexError, OverflowError):
+                raise SessionError(f"Malformed event line '{event_line[:100]}'")
+
+    return values[0::2].astype(np.int16), values[1::2].copy()
+
+
+# Parses a whole session file from its text. Returns (header, codes, times), header being None for files
+# that do not begin with 'Start:' (codes and times are then None too)
+def parse_session(text):
+    header, events_start = parse_header(text)
+    if header is None:
+        return None, None, None
+    codes, times = parse_events(text, events_start)
+    return header, codes, times
+
+
+def read_session(path, max_bytes=MAX_FILE_BYTES):
+    size = os.path.getsize(path)
+    check_size(size, max_bytes)
+    if size >= MAPPED_MIN_BYTES:
+        return read_session_mapped(path)
+    with open(path, "r") as file:
+        return parse_session(read_all(file))
+
+
+# read_session() for big files: same result, parsed from a memory map a chunk at a time
+def read_session_mapped(path, chunk_bytes=CHUNK_BYTES):
+    with open(path, "rb") as file:
+        # mmap can't map an empty file, which doesn't begin with 'Start:' either
+        if os.fstat(file.fileno()).st_size == 0:
+            return None, None, None
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            header, events_start = parse_mapped_header(mapped)
+            if header is None:
+                return None, None, None
+            codes, times = _parse_mapped_events(mapped, events_start, chunk_bytes)
+            return header, codes, times
+
+
+# parse_header() on the head of a mapped file (or the bytes of one). Returns (header, byte offset of the first event
+# line)
+def parse_mapped_header(mapped):
+    head_bytes = HEAD_BYTES
+    while True:
+        whole_file = head_bytes >= len(mapped)
+        head = mapped[:head_bytes]
+        if not whole_file:
+            # Whole lines only, so no character or line end is cut in half
+            head = head[:head.rfind(b"\n") + 1]
+        # Line ends as reading in text mode would translate them
+        text = decode(head).replace("\r\n", "\n").replace("\r", "\n")
+
+        try:
+            header, events_start = parse_header(text)
+        except SessionCutOff:
+            # Cut off inside the header
+            if whole_file:
+                raise
+            header, events_start = None, len(text)
+        if text[:6] != "Start:" and (len(text) >= 6 or whole_file):
+            return None, 0
+        if header is not None and (whole_file or events_start < len(text)):
+            break
+        head_bytes *= 2
+
+    # The event lines start after as many line ends in the file as there are in the translated text
+    lines = text[:events_start].count("\n")
+    if lines == 0:
+        return header, 0
+    for (i, line_end) in enumerate(LINE_END.finditer(head)):
+        if i == lines - 1:
+            return header, line_end.end()
+    return header, len(head)
+
+
+# parse_events() over the event lines of a mapped file, a chunk of whole lines at a time. The arrays are allocated
+# once, for as many events as there are ')' in the file, and filled chunk by chunk.
+def _parse_mapped_events(mapped, start, chunk_bytes):
+    capacity = sum(mapped[offset:offset + chunk_bytes].count(b")") for offset in range(start, len(mapped), chunk_bytes))
+    codes = np.empty(capacity, dtype=np.int16)
+    times = np.empty(capacity, dtype=np.int64)
+
+    num_events = 0
+    position = start
+    while position < len(mapped):
+        end = min(position + chunk_bytes, len(mapped))
+        if end < len(mapped):
+            # Up to the last line end of the chunk, or the first one after it for a line longer than a chunk
+            line_end = mapped.rfind(b"\n", position, end)
+            if line_end == -1:
+                line_end = mapped.find(b"\n", end)
+            end = len(mapped) if line_end == -1 else line_end + 1
+
+        chunk_codes, chunk_times = parse_events(decode(mapped[position:end]))
+        codes[num_events:num_events + len(chunk_codes)] = chunk_codes
+        times[num_events:num_events + len(chunk_times)] = chunk_times
+        num_events += len(chunk_codes)
+        position = end
+
+    if num_events == capacity:
+        return codes, times
+    return codes[:num_events].copy(), times[:num_events].copy()
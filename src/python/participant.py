@@ -1,45 +1,74 @@
+import copy
 import json
 from json import JSONEncoder
-import os
-import math
-from operator import itemgetter
 import numpy as np
+from binning import segment_events, count_bins, bins_needed, count_dtype, END_OF_PHASE_1, END_OF_PHASE_2, \
+    END_OF_SESSION
+from exclusion import EventIndex, evaluate_exclusion_rules, DEFAULT_EXCLUSION_RULES
+import cache
+from parsing import SessionError
+from timing import stage_clock
+from latency import event_codes_of, first_latency_matrix, irt_histogram, latency_needed
+from results import participant_record, typed_array
 
 
-# self.config = {
+# config = {
 #     'bin_size': 60000,
 #     'bin_num_phase_1': 5,
 #     'bin_num_phase_2_max': 5,
 #     'bin_num_phase_3': 5,
+#     'workers': 1,  # >1 parses participants on a process pool, 0 uses one worker per core
+#     'exclusion_rules': [...],  # optional, defaults to exclusion.DEFAULT_EXCLUSION_RULES
+#     'cache': True,  # parsed sessions are cached under out/.cache/ (see cache.py)
+#     'file_timeout': 60,  # seconds a file can take before it is given up on (see engine._guarded)
+#     'max_file_bytes': 2 * 1024 ** 3,  # bigger files aren't parsed (see parsing.py)
 # }
 
 
+# Where missing 30/31 markers are reconstructed: after the configured length of phases 1 and 2
+def default_phase_ends(config):
+    phase_1_timestamp = int(config['bin_size']) * int(config['bin_num_phase_1'])
+    phase_2_timestamp = int(config['bin_size']) * int(config['bin_num_phase_2_max']) + phase_1_timestamp
+    return phase_1_timestamp, phase_2_timestamp
+
+
 # Our participant class. Each participant corresponds to one .csv file
 # which is stored in the 'filepath' variable. On init, python will analyze
 # the participant's file and store all necessary info in the Participant class.
+# An already parsed (header, codes, times) can be passed as 'session' to skip reading the file.
+# Once analyzed, only the results are kept: the events (codes, times, segments) are released unless keep_events
+# is set, e.g. to rebin the participant afterwards, and the config isn't referenced.
 class Participant:
-    def __init__(self, dir_path, file_path, config):
+    __slots__ = ('dir_path', 'file_path', 'error', 'no_phase_1', 'num_of_events', 'codes', 'times',
+                 'phase_3_latency', 'phases_offset', 'segments', 'phases_duration', 'bin_phase_2', 'excluded',
+                 'exclusion_reason', 'sr', 'event_list', 'event_99_detected', 'type_response', 'timings',
+                 'first_latency', 'irt_histogram', 'responses')
+
+    def __init__(self, dir_path, file_path, config, session=None, keep_events=False):
         self.dir_path = dir_path
         self.file_path = file_path
         self.error = None
-        self.config = config
+        clock = stage_clock(config)
 
         # Instantiate variables
 
         # These will be initialized by extract_event_markers()
         self.no_phase_1 = None
         self.num_of_events = None
-        self.events = None
+        self.codes = None
+        self.times = None
 
         # These will be initialized (or set) by analyze_event_markers
         self.phase_3_latency = [-1000, -1000, -1000, -1000]  # Initialize with -1000ms latency for each phase
         self.phases_offset = (0, 0, 0)
+        self.segments = None  # binning.PhaseSegments, kept with keep_events so the participant can be rebinned
 
         # We found that event markers 30 and 31 (end of phases 1 and 2) were not present in all participant files
         # So, if that is found to be the case, then this script will tell the GUI this, and a manual override
         # will be allowed. In that case, the phase durations will be manually set.
-        if 'phases_duration' in self.config:
-            self.phases_duration = self.config['phases_duration']
+        # The override list is copied, as each participant overwrites its own durations during analysis.
+        if 'phases_duration' in config:
+            self.phases_duration = list(config['phases_duration'])
         else:
             self.phases_duration = [0, 0, 0]
 
@@ -52,232 +81,112 @@ class Participant:
         self.event_list = []
         self.event_99_detected = False
 
+        # Counts per (event code - 1, phase, bin), see __extract_event_markers()
+        self.type_response = None
+        # Binned events per event code - 1, bins that aren't stored included (see summary.write_summary)
+        self.responses = None
+        # Per event of event_list: first latency in each phase and inter-response times (see latency.py), only
+        # computed when the run reads them (latency.latency_needed)
+        self.first_latency = None
+        self.irt_histogram = None
+
         # File analysis
 
         # First, we want to extract all the event markers from the file,
         # The rest of analysis will only depend on these events.
-        self.__extract_event_markers()
+        self.__extract_event_markers(session, config)
+        clock.lap('parse')
 
         # Next, we want to analyze all the events to generate the
         # summary that will be used to create new csv file
         if not self.excluded:
-            self.__analyze_event_markers()
+            self.__analyze_event_markers(config, clock)
+
+        # Seconds spent per stage when config['timings'] is set (see timing.py), None otherwise
+        self.timings = clock.stages
+
+        if not keep_events:
+            self.release_events()
 
     # Private function to be used during initialization
-    def __extract_event_markers(self):
+    def __extract_event_markers(self, session, config):
         # TODO: Check on Windows to see if this properly escapes ANY filepath
-        file = open(os.path.join(self.dir_path, self.file_path), "r")
-        # Reads first 6 bytes (in this case letters/nums)
-        # If line doesn't begin with 'Start:', ignore rest of initialization
-        if file.readline(6) != "Start:":
+        # Served from out/.cache/ when the file hasn't changed since it was last parsed
+        if session is None:
+            session = cache.load_session(self.dir_path, self.file_path, config)
+        header, codes, times = session
+
+        # If file doesn't begin with 'Start:', ignore rest of initialization
+        if header is None:
             # TODO: do something if reached
             self.excluded = True
             self.exclusion_reason = f"File {self.file_path} does not begin with 'Start:'"
         else:
-            current_line = file.readline()
-
-            # Skip all lines that don't start with 'LIST OF EVENTS'. We have now reached the beginning of the event list.
-            # We need to dynamically find the END of this list - which is marked by a blank line.
-            while not current_line.startswith("LIST OF EVENTS"):
-                current_line = file.readline()
-
-                if current_line.startswith("noPhase1:"):
-                    # Checks if participant went through phase 1.
-                    # 0 or 1 value here is converted to a boolean for clarity
-                    self.no_phase_1 = bool(int(current_line.rstrip().split()[1]))
-
-                if current_line.startswith("totalSR:"):
-                    self.sr.append(current_line.rstrip())
-                if current_line.startswith("srPhase1:"):
-                    self.sr.append(current_line.rstrip())
-                if current_line.startswith("srPhase2:"):
-                    self.sr.append(current_line.rstrip())
-                if current_line.startswith("srPhase3:"):
-                    self.sr.append(current_line.rstrip())
-
-            current_line = file.readline()  # go to the first event
-            # At this point, the file reader is at the list of events, so we need to keep reading until blank line
-            while not current_line == "\n":
-                self.event_list.append(current_line.rstrip().split(": "))
-
-                current_line = file.readline()
-
-            # Instead of fixing the format, we will read until a line has a ')' in it, marking the beginning of the events list
-            last_position = file.tell()
-            while ")" not in current_line:
-                current_line = file.readline()
-                last_position = file.tell()
-
-            # Rewind file pointer back to beginning of current_line
-            file.seek(last_position - len(current_line))
-
-            self.type_response = np.zeros((max(map(lambda event: int(event[0]), self.event_list)), 3, 30))
-
-            # self.type_response = np.zeros((16, 3, 30))  # (response types, phases, max bins)
-            # Now the readlines (which starts at current iterator position)
-            # will give us beginning of events
-
-            # Below line will take care of:
-            #   - Filtering out lines with only a newline
-            #   - Filtering out empty lines ('')
-            #   - Splitting event and time into tuple
-            #   - Deleting ')' from each event type ('02)' turns into '02')
-
-            event_lines = [tuple([event_line.rstrip().split()[0][:-1], int(event_line.rstrip().split()[1])]) for
-                           event_line
-                           in file.readlines() if (event_line != '\n' and event_line != '' and ")" in event_line)]
-            self.events = event_lines
-            self.num_of_events = len(event_lines)
+            self.no_phase_1 = header.no_phase_1
+            self.sr = header.sr
+            self.event_list = header.event_list
 
-    # Private function to be used during initialization
-    def __analyze_event_markers(self):
-        current_phase = 1 if self.no_phase_1 else 0  # If no_phase_1 -> start with phase 2, else start w/ 1
-        current_phase_start_time = 0
-        first_sr = True if self.no_phase_1 else False
+            # Event codes ('02)' -> 2) and their timestamps, in file order
+            self.codes = codes
+            self.times = times
+            self.num_of_events = len(codes)
+            if self.num_of_events == 0:
+                raise SessionError("No event lines")
+
+            self.type_response = self.__empty_counts(config)
 
-        phase_1_timestamp = int(self.config['bin_size']) * int(self.config['bin_num_phase_1'])
-        phase_2_timestamp = int(self.config['bin_size']) * int(
-            self.config['bin_num_phase_2_max']) + phase_1_timestamp
+    # Private function to be used during initialization
+    def __analyze_event_markers(self, config, clock):
+        phase_1_timestamp, phase_2_timestamp = default_phase_ends(config)
 
         # Grabs the end times of each phase (this relies on there only being one entry starting
         # with '30)', '31)', and '99)', unless a manual duration override is supplied.
-        if 'phases_duration' in self.config:
+        if 'phases_duration' in config:
             self.phases_offset = (
                 self.phases_duration[0],  # End of phase 1
                 self.phases_duration[0] + self.phases_duration[1],  # End of phase 2
                 sum(self.phases_duration)  # End of phase 3
             )
         else:
-            # next() accepts a default, so if '99' is not found, then it will be the max time
+            # Missing markers fall back to the configured phase lengths, and a missing '99' to the max time
             self.phases_offset = (
-                next((time for (event_type, time) in self.events if (event_type == "30")),
-                     phase_1_timestamp),
-                next((time for (event_type, time) in self.events if (event_type == "31")),
-                     phase_2_timestamp),
-                next((time for (event_type, time) in self.events if (event_type == "99")),
-                     max(self.events, key=lambda event: event[1])[1])
+                self.__first_time_of(END_OF_PHASE_1, phase_1_timestamp),
+                self.__first_time_of(END_OF_PHASE_2, phase_2_timestamp),
+                self.__first_time_of(END_OF_SESSION, int(self.times.max()))
             )
 
         # reconstruct missing end of phase event markers if need be
-        end_of_phase_1_found = len([time for (event_type, time) in self.events if (event_type == "30")]) > 0
-        end_of_phase_2_found = len([time for (event_type, time) in self.events if (event_type == "31")]) > 0
+        end_of_phase_1_found = np.any(self.codes == END_OF_PHASE_1)
+        end_of_phase_2_found = np.any(self.codes == END_OF_PHASE_2)
         if not end_of_phase_1_found:
-            self.events.append(("30", phase_1_timestamp))
+            self.codes = np.append(self.codes, np.int16(END_OF_PHASE_1))
+            self.times = np.append(self.times, phase_1_timestamp)
         if not end_of_phase_2_found:
-            self.events.append(("31", phase_2_timestamp))
-
-        self.events.sort(key=lambda event: event[1])
-
-        for event_marker in self.events:
-            event_type, event_time = event_marker
-            time_till_phase_end = self.phases_offset[current_phase] - event_time
-            time_since_phase_begin = event_time - current_phase_start_time
-
-            if event_type == "17" or event_type == "18":  # First SR -> Starts phase1 (skipped for noPhase1)
-                if not first_sr:
-                    first_sr = True
-                    # current_phase += 1  # Commenting out -> we started out in phase 1 (current_phase = 0)
-                    current_phase_start_time = event_time
-                    self.__assign_forward(0, current_phase, 0)
-
-            if event_type == "30":  # End of phase 1
-                self.phases_duration[0] = event_time - current_phase_start_time
-                current_phase += 1
-                current_phase_start_time = event_time
-
-            elif event_type == "31":  # End of phase 2
-                # Calculate #bins in Phase 2 first
-                self.bin_phase_2 = math.floor((event_time - current_phase_start_time) / self.config['bin_size'])
-
-                self.phases_duration[1] = event_time - current_phase_start_time
-                current_phase += 1
-                current_phase_start_time = event_time
-
-            elif event_type == "99":  # End of phase 3
-                self.phases_duration[2] = event_time - current_phase_start_time
-                self.event_99_detected = True
-
-            elif event_type == "01":  # Target response
-                if current_phase == 0 or current_phase == 1:
-                    if first_sr:
-                        self.__assign_backward(int(event_type) - 1, current_phase, time_till_phase_end)
-                elif current_phase == 2:
-                    if first_sr:
-                        self.__assign_forward(int(event_type) - 1, current_phase, time_since_phase_begin)
-                    if self.phase_3_latency[0] == -1000:
-                        self.phase_3_latency[0] = time_since_phase_begin
-
-            elif event_type == "02":  # Alt response
-                if current_phase == 0 or current_phase == 1:
-                    if first_sr:
-                        self.__assign_backward(int(event_type) - 1, current_phase, time_till_phase_end)
-                elif current_phase == 2:
-                    if first_sr:
-                        self.__assign_forward(int(event_type) - 1, current_phase, time_since_phase_begin)
-                    if self.phase_3_latency[1] == -1000:
-                        self.phase_3_latency[1] = time_since_phase_begin
-
-            else:  # All other response types
-                if current_phase == 0 or current_phase == 1:
-                    if first_sr:
-                        self.__assign_backward(int(event_type) - 1, current_phase, time_till_phase_end)
-                elif current_phase == 2:
-                    if first_sr:
-                        self.__assign_forward(int(event_type) - 1, current_phase, time_since_phase_begin)
-
-        # Check if phase3 duration was recorded
-        if self.phases_duration[2] == 0:
-            # if not initialized -> set it in accordance of max time
-            self.phases_duration[2] = self.phases_offset[2] - current_phase_start_time
-
-        # Check exclusion reasons
-
-        # 1. There are zero target and zero alt responses in the last 2 minutes of phase 1
-
-        phase_1_end = self.phases_offset[0]
-        phase_1_end_minus_two_mins = phase_1_end - 120000 if phase_1_end - 120000 > 0 else 0
-
-        last_2_mins_of_phase_1_tr = list(
-            filter(lambda evt: evt[0] == "01" and phase_1_end_minus_two_mins <= evt[1] <= phase_1_end,
-                   self.events))
-        last_2_mins_of_phase_1_ar = list(
-            filter(lambda evt: evt[0] == "02" and phase_1_end_minus_two_mins <= evt[1] <= phase_1_end,
-                   self.events))
-        if len(last_2_mins_of_phase_1_ar) == 0 and len(last_2_mins_of_phase_1_tr) == 0:
-            self.excluded = True
-            self.exclusion_reason = "Zero target and zero alt responses in last 2 minutes of Phase 1"
-
-        # 2. There are zero target and zero alt responses in the last 2 minutes of phase 2
-
-        phase_2_end = self.phases_offset[1]
-        phase_2_end_minus_two_mins = phase_2_end - 120000
-
-        last_2_mins_of_phase_2_tr = list(
-            filter(lambda evt: evt[0] == "01" and phase_2_end_minus_two_mins <= evt[1] <= phase_2_end,
-                   self.events))
-
-        last_2_mins_of_phase_2_ar = list(
-            filter(lambda evt: evt[0] == "02" and phase_2_end_minus_two_mins <= evt[1] <= phase_2_end,
-                   self.events))
-
-        if len(last_2_mins_of_phase_2_ar) == 0 and len(last_2_mins_of_phase_2_tr) == 0:
-            self.excluded = True
-            self.exclusion_reason = "Zero target and zero alt responses in last 2 minutes of Phase 2"
-
-        # 3. Target responding has not decreased to 50% of the phase-1 levels
-        # Check if # of target responses in last min of phase 2 is less than 50% of last min of phase 1
-
-        phase_1_end_minus_one_min = phase_1_end - 60000 if phase_1_end - 60000 > 0 else 0
-        last_1_min_p1_tr = list(
-            filter(lambda evt: evt[0] == "01" and phase_1_end_minus_one_min <= evt[1] <= phase_1_end, self.events))
-        phase_2_end_minus_one_min = phase_2_end - 60000 if phase_2_end - 60000 > 0 else 0
-        last_1_min_p2_tr = list(
-            filter(lambda evt: evt[0] == "01" and phase_2_end_minus_one_min <= evt[1] <= phase_2_end, self.events))
-
-        # If responding has not decreased to 50% of phase 1, exclude
-        if len(last_1_min_p2_tr) >= (0.5 * len(last_1_min_p1_tr)):
-            self.excluded = True
-            self.exclusion_reason = f"Target responding has not decreased to 50% of phase 1 levels. Phase 1 level (last minute): {len(last_1_min_p1_tr)}, Phase 2 level (last minute): {len(last_1_min_p2_tr)}"
+            self.codes = np.append(self.codes, np.int16(END_OF_PHASE_2))
+            self.times = np.append(self.times, phase_2_timestamp)
+
+        # Stable, so reconstructed markers land after any events sharing their timestamp
+        order = np.argsort(self.times, kind='stable')
+        self.codes = self.codes[order]
+        self.times = self.times[order]
+
+        self.segments = segment_events(self.codes, self.times, self.phases_offset, self.phases_duration,
+                                       self.no_phase_1)
+        self.phase_3_latency = self.segments.phase_3_latency
+        self.event_99_detected = self.segments.event_99_detected
+        self.responses = np.zeros(self.type_response.shape[0], dtype=np.int64)
+        self.bin_phase_2 = count_bins(self.segments, self.type_response, config, self.responses)
+        # Left at None unless the run reads them
+        if latency_needed(config):
+            event_codes = event_codes_of(self.event_list)
+            self.first_latency = first_latency_matrix(self.segments, event_codes)
+            self.irt_histogram = irt_histogram(self.codes, self.times, event_codes)
+        clock.lap('analysis')
+
+        # Check exclusion reasons (see exclusion.py for the default rules)
+        self.excluded, self.exclusion_reason = evaluate_exclusion_rules(
+            config.get('exclusion_rules', DEFAULT_EXCLUSION_RULES), EventIndex(self.codes, self.times),
+            self.phases_offset)
 
         # If 99 was not detected, (some csvs were cut off in earlier experiments)
         # then do NOT exclude, instead give exclusion reason to be 'cut-off', so that when producing summary,
@@ -285,46 +194,50 @@ class Participant:
         if not self.event_99_detected:
             self.excluded = False
             self.exclusion_reason = "Cut-Off"
-
-    # Helper Functions (named bin as _bin b/c python uses that name elsewhere - just to be safe)
-    def __assign_backward(self, event_type, phase, time_till_phase_end):
-        _bin, bin_size = 0, self.config['bin_size']
-        bin_num_phase_1, bin_num_phase_2_max = itemgetter('bin_num_phase_1', 'bin_num_phase_2_max')(self.config)
-        if phase == 0:
-            _bin = bin_num_phase_1 - math.floor(time_till_phase_end / bin_size)  # Round down first
-        elif phase == 1:
-            _bin = bin_num_phase_2_max - math.floor(time_till_phase_end / bin_size)  # Round down first
-
-        if _bin > 0:
-            current_bin_count = self.type_response[event_type][phase][_bin - 1]
-            if (current_bin_count < 300):
-                self.type_response[event_type][phase][_bin - 1] += 1
-            else:
-                self.type_response[event_type][phase][_bin - 1] += 1
-                # self.excluded = True
-                # self.exclusion_reason = f"Too many responses in bin {_bin} in phase {phase + 1} for event {event_type + 1} ({int(current_bin_count + 1)})"
-
-    def __assign_forward(self, event_type, phase, time_since_phase_begin):
-        # Same issue with time_since_phase_begin, may be incorrectly named, but program should
-        # work the same - OG var name was again 'time'
-        bin_size = self.config['bin_size']
-        _bin = math.floor(time_since_phase_begin / bin_size) + 1  # Round down first, then +1 (same as round up)
-        current_bin_count = self.type_response[event_type][phase][_bin - 1]
-        if (current_bin_count < 300):
-            self.type_response[event_type][phase][_bin - 1] += 1
-        else:
-            self.type_response[event_type][phase][_bin - 1] += 1
-            # self.excluded = True
-            # self.exclusion_reason = f"Too many responses in bin {_bin + 1} in phase {phase + 1} for event {event_type + 1} ({int(current_bin_count + 1)})"
+        clock.lap('exclusion')
+
+    # Returns a copy of this participant binned with another bin_size / bin counts, without touching the events
+    # again. Only valid while the phase split doesn't change, i.e. no 30/31 marker had to be reconstructed from
+    # the bin settings (see sweep.py).
+    # The participant must have been created with keep_events.
+    def rebinned(self, config):
+        other = copy.copy(self)
+        other.phases_duration = list(self.phases_duration)
+        if self.type_response is not None:
+            if self.segments is None:
+                raise ValueError(f"Participant {self.file_path} can't be rebinned, its events were released")
+            other.type_response = self.__empty_counts(config)
+            other.responses = np.zeros(other.type_response.shape[0], dtype=np.int64)
+            other.bin_phase_2 = count_bins(self.segments, other.type_response, config, other.responses)
+        return other
+
+    # Drops the events, keeping only the analysis results
+    def release_events(self):
+        self.codes = None
+        self.times = None
+        self.segments = None
+
+    # Zeroed counts for every event code up to the highest one in the event list, with only as many bins as the
+    # config uses, in the smallest dtype that can't overflow (each event is counted once, the first SR twice)
+    def __empty_counts(self, config):
+        num_types = max(map(lambda event: int(event[0]), self.event_list))
+        return np.zeros((num_types, 3, bins_needed(config)), dtype=count_dtype(self.num_of_events + 1))
+
+    # First timestamp of the given event code, or 'default' if it never occurs
+    def __first_time_of(self, event_type, default):
+        matches = np.flatnonzero(self.codes == event_type)
+        return int(self.times[matches[0]]) if len(matches) else default
 
 
 # Our custom encoder, which allows each participant object to be
 # JSON serializable. AKA if we ever want to send participant info to
 # the JavaScript GUI, we can send it JSON formatted, so it can
-# understand it.
+# understand it. Participants are sent as their results only (see results.participant_record), not their events
+# or config, and arrays as typed arrays.
 class ParticipantEncoder(JSONEncoder):
     def default(self, o):
         if isinstance(o, np.ndarray):
-            return o.tolist()
-        else:
-            return o.__dict__
+            return typed_array(o)
+        elif hasattr(o, 'type_response') and hasattr(o, 'file_path'):
+            return participant_record(o)
+        return super().default(o)
@@ -1,34 +1,75 @@
-import sys, json, os, time
-from engine import AnalysisEngine
-from participant import Participant, ParticipantEncoder
+import sys, json
+from multiprocessing import freeze_support
+from engine import run_analysis, preview_folder
+from server import serve
+from batch import run_batch, find_session_folders
+from live import watch, DEFAULT_INTERVAL
+from shards import parse_shard, run_shard, merge_partials
 
 # This program is to be run within the context of the GUI provided
 # If this program runs on its own, it will (likely) fail as it depends
 # on information provided to it by the GUI.
 if __name__ == '__main__':
+    # Needed so the frozen 'analyze' binary can start worker processes when config['workers'] > 1
+    freeze_support()
+
     # Get directory path from Electron (submitted by the user as arguments to cmd line)
     n = len(sys.argv)
 
+    # Long-lived mode: requests arrive as JSON lines on stdin (see server.py)
+    if n > 1 and sys.argv[1] == "--serve":
+        serve()
+        sys.exit(0)
+
+    # Many folders at once: a root to search for session folders, or a JSON list of folders (see batch.py)
+    if n > 1 and sys.argv[1] == "--batch":
+        folders = json.loads(sys.argv[2]) if sys.argv[2].startswith("[") else find_session_folders(sys.argv[2])
+        response = run_batch(folders, str(sys.argv[3]), json.loads(sys.argv[4]))
+        json.dump(response, sys.stdout)
+        sys.stdout.flush()
+        sys.exit(0)
+
+    # Quick look at a folder (headers and phase markers), before analyzing it (see preview.py)
+    if n > 1 and sys.argv[1] == "--preview":
+        json.dump(preview_folder(str(sys.argv[2])), sys.stdout)
+        sys.stdout.flush()
+        sys.exit(0)
+
+    # Live view of sessions still being recorded, one JSON line per update (see live.py)
+    if n > 1 and sys.argv[1] == "--watch":
+        arguments = [argument for argument in sys.argv[2:] if argument != "--until-done"]
+        try:
+            interval = float(arguments[2]) if len(arguments) > 2 else DEFAULT_INTERVAL
+            watch(arguments[0], json.loads(arguments[1]), interval, until_done="--until-done" in sys.argv)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    # One shard of a folder analyzed into a partial result file, and the merge of the partials (see shards.py)
+    if n > 1 and sys.argv[1] == "--shard":
+        shard_index, shard_count = parse_shard(sys.argv[2])
+        partial_path = str(sys.argv[5]) if n > 5 else None
+        json.dump(run_shard(str(sys.argv[3]), json.loads(sys.argv[4]), shard_index, shard_count, partial_path),
+                  sys.stdout)
+        sys.stdout.flush()
+        sys.exit(0)
+    if n > 1 and sys.argv[1] == "--merge":
+        arguments = sys.argv[3:]
+        merge_dir = None
+        if "--dir" in arguments:
+            merge_dir = arguments[arguments.index("--dir") + 1]
+            arguments = arguments[:arguments.index("--dir")] + arguments[arguments.index("--dir") + 2:]
+        json.dump(merge_partials(arguments, str(sys.argv[2]), merge_dir), sys.stdout)
+        sys.stdout.flush()
+        sys.exit(0)
+
     # All this information is received from Electron
     dir_path = str(sys.argv[1])
     analysis_type = str(sys.argv[2])
 
     config = json.loads(sys.argv[3])
-    participant_files = os.listdir(dir_path)
-
-    # Get time taken
-    start = time.time()
-    engine = AnalysisEngine(dir_path, config)
-    engine.produce_summary(analysis_type)
-    end = time.time() - start
 
-    response = {
-        "message": "Done",
-        "files_processed": engine.files_processed,
-        "duration": round(end, 4),
-        "out_file": engine.out_path,
-        "excluded": int(len(engine.excluded_participants))
-    }
+    response = run_analysis(dir_path, analysis_type, config)
 
     json.dump(response, sys.stdout)
     sys.stdout.flush()
@@ -0,0 +1,68 @@
+import os, mmap
+from parsing import parse_mapped_header
+from binning import END_OF_PHASE_1, END_OF_PHASE_2, END_OF_SESSION
+
+# Quick look at a session file without parsing its events: the header block is read and parsed (with
+# parsing.parse_mapped_header, like the analysis of a mapped file), and the 30/31/99 markers are found with a byte
+# search across the whole mapped file, past the header (30/31 from the start, 99 from the end, where it is written),
+# so the GUI can learn about a folder (see engine.preview_folder) before running the analysis. The events are only
+# parsed by the analysis, which reads the file again.
+
+
+class SessionPreview:
+    __slots__ = ('dir_path', 'file_path', 'error', 'malformed', 'no_phase_1', 'sr', 'event_list', 'markers')
+
+    def __init__(self, dir_path, file_path):
+        self.dir_path = dir_path
+        self.file_path = file_path
+        self.error = None
+        # The file does not begin with 'Start:'
+        self.malformed = False
+        self.no_phase_1 = None
+        self.sr = []
+        self.event_list = []
+        # Whether each of the 30, 31 and 99 markers is in the file
+        self.markers = {END_OF_PHASE_1: False, END_OF_PHASE_2: False, END_OF_SESSION: False}
+
+        try:
+            self.__scan(os.path.join(dir_path, file_path))
+        except (OSError, ValueError) as err:
+            self.error = str(err)
+
+    def __scan(self, path):
+        with open(path, "rb") as file:
+            # mmap can't map an empty file, which doesn't begin with 'Start:' either
+            if os.fstat(file.fileno()).st_size == 0:
+                self.malformed = True
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                # The same header parse as the analysis of a mapped file
+                header, events_start = parse_mapped_header(mapped)
+                if header is None:
+                    self.malformed = True
+                    return
+                self.no_phase_1 = header.no_phase_1
+                self.sr = header.sr
+                self.event_list = header.event_list
+
+                # From the line end before the first event line, so the list of events is never searched
+                events_start = max(events_start - 1, 0)
+                self.markers[END_OF_PHASE_1] = mapped.find(b"\n30)", events_start) != -1
+                self.markers[END_OF_PHASE_2] = mapped.find(b"\n31)", events_start) != -1
+                self.markers[END_OF_SESSION] = mapped.rfind(b"\n99)", events_start) != -1
+
+    # Markers missing from the file. The analysis reconstructs a missing 30/31 from the bin settings unless the GUI
+    # asks for the phase durations, and a file without 99 is a cut-off session
+    def missing_markers(self):
+        return [code for (code, found) in self.markers.items() if not found]
+
+    def to_dict(self):
+        return {
+            'file': self.file_path,
+            'error': self.error,
+            'malformed': self.malformed,
+            'no_phase_1': self.no_phase_1,
+            'sr': self.sr,
+            'event_list': self.event_list,
+            'missing_markers': self.missing_markers() if not (self.malformed or self.error) else [],
+        }
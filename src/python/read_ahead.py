@@ -0,0 +1,62 @@
+import time
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import cache
+
+# Read-ahead of session files, for study folders on network shares where every file costs a round trip.
+# While a participant is analyzed, the next files are already being read on a small thread pool (the reads wait on
+# the share, not on the CPU, so threads are enough), and the analysis only parses what was read.
+#   config['read_ahead']     files read ahead of the analysis, DEFAULT_DEPTH by default, 0 reads every file only
+#                            when its participant is analyzed
+#   config['read_latency']   seconds added to every read, to try the read-ahead on a local folder as if it were on a
+#                            slow share (see python benchmark.py --read-ahead)
+# With a cache (see cache.py) the read is of the cache entry, and the file itself is only read when it changed.
+
+DEFAULT_DEPTH = 8
+
+
+# Reads one file (or its cache entry). 'entry' is the os.DirEntry of the file when the folder listing has it,
+# so its stat is reused instead of taken again
+def fetch(dir_path, file_path, config, entry=None):
+    latency = config.get('read_latency')
+    if latency:
+        time.sleep(latency)
+    stat = entry.stat() if entry is not None and config.get('cache', True) else None
+    return cache.fetch_session(dir_path, file_path, config, stat)
+
+
+# Yields (file_path, load_session) for every file, in file_paths order, with up to config['read_ahead'] files read
+# ahead. load_session() returns the file's (header, codes, times), or raises what reading or parsing it raised, so a
+# file that fails doesn't stop the files after it. 'entries' (optional) maps file paths to their os.DirEntry
+def read_sessions(dir_path, file_paths, config, entries=None):
+    entries = entries or {}
+    depth = min(config.get('read_ahead', DEFAULT_DEPTH), len(file_paths))
+    if depth <= 0:
+        for file_path in file_paths:
+            yield file_path, partial(_read_now, dir_path, file_path, config, entries.get(file_path))
+        return
+
+    executor = ThreadPoolExecutor(max_workers=depth)
+    try:
+        pending = deque()
+        next_file = 0
+        while next_file < len(file_paths) or pending:
+            while next_file < len(file_paths) and len(pending) < depth:
+                file_path = file_paths[next_file]
+                pending.append((file_path, executor.submit(fetch, dir_path, file_path, config,
+                                                           entries.get(file_path))))
+                next_file += 1
+            file_path, future = pending.popleft()
+            yield file_path, partial(_read_ahead, dir_path, file_path, config, future)
+    finally:
+        # Stopped early (e.g. cancelled): reads that haven't started are dropped
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _read_now(dir_path, file_path, config, entry):
+    return cache.finish_session(dir_path, file_path, config, fetch(dir_path, file_path, config, entry))
+
+
+def _read_ahead(dir_path, file_path, config, future):
+    return cache.finish_session(dir_path, file_path, config, future.result())
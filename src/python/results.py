@@ -0,0 +1,113 @@
+import base64
+import numpy as np
+from binning import count_dtype
+from summary import SummaryModel
+import cache
+
+# Compact per participant results for the GUI, instead of JSON dumps of whole Participant objects.
+# An analyze request to the server (see server.py) with "results": true, or {"chunk_size": ..., "events": true},
+# gets its participants back as {"id": ..., "results": <chunk>} lines ahead of its response, CHUNK_SIZE
+# participants (summarized and auto excluded ones alike) per chunk, so the GUI can render a large cohort as it
+# comes in. A chunk is columnar:
+#   chunk, chunks            position of the chunk, and how many there are
+#   first                    index of the chunk's first participant
+#   event_list               [[code, event type], ...] of the counts' second axis
+#   files, excluded, exclusion_reason, event_99_detected, sr, bin_phase_2    one value per participant
+#   counts                   (participants, events, 3 phases, bins)
+#   phases_duration          (participants, 3), ms
+#   phase_3_latency          (participants, 4), ms, -1000 when there was no response
+#   events                   only asked for with "events": true, per participant {'codes', 'times'} of its session
+# Arrays are typed arrays: {'type': 'Uint8Array' | 'Int16Array' | ..., 'shape': [...], 'data': <base64>}, the data
+# being the little endian values in row-major order, ready for new <type>(buffer) on the GUI side.
+
+CHUNK_SIZE = 500
+
+TYPED_ARRAYS = {'int8': 'Int8Array', 'uint8': 'Uint8Array', 'int16': 'Int16Array', 'uint16': 'Uint16Array',
+                'int32': 'Int32Array', 'uint32': 'Uint32Array', 'float32': 'Float32Array', 'float64': 'Float64Array'}
+
+
+# A typed array of 'array'. 64 bit integers (which would need BigInt on the GUI side) are sent as Int32Array when
+# they fit, as Float64Array otherwise
+def typed_array(array):
+    array = np.asarray(array)
+    if array.dtype == np.bool_:
+        array = array.astype(np.uint8)
+    elif array.dtype.kind in 'iu' and array.dtype.name not in TYPED_ARRAYS:
+        fits = array.size == 0 or (array.min() >= np.iinfo(np.int32).min and array.max() <= np.iinfo(np.int32).max)
+        array = array.astype(np.int32 if fits else np.float64)
+    elif array.dtype.name not in TYPED_ARRAYS:
+        array = array.astype(np.float64)
+    data = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<')).tobytes()
+    return {'type': TYPED_ARRAYS[array.dtype.name], 'shape': list(array.shape),
+            'data': base64.b64encode(data).decode('ascii')}
+
+
+# One participant's results (see participant.ParticipantEncoder), its counts per (event code - 1, phase, bin)
+def participant_record(participant):
+    type_response = getattr(participant, 'type_response', None)
+    return {
+        'file': participant.file_path,
+        'excluded': bool(participant.excluded),
+        'exclusion_reason': participant.exclusion_reason,
+        'event_99_detected': bool(participant.event_99_detected),
+        'sr': list(participant.sr),
+        'bin_phase_2': _optional_int(participant.bin_phase_2),
+        'phases_duration': [int(duration) for duration in participant.phases_duration],
+        'phase_3_latency': [int(latency) for latency in participant.phase_3_latency],
+        'counts': typed_array(type_response) if type_response is not None else None,
+    }
+
+
+# Splits participants into the chunks described above. 'config' (the engine's) is only needed with events, to
+# read the sessions again (analyzed participants don't keep their events)
+def result_chunks(participants, event_list, chunk_size=CHUNK_SIZE, events=False, config=None):
+    chunk_size = max(1, chunk_size)
+    num_chunks = (len(participants) + chunk_size - 1) // chunk_size
+    for i in range(num_chunks):
+        part = participants[i * chunk_size:(i + 1) * chunk_size]
+        model = SummaryModel([part], event_list)
+        counts = model.counts.astype(count_dtype(model.counts.max(initial=0)))
+        chunk = {
+            'chunk': i,
+            'chunks': num_chunks,
+            'first': i * chunk_size,
+            'event_list': [[key, event_type] for (key, event_type) in event_list],
+            'files': [participant.file_path for participant in part],
+            'excluded': [bool(participant.excluded) for participant in part],
+            'exclusion_reason': [participant.exclusion_reason for participant in part],
+            'event_99_detected': [bool(participant.event_99_detected) for participant in part],
+            'sr': [list(participant.sr) for participant in part],
+            'bin_phase_2': [_optional_int(participant.bin_phase_2) for participant in part],
+            'counts': typed_array(counts),
+            'phases_duration': typed_array(model.phases_duration),
+            'phase_3_latency': typed_array(model.phase_3_latency),
+        }
+        if events:
+            chunk['events'] = [session_events(participant, config) for participant in part]
+        yield chunk
+
+
+def session_events(participant, config):
+    _, codes, times = cache.load_session(participant.dir_path, participant.file_path, config)
+    return {'codes': typed_array(codes), 'times': typed_array(times)}
+
+
+# Sends the results of a run through 'send' (called with every chunk), as asked for by the request's "results"
+class ResultSender:
+    def __init__(self, send, options=True):
+        options = options if isinstance(options, dict) else {}
+        self.send = send
+        self.chunk_size = options.get('chunk_size', CHUNK_SIZE)
+        self.events = bool(options.get('events', False))
+
+    # Returns the number of chunks sent
+    def send_participants(self, participants, event_list, config):
+        num_chunks = 0
+        for chunk in result_chunks(participants, event_list, self.chunk_size, self.events, config):
+            self.send(chunk)
+            num_chunks += 1
+        return num_chunks
+
+
+def _optional_int(value):
+    return None if value is None else int(value)
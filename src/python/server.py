@@ -0,0 +1,124 @@
+import os, sys, json, threading
+from concurrent.futures import ThreadPoolExecutor
+from engine import run_analysis, preview_folder, AnalysisCancelled
+from results import ResultSender
+import cache
+
+# Long-lived analysis server, started by the GUI with 'analyze --serve' (see performAnalysisOnFolder.py).
+# Imports, and the sessions parsed by earlier runs (cache.keep_warm), stay in memory between requests.
+#
+# Requests are JSON objects, one per line on stdin, each with an 'id' chosen by the GUI:
+#   {"id": "1", "command": "analyze", "dir_path": "...", "analysis": "targetAltControl", "config": {...}}
+#   {"id": "2", "command": "cancel", "job": "1"}
+#   {"id": "3", "command": "preview", "dir_path": "..."}
+#   {"id": "4", "command": "ping"}
+#   {"id": "5", "command": "shutdown"}
+# Every request gets exactly one JSON line back on stdout carrying the same 'id'. For 'analyze' that is the
+# response performAnalysisOnFolder.py prints, {"error": ...} if the run failed, or {"cancelled": true}. 'preview'
+# answers with engine.preview_folder() right away, it only reads the headers of the session files.
+# An 'analyze' request with "results": true (or {"chunk_size": ..., "events": true}) also gets the participants'
+# results, as {"id": ..., "results": <chunk>} lines ahead of its response (see results.py).
+# Analyze jobs on the same folder run one after the other, and a cancelled job writes nothing once it sees the
+# cancellation, so the summaries in out/ are always those of the last job that wasn't cancelled.
+
+MAX_CONCURRENT_JOBS = 2
+# Bytes of event arrays the sessions kept in memory can take, the least recently used ones are dropped past it
+MAX_WARM_BYTES = 512 * 1024 * 1024
+
+
+class AnalysisServer:
+    def __init__(self, input_stream, output_stream):
+        self.input_stream = input_stream
+        self.output_stream = output_stream
+        self.output_lock = threading.Lock()
+        self.jobs = {}  # job id -> threading.Event set on cancellation
+        self.jobs_lock = threading.Lock()
+        # Jobs on the same folder run one at a time, so a cancelled job still writing its summaries is done before
+        # the job that superseded it writes the same files
+        self.folder_locks = {}  # absolute dir_path -> threading.Lock
+        self.executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS)
+
+    def send(self, message):
+        with self.output_lock:
+            self.output_stream.write(json.dumps(message) + "\n")
+            self.output_stream.flush()
+
+    # Reads requests until 'shutdown' or end of input, then waits for the running jobs
+    def serve_forever(self):
+        for line in self.input_stream:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as err:
+                self.send({"id": None, "error": repr(err)})
+                continue
+
+            command = request.get("command")
+            if command == "shutdown":
+                self.send({"id": request.get("id"), "message": "Shutting down"})
+                break
+            elif command == "analyze":
+                self.start_job(request)
+            elif command == "cancel":
+                self.cancel_job(request)
+            elif command == "preview":
+                self.preview(request)
+            elif command == "ping":
+                self.send({"id": request.get("id"), "message": "pong"})
+            else:
+                self.send({"id": request.get("id"), "error": f"Unknown command '{command}'"})
+
+        self.executor.shutdown(wait=True)
+
+    def start_job(self, request):
+        job_id = request.get("id")
+        cancelled = threading.Event()
+        with self.jobs_lock:
+            if job_id in self.jobs:
+                self.send({"id": job_id, "error": f"Job '{job_id}' is already running"})
+                return
+            self.jobs[job_id] = cancelled
+        self.executor.submit(self.run_job, job_id, request, cancelled)
+
+    def run_job(self, job_id, request, cancelled):
+        try:
+            if cancelled.is_set():
+                raise AnalysisCancelled()
+            results = None
+            if request.get("results"):
+                results = ResultSender(lambda chunk: self.send({"id": job_id, "results": chunk}), request["results"])
+            with self.folder_lock(request["dir_path"]):
+                response = run_analysis(request["dir_path"], request["analysis"], request["config"],
+                                        cancelled.is_set, results)
+        except AnalysisCancelled:
+            response = {"cancelled": True}
+        except Exception as err:
+            response = {"error": repr(err), "config": repr(request.get("config"))}
+        finally:
+            with self.jobs_lock:
+                self.jobs.pop(job_id, None)
+        self.send({"id": job_id, **response})
+
+    def folder_lock(self, dir_path):
+        with self.jobs_lock:
+            return self.folder_locks.setdefault(os.path.abspath(dir_path), threading.Lock())
+
+    def preview(self, request):
+        try:
+            response = preview_folder(request["dir_path"])
+        except Exception as err:
+            response = {"error": repr(err)}
+        self.send({"id": request.get("id"), **response})
+
+    def cancel_job(self, request):
+        with self.jobs_lock:
+            cancelled = self.jobs.get(request.get("job"))
+        if cancelled is not None:
+            cancelled.set()
+        self.send({"id": request.get("id"), "message": "Cancelling" if cancelled is not None else "No such job"})
+
+
+def serve(input_stream=sys.stdin, output_stream=sys.stdout):
+    cache.keep_warm(MAX_WARM_BYTES)
+    AnalysisServer(input_stream, output_stream).serve_forever()
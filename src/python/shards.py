@@ -0,0 +1,152 @@
+import os, json, time
+from engine import AnalysisEngine, AnalysisCancelled, FailedFile, session_entries, engine_config, \
+    iter_participants, summary_response
+from manifest import make_entry, analysis_config, StoredParticipant
+from latency import latency_needed
+
+# Sharded runs, to analyze one big folder on several machines (or several processes of one):
+#   python performAnalysisOnFolder.py --shard <i>/<N> <dir_path> '<config json>' [partial path]
+# analyzes shard i (0 based) of N of the folder's session files, a contiguous run of them in session_files() order,
+# and writes a partial result file, by default <dir_path>/out/shards/shard-<i>-of-<N>.json. Then
+#   python performAnalysisOnFolder.py --merge <analysis_type> <partial paths, or folders of them> [--dir <dir_path>]
+# writes the summaries of every analysis of analysis_type from all N partials, the same files a single run of the
+# folder with that config would write (exclusion summary included). They go in <dir_path>/out/, dir_path being
+# the one the shards ran on unless --dir says otherwise, so the merge doesn't need the session files.
+# To try it on one box:
+#   for i in 0 1 2 3; do python performAnalysisOnFolder.py --shard $i/4 <dir_path> '<config json>' & done; wait
+#   python performAnalysisOnFolder.py --merge targetAltControl <dir_path>/out/shards
+# A partial holds the config and file list of the run, one incremental manifest entry (see manifest.py) per
+# participant of the shard, and the errors of the shard's files that couldn't be analyzed (see engine.FailedFile).
+
+PARTIAL_VERSION = 1
+
+
+# (shard index, shard count) of an 'i/N' spec. Raises ValueError unless 0 <= i < N
+def parse_shard(spec):
+    try:
+        shard_index, shard_count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard should be given as <index>/<count>, got '{spec}'")
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Shard index should be from 0 to {shard_count - 1}, got {shard_index}")
+    return shard_index, shard_count
+
+
+# The files of shard shard_index of shard_count, a contiguous run of file_paths (sizes differ by one at most)
+def shard_files(file_paths, shard_index, shard_count):
+    return file_paths[shard_index * len(file_paths) // shard_count:(shard_index + 1) * len(file_paths) // shard_count]
+
+
+def default_partial_path(dir_path, shard_index, shard_count):
+    return os.path.join(dir_path, "out", "shards", f"shard-{shard_index}-of-{shard_count}.json")
+
+
+# Analyzes one shard of dir_path and writes its partial. config is the GUI's, like for run_analysis
+def run_shard(dir_path, config, shard_index, shard_count, partial_path=None, is_cancelled=None):
+    if 'sweep' in config or config.get('incremental') or config.get('event_store') or config.get('output') == 'long':
+        raise ValueError("Sharded runs don't support 'sweep', 'incremental', 'event_store' or long output")
+
+    start = time.time()
+    entries = {entry.name: entry for entry in session_entries(dir_path)}
+    file_paths = list(entries)
+    shard = shard_files(file_paths, shard_index, shard_count)
+    participants = list(iter_participants(dir_path, shard, engine_config(config), is_cancelled, entries=entries))
+    errors = [participant.to_dict() for participant in participants if isinstance(participant, FailedFile)]
+    partial = {
+        'version': PARTIAL_VERSION,
+        'dir_path': os.path.abspath(dir_path),
+        'shard': [shard_index, shard_count],
+        'config': config,
+        'files': file_paths,
+        'participants': [make_entry(participant, entries[participant.file_path].stat())
+                         for participant in participants if not isinstance(participant, FailedFile)],
+        'errors': errors,
+    }
+
+    partial_path = partial_path or default_partial_path(dir_path, shard_index, shard_count)
+    os.makedirs(os.path.dirname(os.path.abspath(partial_path)), exist_ok=True)
+    temp_path = f"{partial_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as partial_file:
+        json.dump(partial, partial_file)
+    os.replace(temp_path, partial_path)
+    response = {
+        "message": "Done",
+        "shard": [shard_index, shard_count],
+        "files_processed": len(shard) - len(errors),
+        "duration": round(time.time() - start, 4),
+        "partial_file": partial_path,
+    }
+    if errors:
+        response["errors"] = errors
+    return response
+
+
+# The partial files among paths, folders standing for the .json files in them
+def partial_paths_of(paths):
+    partial_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            partial_paths += sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".json"))
+        else:
+            partial_paths.append(path)
+    return partial_paths
+
+
+# Loads the partials and checks they make up one whole run: same version, config and file list, and every shard
+# exactly once. Raises ValueError otherwise
+def load_partials(partial_paths):
+    partials = []
+    for path in partial_paths:
+        with open(path, "r") as partial_file:
+            partial = json.load(partial_file)
+        if partial.get('version') != PARTIAL_VERSION:
+            raise ValueError(f"{path} is not a partial result file of this version")
+        partials.append(partial)
+    if not partials:
+        raise ValueError("No partial result files to merge")
+
+    first = partials[0]
+    shard_count = first['shard'][1]
+    for partial in partials[1:]:
+        if analysis_config(partial['config']) != analysis_config(first['config']):
+            raise ValueError("Partials were analyzed with different configs")
+        if partial['files'] != first['files'] or partial['shard'][1] != shard_count:
+            raise ValueError("Partials are from different runs (file lists or shard counts differ)")
+
+    shards = sorted(partial['shard'][0] for partial in partials)
+    if len(set(shards)) != len(shards):
+        raise ValueError("Some shards were given more than once")
+    missing = sorted(set(range(shard_count)) - set(shards))
+    if missing:
+        raise ValueError(f"Missing shards {', '.join(map(str, missing))} of {shard_count}")
+    return sorted(partials, key=lambda partial: partial['shard'][0])
+
+
+# Writes the summaries of analysis_type from the partials, returns the response of a single run
+def merge_partials(partial_paths, analysis_type, dir_path=None, file_name=None, is_cancelled=None):
+    start = time.time()
+    partials = load_partials(partial_paths_of(partial_paths))
+    dir_path = dir_path or partials[0]['dir_path']
+
+    entries = [entry for partial in partials for entry in partial['participants']]
+    if latency_needed(partials[0]['config']) and any(entry['type_response'] is not None and
+                                                     entry.get('first_latency') is None for entry in entries):
+        raise ValueError("Some partials were analyzed without the latencies this config needs (latency_metrics, "
+                         "bootstrap), run their shards again with it")
+    participants = [StoredParticipant(dir_path, entry) for entry in entries]
+    errors = [error for partial in partials for error in partial['errors']]
+    failed = {error['file'] for error in errors}
+    analyzed_files = [file_path for file_path in partials[0]['files'] if file_path not in failed]
+    if [participant.file_path for participant in participants] != analyzed_files:
+        raise ValueError("Partials don't cover the run's files")
+    if is_cancelled is not None and is_cancelled():
+        raise AnalysisCancelled()
+
+    # The session files were read by the shards, nothing to cache
+    config = {**partials[0]['config'], 'cache': False, 'clear_cache': False}
+    engine = AnalysisEngine(dir_path, config, is_cancelled, participants, partials[0]['files'])
+    engine.produce_summary(analysis_type, file_name)
+    engine.errors = errors
+    response = summary_response(engine, time.time() - start)
+    response["shards"] = len(partials)
+    return response
@@ -0,0 +1,241 @@
+import os, csv
+import numpy as np
+from latency import (IRT_BIN_EDGES, FIRST_RESPONSE_CLASSES, DEFAULT_CONTROL_CODES, event_codes_of, rows_of,
+                     irt_bin_labels, classify_first_responses)
+
+latency_events = {
+    1: "Target Response",
+    2: "Alt Response",
+}
+
+
+# All participants of a run stacked into arrays once:
+#   counts[participant, event, phase, bin] for every event of the event list, in event list order
+#   responses[participant, event], the participant's binned events of each type, those in bins past the stored ones
+#   included (the counts summed up for participants that don't have it, e.g. read back from a long file)
+#   phases_duration[participant, phase] and phase_3_latency[participant, slot] (ms, -1000 when missing)
+#   first_latency[participant, event, phase] (ms, NaN when missing) and irt[participant, event, irt bin], see latency.py
+# Each group passed in (e.g. included and excluded participants) becomes a SummaryGroup whose arrays are
+# slices, i.e. views, of the stacked ones.
+class SummaryModel:
+    def __init__(self, participant_groups, event_list):
+        self.event_list = event_list
+        participants = [participant for group in participant_groups for participant in group]
+        event_rows = np.array([int(key) - 1 for (key, _) in event_list], dtype=np.int64)
+
+        num_bins = max([participant.type_response.shape[2] for participant in participants if
+                        getattr(participant, 'type_response', None) is not None] + [0])
+        self.counts = np.zeros((len(participants), len(event_list), 3, num_bins))
+        for i, participant in enumerate(participants):
+            type_response = getattr(participant, 'type_response', None)
+            # Participants without responses (malformed files) or without some of the event types stay at zero
+            if type_response is not None:
+                rows = event_rows < type_response.shape[0]
+                self.counts[i, rows, :, :type_response.shape[2]] = type_response[event_rows[rows]]
+        self.responses = self.counts.sum(axis=(2, 3))
+        for i, participant in enumerate(participants):
+            responses = getattr(participant, 'responses', None)
+            if responses is not None:
+                rows = event_rows < len(responses)
+                self.responses[i, rows] = responses[event_rows[rows]]
+
+        self.phases_duration = np.array([[int(duration) for duration in participant.phases_duration]
+                                         for participant in participants], dtype=np.int64).reshape(-1, 3)
+        self.phase_3_latency = np.array([participant.phase_3_latency for participant in participants],
+                                        dtype=np.int64).reshape(-1, 4)
+
+        event_codes = event_codes_of(event_list)
+        self.first_latency = np.full((len(participants), len(event_list), 3), np.nan)
+        self.irt = np.zeros((len(participants), len(event_list), len(IRT_BIN_EDGES)))
+        for i, participant in enumerate(participants):
+            if getattr(participant, 'first_latency', None) is None:
+                continue
+            # Matched by event code, in case a participant lists its events differently
+            rows = rows_of(event_codes_of(participant.event_list), event_codes)
+            listed = rows >= 0
+            self.first_latency[i, listed] = participant.first_latency[rows[listed]]
+            self.irt[i, listed] = participant.irt_histogram[rows[listed]]
+
+        self.groups = []
+        start = 0
+        for group in participant_groups:
+            self.groups.append(SummaryGroup(self, group, start, start + len(group)))
+            start += len(group)
+
+
+class SummaryGroup:
+    def __init__(self, model, participants, start, end):
+        self.participants = participants
+        self.counts = model.counts[start:end]
+        self.responses = model.responses[start:end]
+        self.phases_duration = model.phases_duration[start:end]
+        self.phase_3_latency = model.phase_3_latency[start:end]
+        self.first_latency = model.first_latency[start:end]
+        self.irt = model.irt[start:end]
+
+
+# Writes the summary csv of one group of participants. The exclusion summary lists every participant's
+# exclusion reason at the top, the main summary their SR info and cut-off state.
+# With config['latency_metrics'] the latency metrics section (write_latency_metrics) is added at the end.
+def write_summary(out_path, group, event_list, config, exclusion_summary=False):
+    if not os.path.exists(os.path.dirname(out_path)):
+        try:
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)  # Created dir if not exists, WILL overwrite previous
+        except OSError:  # Guard against very unlikely race condition
+            pass
+
+    participants = group.participants
+    n = len(participants)
+
+    def label(text):
+        return [text] * n
+
+    with open(out_path, "w+") as out_file:
+        writer = csv.writer(out_file)
+
+        # Write each row
+        writer.writerow([part.file_path[:-4] for part in participants])
+
+        if exclusion_summary:
+            writer.writerow([part.exclusion_reason for part in participants])
+        else:
+            writer.writerow([])
+            # Write SR info
+            writer.writerows([[str(part.sr[i]) if len(part.sr) > i else "no sr info" for part in participants]
+                              for i in range(4)])
+            writer.writerow([])
+
+            # Inform if has been cut off, if so, the rest of analysis should essentially be ignored, as it will be
+            # inaccurate
+            writer.writerow(label("Cut-off?"))
+            writer.writerow([part.exclusion_reason == "Cut-Off" for part in participants])
+
+        # Write events
+        bins_per_phase = (config["bin_num_phase_1"], config["bin_num_phase_2_max"], config["bin_num_phase_3"])
+        do_not_print = config.get('do_not_print')
+        for j, (key, event_type) in enumerate(event_list):
+            key = int(key)
+            if do_not_print and key in do_not_print:
+                continue
+
+            writer.writerow([])
+
+            # If no responses were recorded for this event, then we can just write "No responses". A type whose
+            # responses all fell in bins past the configured ones still gets its (zero) bins written
+            event_counts = group.counts[:, j]
+            if not np.any(group.responses[:, j]):
+                writer.writerow([f"No responses were recorded for type {event_type}"])
+                continue
+
+            # Write event name
+            writer.writerow(label(event_type))
+            for phase in [0, 1, 2]:
+                # Write phase number, then one row per bin
+                # If you want to cut off first X bins of a phase, slice from X instead of 0 below (0-indexed)
+                writer.writerow(label(f"Phase {phase + 1}"))
+                writer.writerows(event_counts[:, phase, 0:bins_per_phase[phase]].T.tolist())
+
+        writer.writerow([])
+        # Write phase durations
+        writer.writerow(label("Phase Durations"))
+        for phase in [0, 1, 2]:
+            writer.writerow(label(f"Phase {phase + 1}"))
+            writer.writerow([str(round(duration / 1000.0, 2)) for duration in group.phases_duration[:, phase].tolist()])
+
+        # Write 'OK' if '99)' was detected, 'Miss' if not
+        writer.writerow(label("99)"))
+        writer.writerow(["OK" if part.event_99_detected else "Miss" for part in participants])
+
+        # Empty Line
+        writer.writerow([])
+
+        # Write Latencies
+        writer.writerow(label("Latencies"))
+        for evt_type in latency_events.keys():  # 1 and 2
+            writer.writerow(label(latency_events[evt_type]))
+            writer.writerow([str(round(latency / 1000.0, 2)) if latency != -1000 else "None"
+                             for latency in group.phase_3_latency[:, evt_type - 1].tolist()])
+            # Empty Line
+            writer.writerow([])
+
+        count_target, all_invalid = phase_3_first_response_counts(group.phase_3_latency)
+
+        writer.writerows([
+            [f"Counts of {n} participant(s) in Phase 3"],
+            ["Target"],
+            [count_target],
+            [],
+            ["No target response in Phase 3"],
+            [all_invalid],
+            [],
+            ["Proportion in Phase 3"],
+            ["Target"],
+            [str(round(float(float(count_target) / n), 2))],
+        ])
+
+        if config.get('latency_metrics'):
+            write_latency_metrics(writer, group, event_list, config)
+
+
+# Per participant, whether the first phase 3 response (target vs the two controls) was the target, and whether
+# there was none of them in phase 3. Returns (target_first, none) boolean arrays
+def phase_3_target_first(phase_3_latency):
+    # Target, Control 1 and Control 2 slots, with the -1000 of a missing response as NaN
+    latency = phase_3_latency[:, [0, 2, 3]].astype(float)
+    latency[latency == -1000] = np.nan
+    none = np.all(np.isnan(latency), axis=1)
+    first = np.nanmin(np.where(none[:, None], 0, latency), axis=1)
+    return ~none & (first == latency[:, 0]), none
+
+
+# Counts the participants whose first phase 3 response (target vs the two controls) was the target,
+# and those with none of them in phase 3. Returns (count_target, all_invalid)
+def phase_3_first_response_counts(phase_3_latency):
+    target_first, none = phase_3_target_first(phase_3_latency)
+    return int(np.sum(target_first)), int(np.sum(none))
+
+
+# Latency metrics section: first latency of every event in every phase, inter-response time distributions, and
+# which came first in phase 3, the target or a control response (config['control_codes']), see latency.py
+def write_latency_metrics(writer, group, event_list, config):
+    participants = group.participants
+    n = len(participants)
+    do_not_print = config.get('do_not_print')
+
+    def label(text):
+        return [text] * n
+
+    writer.writerow([])
+    writer.writerow(label("First Response Latencies"))
+    for j, (key, event_type) in enumerate(event_list):
+        if do_not_print and int(key) in do_not_print:
+            continue
+        writer.writerow(label(event_type))
+        for phase in [0, 1, 2]:
+            writer.writerow(label(f"Phase {phase + 1}"))
+            writer.writerow(["None" if np.isnan(latency) else str(round(latency / 1000.0, 2))
+                             for latency in group.first_latency[:, j, phase].tolist()])
+
+    writer.writerow([])
+    writer.writerow(label("Inter-Response Times"))
+    for j, (key, event_type) in enumerate(event_list):
+        if do_not_print and int(key) in do_not_print:
+            continue
+        if not np.any(group.irt[:, j]):
+            writer.writerow([f"No inter-response times were recorded for type {event_type}"])
+            continue
+        writer.writerow(label(event_type))
+        for irt_bin, bin_label in enumerate(irt_bin_labels()):
+            writer.writerow(label(bin_label))
+            writer.writerow(group.irt[:, j, irt_bin].astype(np.int64).tolist())
+
+    classes = classify_first_responses(group.first_latency, event_codes_of(event_list),
+                                       config.get('control_codes', DEFAULT_CONTROL_CODES))
+    writer.writerow([])
+    writer.writerow(label("First Response in Phase 3"))
+    writer.writerow([FIRST_RESPONSE_CLASSES[first] for first in classes.tolist()])
+    writer.writerows([
+        ["Target first", int(np.sum(classes == 0))],
+        ["Control first", int(np.sum(classes == 1))],
+        ["No target or control response", int(np.sum(classes == 2))],
+    ])
@@ -0,0 +1,84 @@
+from itertools import product
+import numpy as np
+from participant import Participant, default_phase_ends
+from binning import END_OF_PHASE_1, END_OF_PHASE_2
+import cache
+
+# Parameter sweeps: config['sweep'] lists binning settings to analyze the same folder with, either as
+#   {'bin_size': [30, 60], 'bin_num_phase_1': [5, 10]}   -> every combination (grid)
+# or as a list of points
+#   [{'bin_size': 30, 'bin_num_phase_1': 10}, {'bin_size': 60, 'bin_num_phase_1': 5}]
+# Keys missing from a point keep their value from the base config. bin_size is in seconds, like the GUI sends it.
+# Each session file is parsed once for the whole sweep, and each distinct phase split is computed once, with only
+# the binning redone per point.
+
+SWEEP_KEYS = ('bin_size', 'bin_num_phase_1', 'bin_num_phase_2_max', 'bin_num_phase_3')
+
+
+def grid_points(sweep):
+    if isinstance(sweep, dict):
+        keys = list(sweep.keys())
+        points = [dict(zip(keys, values)) for values in product(*(sweep[key] for key in keys))]
+    else:
+        points = list(sweep)
+
+    for point in points:
+        for key in point:
+            if key not in SWEEP_KEYS:
+                raise ValueError(f"'{key}' can't be swept, only {', '.join(SWEEP_KEYS)}")
+    return points
+
+
+# Engine config (bin_size already in ms) for one sweep point
+def point_config(config, point):
+    config = {key: value for (key, value) in config.items() if key != 'sweep'}
+    config.update(point)
+    if 'bin_size' in point:
+        config['bin_size'] = point['bin_size'] * 1000
+    return config
+
+
+# Name of a sweep point's summary file
+def point_label(config):
+    return (f"bin_{config['bin_size'] / 1000:g}s_p1_{config['bin_num_phase_1']}_"
+            f"p2_{config['bin_num_phase_2_max']}_p3_{config['bin_num_phase_3']}")
+
+
+# The phase split only depends on the bin settings through the 30/31 markers reconstructed from them
+def phase_key(markers_found, config):
+    phase_1_timestamp, phase_2_timestamp = default_phase_ends(config)
+    return (None if markers_found[0] else phase_1_timestamp, None if markers_found[1] else phase_2_timestamp)
+
+
+# Analyzes one session file for every sweep point of config['sweep'].
+# Returns one Participant per point, in grid_points() order.
+def analyze_grid(dir_path, file_path, config, session=None):
+    if session is None:
+        session = cache.load_session(dir_path, file_path, config)
+    codes = session[1]
+    markers_found = (True, True) if codes is None else (
+        bool(np.any(codes == END_OF_PHASE_1)), bool(np.any(codes == END_OF_PHASE_2)))
+
+    participants = []
+    by_phase_key = {}
+    for point in grid_points(config['sweep']):
+        this_config = point_config(config, point)
+        key = phase_key(markers_found, this_config)
+        if key in by_phase_key:
+            participants.append(by_phase_key[key].rebinned(this_config))
+        else:
+            by_phase_key[key] = Participant(dir_path, file_path, this_config, session, keep_events=True)
+            participants.append(by_phase_key[key])
+
+    for participant in participants:
+        participant.release_events()
+    return participants
+
+
+# The participants of one sweep point, split like the engine splits them
+class SweepPoint:
+    def __init__(self, config, participants, excluded_participants):
+        self.config = config
+        self.label = point_label(config)
+        self.participants = participants
+        self.excluded_participants = excluded_participants
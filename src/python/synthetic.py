@@ -0,0 +1,81 @@
+import os, sys
+import numpy as np
+
+# Writes synthetic session files in the format parsing.py reads (and the operant boxes produce):
+#   'Start:' line, subject/noPhase1/SR lines, 'LIST OF EVENTS' block ended by a blank line, then 'NN) time' lines.
+# Used by benchmark.py, and handy to try the analysis without study data:
+#   python synthetic.py <dir_path> <participants> [seed]
+
+EVENT_LIST = [("01", "Target Response"), ("02", "Alt Response"), ("03", "Control 1"), ("04", "Control 2"),
+              ("17", "SR Target"), ("18", "SR Alt"), ("30", "End of Phase 1"), ("31", "End of Phase 2"),
+              ("99", "End of Session")]
+
+RESPONSE_CODES = np.array([1, 2, 3, 4])
+# Event lines formatted and written at once, so multi-million-event sessions don't build every line in memory
+WRITE_BATCH = 100000
+
+# Relative rates of target, alt and the two control responses in each phase
+RESPONSE_WEIGHTS = (
+    (5, 3, 1, 1),  # Phase 1, target reinforced
+    (1, 3, 1, 1),  # Phase 2, alt reinforced
+    (3, 3, 1, 1),  # Phase 3, test
+)
+
+
+# One session file.
+#   phase_lengths: (phase 1, phase 2, phase 3) in ms
+#   response_rate: mean responses per second (each participant draws its own, between 0.2 and 1.5 times this)
+#   markers: whether the 30, 31 and 99 markers are written
+def write_session(path, rng, phase_lengths=(300000, 300000, 300000), response_rate=1.0, markers=(True, True, True),
+                  no_phase_1=False):
+    lines = ["Start: 01/01/2023 10:00:00\n", f"Subject: {os.path.splitext(os.path.basename(path))[0]}\n",
+             f"noPhase1: {int(no_phase_1)}\n", "totalSR: 12\n", "srPhase1: 5\n", "srPhase2: 4\n", "srPhase3: 3\n",
+             "LIST OF EVENTS\n"]
+    lines += [f"{code}: {name}\n" for (code, name) in EVENT_LIST]
+    lines += ["\n", "Time,Event\n"]
+
+    codes, times = [], []
+    phase_start = int(rng.integers(0, 20000))
+    if not no_phase_1:
+        codes.append([17])
+        times.append([phase_start])
+    phase_ends = np.cumsum(phase_lengths) + phase_start
+    for phase, phase_end in enumerate(phase_ends):
+        num_responses = int((phase_end - phase_start) / 1000 * response_rate * rng.uniform(0.2, 1.5))
+        weights = np.array(RESPONSE_WEIGHTS[phase], dtype=float)
+        codes.append(rng.choice(RESPONSE_CODES, size=num_responses, p=weights / weights.sum()))
+        times.append(rng.integers(phase_start, phase_end, size=num_responses))
+        num_srs = int(rng.integers(0, 5))
+        codes.append(rng.choice([17, 18], size=num_srs))
+        times.append(rng.integers(phase_start, phase_end, size=num_srs))
+        phase_start = phase_end
+    for marker, code, time in zip(markers, (30, 31, 99), phase_ends):
+        if marker:
+            codes.append([code])
+            times.append([time])
+
+    codes = np.concatenate(codes).astype(np.int64)
+    times = np.concatenate(times).astype(np.int64)
+    order = np.argsort(times, kind='stable')
+    codes, times = codes[order], times[order]
+    with open(path, "w") as session_file:
+        session_file.writelines(lines)
+        for start in range(0, len(codes), WRITE_BATCH):
+            session_file.writelines(f"{code:02d}) {time}\n" for (code, time) in
+                                    zip(codes[start:start + WRITE_BATCH].tolist(),
+                                        times[start:start + WRITE_BATCH].tolist()))
+    return len(codes)
+
+
+# A folder of 'participants' session files named P00000.csv, P00001.csv, ... Returns the number of events written.
+# The other arguments are passed on to write_session().
+def generate_folder(dir_path, participants, seed=0, **session_options):
+    os.makedirs(dir_path, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    return sum(write_session(os.path.join(dir_path, f"P{i:05d}.csv"), rng, **session_options)
+               for i in range(participants))
+
+
+if __name__ == '__main__':
+    num_events = generate_folder(str(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) > 3 else 0)
+    print(f"{sys.argv[2]} session files, {num_events} events written to {sys.argv[1]}")
@@ -1,20 +1,55 @@
-import json
-import os
-from participant import Participant, ParticipantEncoder
-from engine import AnalysisEngine
+import os, shutil, tempfile
+import numpy as np
+from participant import Participant
+from engine import run_analysis, engine_config
+from synthetic import generate_folder
 
+# Quick end to end check of the analysis on a synthetic folder (see synthetic.py), no study data needed:
+#   python test.py
+# Runs every analysis with a config like the GUI's (and with a fractional phases_duration override), and analyzes
+# single participants with the engine's config.
+
+CONFIG = {'bin_size': 60, 'bin_num_phase_1': 5, 'bin_num_phase_2_max': 5, 'bin_num_phase_3': 5}
+
+
+def check_analyses(dir_path):
+    for analysis_type in ('targetAltControl', 'cuePairing'):
+        response = run_analysis(dir_path, analysis_type, {**CONFIG, 'cache': False})
+        assert response['message'] == "Done", response
+        assert os.path.isfile(response['out_file']), f"{analysis_type} wrote no summary"
+        assert 'errors' not in response, response['errors']
 
-def main():
-    dir_path = "/Users/matthewlamperski/Desktop/-1000 (7-8)"
-    participant_files = os.listdir(dir_path)
-    participants = []
-    # participant1 = Participant(dir_path, participant_files[0])
 
-    engine = AnalysisEngine(dir_path)
-    engine.produce_summary()
+# The GUI's phases_duration override is a number input, so the phase durations can be fractional
+def check_fractional_override(dir_path):
+    config = {**CONFIG, 'cache': False, 'phases_duration': [300000.5, 299999.75, 300000.25]}
+    response = run_analysis(dir_path, 'targetAltControl', config)
+    assert 'errors' not in response, response['errors']
+    participant = Participant(dir_path, "P00000.csv", engine_config(config))
+    assert int(np.sum(participant.type_response)) > 0
 
-    # for file_path in participant_files:
-    #     participants.append(Participant(dir_path, file_path))
+
+def check_participants(dir_path):
+    config = engine_config({**CONFIG, 'cache': False})
+    for file_path in sorted(os.listdir(dir_path)):
+        if not file_path.endswith(".csv"):
+            continue
+        participant = Participant(dir_path, file_path, config)
+        assert participant.event_99_detected, file_path
+        assert int(np.sum(participant.type_response)) > 0, file_path
+
+
+def main():
+    dir_path = tempfile.mkdtemp(prefix="test_")
+    try:
+        generate_folder(dir_path, 10)
+        check_participants(dir_path)
+        check_analyses(dir_path)
+        check_fractional_override(dir_path)
+    finally:
+        shutil.rmtree(dir_path, ignore_errors=True)
+    print("OK")
 
 
-main()
+if __name__ == '__main__':
+    main()
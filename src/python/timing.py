@@ -0,0 +1,64 @@
+import time
+import numpy as np
+
+# Per stage timings of a run, returned under 'timings' in the response when config['timings'] is set.
+#   engine stages (wall clock):       listing, participants (parse + analysis of every file), summary
+#   participant stages (per file):    parse, analysis (phase split and binning), exclusion
+# Participant stages are aggregated over the files as total, p50 and p95, and the slowest files are listed
+# (config['timings_slowest'], 5 by default).
+# With timings off every stage clock is a NullClock, so the only cost left is a no-op call per stage.
+
+DEFAULT_SLOWEST = 5
+
+
+# Measures consecutive stages: lap('parse') adds the time since the previous lap (or since the clock was made)
+class StageClock:
+    def __init__(self):
+        self.stages = {}
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.last
+        self.last = now
+
+
+class NullClock:
+    stages = None
+
+    def lap(self, stage):
+        pass
+
+
+def stage_clock(config):
+    return StageClock() if config.get('timings') else NullClock()
+
+
+def summarize(engine_stages, participants, slowest=DEFAULT_SLOWEST):
+    timed = [participant for participant in participants if getattr(participant, 'timings', None) is not None]
+    participant_stages = {}
+    for stage in ('parse', 'analysis', 'exclusion'):
+        durations = np.array([participant.timings.get(stage, 0.0) for participant in timed])
+        participant_stages[stage] = _aggregate(durations)
+
+    totals = np.array([sum(participant.timings.values()) for participant in timed])
+    participant_stages['total'] = _aggregate(totals)
+    slowest_files = [{'file': timed[i].file_path, 'seconds': round(float(totals[i]), 6)}
+                     for i in np.argsort(-totals, kind='stable')[:slowest]]
+
+    return {
+        'stages': {stage: round(seconds, 6) for (stage, seconds) in engine_stages.items()},
+        'participants_timed': len(timed),
+        'participant_stages': participant_stages,
+        'slowest_files': slowest_files,
+    }
+
+
+def _aggregate(durations):
+    if len(durations) == 0:
+        return {'total': 0.0, 'p50': None, 'p95': None}
+    return {
+        'total': round(float(durations.sum()), 6),
+        'p50': round(float(np.percentile(durations, 50)), 6),
+        'p95': round(float(np.percentile(durations, 95)), 6),
+    }
@@ -72,7 +72,6 @@ const TargetAltControl = ({setScreen}) => {
   }, [])
   useEffect(() => {
     window.api.receive('fromMain', (event, args) => {
-      console.log('Event received from main', JSON.stringify(event, null, 2))
       if (event[0] === 'dir selected') {
         setAnalyzing(true);
       } else if (event[0] === "error") {
@@ -340,6 +339,35 @@ const TargetAltControl = ({setScreen}) => {
                     textAlign: 'center',
                   }}>{`${finished.out_file}`}</u>
                 </div>
+                {
+                  finished.errors && finished.errors.length > 0 && (
+                    <div style={{
+                      marginTop: 15,
+                      display: 'flex',
+                      flexDirection: 'column',
+                      alignItems: 'flex-start',
+                      alignSelf: 'stretch',
+                      maxHeight: 150,
+                      overflow: 'scroll'
+                    }}>
+                      <h5 style={{
+                        color: '#d04b45',
+                        marginTop: 0,
+                        marginBottom: 5,
+                      }}>{`${finished.errors.length} ${finished.errors.length === 1 ? 'file' : 'files'} could not be analyzed and ${finished.errors.length === 1 ? 'was' : 'were'} left out:`}</h5>
+                      {
+                        finished.errors.map(failed => (
+                          <h5 key={failed.file} style={{
+                            color: colorScheme === 'dark' ? '#969696' : 'black',
+                            overflowWrap: 'anywhere',
+                            marginTop: 0,
+                            marginBottom: 2,
+                          }}>{`${failed.file}: ${failed.message || failed.error}`}</h5>
+                        ))
+                      }
+                    </div>
+                  )
+                }
               </>
             ) : err ? (
               <>